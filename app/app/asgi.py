@@ -9,8 +9,9 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
+# Django's handler, also streaming the recipe export
+from core.asgi import get_asgi_application  # noqa: E402
+
 application = get_asgi_application()
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
     'rest_framework',
     'rest_framework.authtoken',
@@ -45,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.timing.ServerTimingMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,16 +83,78 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Connections come from a pool per process and go back to it at the end
+# of each request, DB_POOL_MAX_SIZE=0 connects for every request instead
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.db.backends.postgresql',
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        'POOL': {
+            'MIN_SIZE': int(os.environ.get('DB_POOL_MIN_SIZE', 0)),
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+            # seconds to wait for a free connection
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'MAX_LIFETIME': int(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+            'MAX_IDLE': int(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+            # idle seconds after which a connection is pinged on checkout
+            'CHECK_AFTER': 10,
+        },
+    }
+}
+
+# Read replicas, comma separated hosts reached with the credentials of the
+# primary. Safe requests read from them, see core.db.replicas
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+    filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))
+):
+    DATABASES[f'replica{index}'] = dict(
+        DATABASES['default'],
+        HOST=host.strip(),
+        POOL=dict(DATABASES['default']['POOL']),
+        TEST={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['core.db.replicas.ReplicaRouter']
+
+# Seconds a user reads from the primary after a write, longer than the lag
+# of the replicas
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+# Seconds a replica that failed is left out
+REPLICA_RETRY_AFTER = int(os.environ.get('REPLICA_RETRY_AFTER', 30))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The default is kept per process, fine for runserver. Per-user versions,
+# ETags, token revocation and replica pins need a cache shared by all
+# workers, `check --deploy` warns while it is locmem.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
+# Seconds a cached api response is kept, writes invalidate it earlier
+API_RESPONSE_CACHE_TIMEOUT = int(
+    os.environ.get('API_RESPONSE_CACHE_TIMEOUT', 300)
+)
+
+# Seconds a token to user lookup is cached by CachedTokenAuthentication
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.environ.get('AUTH_TOKEN_CACHE_TIMEOUT', 60))
+
+# Worker threads running the blocking part of the async read views
+ASYNC_VIEW_WORKERS = int(os.environ.get('ASYNC_VIEW_WORKERS', 16))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -131,6 +198,46 @@ MEDIA_URL = '/static/media/'
 MEDIA_ROOT = '/vol/web/static'
 STATIC_ROOT = '/vol/web/media'
 
+# Media files never change under the same url, cache them for a year
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 31536000))
+
+# Resized copies made of every recipe image, name: (width, height), the
+# image is cropped to the box when a height is set
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': (200, 200),
+    'small': (480, None),
+    'medium': (960, None),
+}
+RECIPE_IMAGE_FORMATS = ('webp', 'jpeg')
+RECIPE_IMAGE_QUALITY = int(os.environ.get('RECIPE_IMAGE_QUALITY', 80))
+IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', 2))
+
+# Uploads are streamed to disk and refused past UPLOAD_MAX_FILE_SIZE bytes,
+# images are checked from their header and re-encoded without EXIF in a
+# pool of IMAGE_UPLOAD_WORKERS threads
+FILE_UPLOAD_HANDLERS = ['core.uploads.LimitedTemporaryFileUploadHandler']
+UPLOAD_MAX_FILE_SIZE = int(
+    os.environ.get('UPLOAD_MAX_FILE_SIZE', 10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_PIXELS = int(
+    os.environ.get('RECIPE_IMAGE_MAX_PIXELS', 40_000_000)
+)
+RECIPE_IMAGE_UPLOAD_QUALITY = int(
+    os.environ.get('RECIPE_IMAGE_UPLOAD_QUALITY', 90)
+)
+IMAGE_UPLOAD_WORKERS = int(os.environ.get('IMAGE_UPLOAD_WORKERS', 2))
+
+# Widths and formats recipe images can be resized to on request, renders
+# are cached under MEDIA_ROOT up to RESIZE_CACHE_MAX_BYTES in total
+RECIPE_IMAGE_RESIZE_WIDTHS = (160, 320, 480, 640, 960, 1280, 1920)
+RESIZE_CACHE_DIR = 'cache/resized'
+RESIZE_CACHE_MAX_BYTES = int(
+    os.environ.get('RESIZE_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+)
+# Browser cache lifetime of renders requested without the ?v= content key,
+# versioned renders are immutable
+RESIZE_CACHE_MAX_AGE = int(os.environ.get('RESIZE_CACHE_MAX_AGE', 86400))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -142,6 +249,68 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema'
 }
 
+# Default and upper bound for the page_size param of paginated list apis
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 200))
+
+# Tag and ingredient autocomplete, matches returned by default and at most,
+# and how many of the best name matches are ranked by usage
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+AUTOCOMPLETE_CANDIDATES = 100
+
+# Most operations accepted by one recipe batch request
+API_MAX_BATCH_SIZE = int(os.environ.get('API_MAX_BATCH_SIZE', 500))
+
+# Recipes fetched per server side cursor round trip by the export api
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+
+# Recipes written per transaction by the import_recipes command
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 10000))
+
+# Time the auth, db, serialize, view and render phases of every request,
+# sent as Server-Timing headers and core.timing log lines
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '') == '1'
+
+# Opt-in request profiling, PROFILE_SAMPLE_RATE of the requests and those
+# with an X-Profile header from manage.py profiles sign are profiled with
+# PROFILER, cprofile or sampler, and the last PROFILE_MAX_COUNT profiles
+# are kept in PROFILE_DIR
+PROFILING = os.environ.get('PROFILING', '') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILER = os.environ.get('PROFILER', 'cprofile')
+# Seconds between two stacks of the sampler
+PROFILE_SAMPLE_INTERVAL = float(
+    os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005)
+)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/vol/web/profiles')
+PROFILE_MAX_COUNT = int(os.environ.get('PROFILE_MAX_COUNT', 200))
+# Seconds an X-Profile header value stays valid
+PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', 86400))
+
+# Prometheus metrics at /metrics, each process writes its values to its
+# own files in METRICS_DIR and the endpoint adds them up, empty the
+# directory when the service starts
+METRICS = os.environ.get('METRICS', '') == '1'
+METRICS_DIR = os.environ.get(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'recipe-metrics')
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True,
 }
\ No newline at end of file
@@ -0,0 +1,75 @@
+"""
+ASGI handler able to stream from async iterators
+
+Django 3.2 sends a streaming response by iterating it on the event loop,
+where a sync iterator cannot query the database. AsyncStreamingHttpResponse
+takes an async iterator instead, which awaits its queries through
+sync_to_async, and ASGIHandler sends each part as soon as it is produced.
+"""
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+from django.http import StreamingHttpResponse
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """Streaming response over an async iterator of str or bytes, only sent
+    by the ASGIHandler of this module"""
+    is_async = True
+
+    @property
+    def streaming_content(self):
+        async def parts():
+            async for part in self._iterator:
+                yield self.make_bytes(part)
+        return parts()
+
+    @streaming_content.setter
+    def streaming_content(self, value):
+        self._iterator = value
+
+    def __iter__(self):
+        raise TypeError(f'{type(self).__name__} needs an async server')
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """Django's handler, also sending AsyncStreamingHttpResponse"""
+
+    async def send_response(self, response, send):
+        if not getattr(response, 'is_async', False):
+            return await super().send_response(response, send)
+        # as the parent, with the parts awaited
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': self.response_headers(response),
+        })
+        async for part in response.streaming_content:
+            for chunk, _ in self.chunk_bytes(part):
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    def response_headers(self, response):
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append((
+                b'Set-Cookie', cookie.output(header='').encode('ascii').strip()
+            ))
+        return headers
+
+
+def get_asgi_application():
+    """django.core.asgi.get_asgi_application with the handler above"""
+    django.setup(set_prefix=False)
+    return ASGIHandler()
@@ -0,0 +1,241 @@
+"""
+In process benchmarks of the api endpoints
+
+Every scenario sends requests through the whole Django stack with the test
+client, against data made by the generate_dataset command, and records the
+latency percentiles, the SQL queries run and the memory allocated per
+request. Reports are plain JSON, a saved report is the baseline later runs
+are compared with.
+"""
+import itertools
+import math
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, Tag
+
+BENCH_PASSWORD = 'benchmark-password'
+
+# words of the generated recipe, tag and ingredient names
+WORDS = [
+    'curry', 'thai', 'green', 'red', 'chicken', 'beef', 'tofu', 'salad',
+    'soup', 'stew', 'noodle', 'rice', 'pasta', 'tomato', 'garlic', 'onion',
+    'lemon', 'ginger', 'spicy', 'sweet', 'roasted', 'grilled', 'baked',
+    'fried', 'vegan', 'quick', 'easy', 'slow', 'creamy', 'crispy', 'cheese',
+    'mushroom', 'potato', 'carrot', 'pepper', 'basil', 'coconut', 'honey',
+    'butter', 'chocolate', 'pancake', 'bread', 'salmon', 'shrimp', 'lamb',
+    'pork', 'bean', 'lentil', 'spinach', 'avocado',
+]
+
+
+class BenchmarkError(Exception):
+    """a scenario did not answer with the expected status"""
+
+
+class QueryStats:
+    """execute wrapper counting queries and their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+
+
+def percentile(values, p):
+    """nearest rank percentile of sorted values"""
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class Fixture:
+    """the benchmark user and ids of its data"""
+
+    def __init__(self, user):
+        user.set_password(BENCH_PASSWORD)
+        user.save(update_fields=['password'])
+        self.user = user
+        self.token = Token.objects.get_or_create(user=user)[0].key
+        self.recipe_ids = list(Recipe.objects.filter(
+            user=user
+        ).order_by('-id').values_list('id', flat=True)[:100])
+        tags = Tag.objects.filter(user=user).order_by('id')
+        self.tag_ids = list(tags.values_list('id', flat=True)[:3])
+        self.tag_names = list(tags.values_list('name', flat=True)[:10])
+        self.ingredient_names = list(Ingredient.objects.filter(
+            user=user
+        ).order_by('id').values_list('name', flat=True)[:20])
+        if not self.recipe_ids:
+            raise BenchmarkError(f'{user.email} has no recipes')
+
+
+def scenarios(fixture):
+    """name: (send one request, expected status), in run order"""
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {fixture.token}')
+    anonymous = APIClient()
+    recipe_ids = itertools.cycle(fixture.recipe_ids)
+    counter = itertools.count()
+    recipes_url = reverse('recipe:recipe-list')
+    tags_url = reverse('recipe:tag-list')
+    ingredients_url = reverse('recipe:ingredient-list')
+
+    def detail_url():
+        return reverse('recipe:recipe-detail', args=[next(recipe_ids)])
+
+    def names(values, count):
+        start = next(counter) % len(values) if values else 0
+        return [{'name': name} for name in
+                (values[start:] + values[:start])[:count]]
+
+    def create():
+        return client.post(recipes_url, {
+            'title': f'Benchmark recipe {next(counter)}',
+            'time_minutes': 30,
+            'price': '9.50',
+            'tags': names(fixture.tag_names, 3),
+            'ingredients': names(fixture.ingredient_names, 6),
+        }, format='json')
+
+    def update():
+        return client.patch(detail_url(), {
+            'title': f'Benchmark update {next(counter)}',
+            'tags': names(fixture.tag_names, 3),
+            'ingredients': names(fixture.ingredient_names, 6),
+        }, format='json')
+
+    tag_ids = ','.join(map(str, fixture.tag_ids))
+    return {
+        'recipe-list': (lambda: client.get(recipes_url), 200),
+        'recipe-list-tags': (
+            lambda: client.get(recipes_url, {'tags': tag_ids}), 200
+        ),
+        'recipe-search': (
+            lambda: client.get(recipes_url, {'search': 'curry rice'}), 200
+        ),
+        'recipe-detail': (lambda: client.get(detail_url()), 200),
+        'recipe-create': (create, 201),
+        'recipe-update': (update, 200),
+        'tag-list-assigned': (
+            lambda: client.get(tags_url, {'assigned_only': 1}), 200
+        ),
+        'ingredient-list-assigned': (
+            lambda: client.get(ingredients_url, {'assigned_only': 1}), 200
+        ),
+        'ingredient-autocomplete': (
+            lambda: client.get(ingredients_url, {'q': 'cur'}), 200
+        ),
+        'token-login': (lambda: anonymous.post(reverse('user:token'), {
+            'email': fixture.user.email, 'password': BENCH_PASSWORD,
+        }), 200),
+        'user-me': (lambda: client.get(reverse('user:me')), 200),
+    }
+
+
+def _send(name, request, status):
+    response = request()
+    if response.status_code != status:
+        raise BenchmarkError(
+            f'{name}: expected {status}, got {response.status_code} '
+            f'{getattr(response, "data", "")}'
+        )
+    return response
+
+
+def measure(name, request, status, iterations, warmup=5,
+            memory_iterations=5):
+    """latency, queries and allocations of one scenario"""
+    for _ in range(warmup):
+        _send(name, request, status)
+
+    latencies, queries, query_times = [], [], []
+    for _ in range(iterations):
+        stats = QueryStats()
+        with connection.execute_wrapper(stats):
+            start = time.perf_counter()
+            _send(name, request, status)
+            latencies.append(time.perf_counter() - start)
+        queries.append(stats.count)
+        query_times.append(stats.time)
+
+    # apart from the timings, tracing makes every allocation slower
+    allocations = []
+    tracemalloc.start()
+    try:
+        for _ in range(memory_iterations):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            _send(name, request, status)
+            allocations.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'queries': max(queries),
+        'query_ms': round(statistics.mean(query_times) * 1000, 3),
+        'memory_kb': round(statistics.median(allocations) / 1024, 1),
+    }
+
+
+def run(fixture, iterations, warmup=5, memory_iterations=5, names=None,
+        progress=None):
+    """results of the selected scenarios, all of them by default"""
+    results = {}
+    for name, (request, status) in scenarios(fixture).items():
+        if names and name not in names:
+            continue
+        results[name] = measure(
+            name, request, status, iterations, warmup, memory_iterations
+        )
+        if progress:
+            progress(name, results[name])
+    return results
+
+
+def compare(results, baseline, threshold=0.2, min_delta_ms=1.0,
+            memory_threshold=0.2, min_delta_kb=64):
+    """regressions of results against baseline results, as messages
+
+    Query counts may not grow at all. Latency may grow by threshold and
+    memory by memory_threshold, and only differences above min_delta_ms
+    and min_delta_kb count, so fast endpoints do not fail on noise.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append(
+                f'{name}: {base["queries"]} -> {result["queries"]} queries'
+            )
+        for key in ('p50_ms', 'p95_ms'):
+            if result[key] > base[key] * (1 + threshold) and \
+                    result[key] - base[key] >= min_delta_ms:
+                regressions.append(
+                    f'{name}: {key} {base[key]:.2f} -> {result[key]:.2f}'
+                )
+        if result['memory_kb'] > base['memory_kb'] * (1 + memory_threshold) \
+                and result['memory_kb'] - base['memory_kb'] >= min_delta_kb:
+            regressions.append(
+                f'{name}: memory {base["memory_kb"]:.0f} KB -> '
+                f'{result["memory_kb"]:.0f} KB'
+            )
+    return regressions
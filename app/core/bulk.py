@@ -0,0 +1,217 @@
+"""
+Bulk loading of recipes with Postgres COPY
+
+Recipe ids are reserved from the table sequence up front, so the recipe
+rows and their tag and ingredient links can all be written with COPY in
+the same transaction, without reading anything back. Tags and ingredients
+are resolved by name for all the users of a batch at once and their ids
+kept in memory across batches.
+"""
+import io
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.cache import invalidate_user
+from core.models import Recipe
+
+RELATED_FIELDS = ('tags', 'ingredients')
+
+# columns written for each recipe, in COPY order
+RECIPE_COLUMNS = [
+    'id', 'user_id', 'title', 'description', 'time_minutes', 'price',
+    'link', 'image', 'updated_at',
+]
+
+
+def _copy_value(value):
+    """a value in the COPY text format"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cursor, table, columns, rows):
+    """write rows of values to a table with COPY FROM STDIN"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(map(_copy_value, row)))
+        buffer.write('\n')
+    buffer.seek(0)
+    quote = connection.ops.quote_name
+    cursor.copy_expert(
+        f'COPY {quote(table)} ({", ".join(map(quote, columns))}) '
+        f'FROM STDIN',
+        buffer,
+    )
+
+
+def reserve_ids(cursor, model, count):
+    """take count ids from the primary key sequence of a model"""
+    cursor.execute(
+        'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+        'FROM generate_series(1, %s)',
+        [model._meta.db_table, model._meta.pk.column, count],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+class RecipeLoader:
+    """Load batches of recipes with their tags and ingredients by name
+
+    Each record is a dict with user_id, title, description, time_minutes,
+    price, link and optionally image, tags and ingredients, the last two as
+    lists of names. The id cache is dropped once it holds more than
+    cache_size names.
+    """
+
+    def __init__(self, cache_size=1000000):
+        self.cache_size = cache_size
+        self._ids = {field_name: {} for field_name in RELATED_FIELDS}
+
+    def _resolve(self, field_name, records):
+        """ids of the names used by records, creating the missing ones
+
+        One INSERT and one SELECT for all the users of the batch.
+        """
+        ids = self._ids[field_name]
+        if len(ids) > self.cache_size:
+            ids.clear()
+        missing = sorted({
+            (record['user_id'], name)
+            for record in records
+            for name in record.get(field_name, ())
+            if (record['user_id'], name) not in ids
+        })
+        if not missing:
+            return ids
+
+        model = Recipe._meta.get_field(field_name).related_model
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        user_column = quote(model._meta.get_field('user').column)
+        params = [[user_id for user_id, _ in missing],
+                  [name for _, name in missing]]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({user_column}, "name") '
+                f'SELECT * FROM unnest(%s::bigint[], %s::text[]) '
+                f'ON CONFLICT DO NOTHING',
+                params,
+            )
+            cursor.execute(
+                f'SELECT t.{user_column}, t."name", t."id" FROM {table} t '
+                f'JOIN unnest(%s::bigint[], %s::text[]) AS m(user_id, name) '
+                f'ON t.{user_column} = m.user_id AND t."name" = m.name',
+                params,
+            )
+            for user_id, name, obj_id in cursor.fetchall():
+                ids[(user_id, name)] = obj_id
+        return ids
+
+    def load(self, records):
+        """insert records in one transaction, return their new ids"""
+        if not records:
+            return []
+        now = timezone.now()
+        with transaction.atomic(), connection.cursor() as cursor:
+            recipe_ids = reserve_ids(cursor, Recipe, len(records))
+            copy_rows(cursor, Recipe._meta.db_table, RECIPE_COLUMNS, (
+                (
+                    recipe_id, record['user_id'], record['title'],
+                    record.get('description', ''), record['time_minutes'],
+                    record['price'], record.get('link', ''),
+                    record.get('image') or None, now,
+                )
+                for recipe_id, record in zip(recipe_ids, records)
+            ))
+            for field_name in RELATED_FIELDS:
+                ids = self._resolve(field_name, records)
+                field = Recipe._meta.get_field(field_name)
+                copy_rows(
+                    cursor,
+                    field.remote_field.through._meta.db_table,
+                    [field.m2m_column_name(), field.m2m_reverse_name()],
+                    (
+                        (recipe_id, ids[(record['user_id'], name)])
+                        for recipe_id, record in zip(recipe_ids, records)
+                        for name in dict.fromkeys(record.get(field_name, ()))
+                    ),
+                )
+            for user_id in {record['user_id'] for record in records}:
+                invalidate_user(user_id)
+        return recipe_ids
+
+
+def _bulk_tables():
+    """recipes, tags, ingredients and the recipe link tables"""
+    tables = [Recipe._meta.db_table]
+    for field_name in RELATED_FIELDS:
+        field = Recipe._meta.get_field(field_name)
+        tables += [
+            field.related_model._meta.db_table,
+            field.remote_field.through._meta.db_table,
+        ]
+    return tables
+
+
+def deferrable_constraints(cursor):
+    """(table, name, definition) of the indexes and foreign keys that a
+    cold load can drop and rebuild at the end, on the tables it writes
+
+    Unique indexes and primary keys stay, they guard the data. Foreign
+    keys are checked row by row at commit during a load, while adding
+    them back validates every row in one pass.
+    """
+    cursor.execute(
+        'SELECT c.conrelid::regclass::text, c.conname, '
+        'pg_get_constraintdef(c.oid) '
+        'FROM pg_constraint c '
+        "WHERE c.conrelid = ANY(%(tables)s::regclass[]) AND c.contype = 'f' "
+        'UNION ALL '
+        'SELECT i.indrelid::regclass::text, c.relname, '
+        'pg_get_indexdef(i.indexrelid) '
+        'FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+        'WHERE i.indrelid = ANY(%(tables)s::regclass[]) '
+        'AND NOT i.indisunique '
+        'ORDER BY 1, 2',
+        {'tables': _bulk_tables()},
+    )
+    return [list(row) for row in cursor.fetchall()]
+
+
+def drop_constraints(cursor, constraints):
+    quote = connection.ops.quote_name
+    for table, name, definition in constraints:
+        if definition.startswith('CREATE '):
+            cursor.execute(f'DROP INDEX IF EXISTS {quote(name)}')
+        else:
+            cursor.execute(
+                f'ALTER TABLE {quote(table)} '
+                f'DROP CONSTRAINT IF EXISTS {quote(name)}'
+            )
+
+
+def create_constraints(cursor, constraints):
+    """build dropped indexes and foreign keys again, skip existing ones"""
+    quote = connection.ops.quote_name
+    cursor.execute(
+        'SELECT conname FROM pg_constraint '
+        'WHERE conrelid = ANY(%s::regclass[])',
+        [_bulk_tables()],
+    )
+    existing = {row[0] for row in cursor.fetchall()}
+    # indexes first, foreign keys then validate against indexed columns
+    for table, name, definition in sorted(
+        constraints, key=lambda c: not c[2].startswith('CREATE ')
+    ):
+        if definition.startswith('CREATE '):
+            cursor.execute(definition.replace(
+                ' INDEX ', ' INDEX IF NOT EXISTS ', 1
+            ))
+        elif name not in existing:
+            cursor.execute(
+                f'ALTER TABLE {quote(table)} '
+                f'ADD CONSTRAINT {quote(name)} {definition}'
+            )
@@ -0,0 +1,79 @@
+"""
+Per user versioned cache helpers
+
+Every user has a version counter in the cache. Cached data for a user is
+keyed by that version, so a write only has to bump the counter and the old
+entries are never read again.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from core.metrics import cache_requests
+
+
+def _version_key(user_id):
+    return f'user-version:{user_id}'
+
+
+def get_user_version(user_id):
+    """return the current cache version of a user"""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # start from the clock so a lost counter never reuses a version
+        version = time.time_ns()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_user_version(user_id):
+    """move the user to a new cache version"""
+    key = _version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate_user(user_id):
+    """invalidate cached data of a user now and once the write commits"""
+    bump_user_version(user_id)
+    # responses cached while the transaction was open saw the old rows
+    transaction.on_commit(lambda: bump_user_version(user_id))
+
+
+class CacheStats:
+    """Thread safe hit and miss counters, also exported as metrics"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+        cache_requests.inc(cache=self.name, result='hit')
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+        cache_requests.inc(cache=self.name, result='miss')
+
+    def snapshot(self):
+        """return the counters as a dict"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+response_cache_stats = CacheStats('response')
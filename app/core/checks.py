@@ -0,0 +1,27 @@
+"""
+System checks for settings the api depends on
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+PER_PROCESS_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+}
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """warn when the default cache is not shared between workers"""
+    backend = settings.CACHES['default']['BACKEND']
+    if backend not in PER_PROCESS_CACHES:
+        return []
+    return [Warning(
+        f'The default cache {backend} is kept per process.',
+        hint=(
+            'Per-user cache versions, ETags, token revocation and replica '
+            'pins are not seen by other workers, which serve stale data '
+            'and accept revoked tokens. Set CACHE_BACKEND to a Redis or '
+            'Memcached backend when running more than one worker.'
+        ),
+        id='core.W001',
+    )]
@@ -0,0 +1,43 @@
+"""
+PostgreSQL backend taking its connections from a pool
+
+Set POOL in the database settings, MIN_SIZE, MAX_SIZE, TIMEOUT,
+MAX_LIFETIME, MAX_IDLE and CHECK_AFTER as in core.db.pool.ConnectionPool,
+a MAX_SIZE of 0 connects directly. Keep CONN_MAX_AGE at 0, closing the
+connection at the end of a request then gives it back to the pool.
+
+Each thread still has a connection of its own, under WSGI threads and
+under ASGI, where Django runs the sync code in threads as well.
+"""
+from django.db.backends.postgresql import base
+
+from core.db.backends.postgresql.creation import DatabaseCreation
+from core.db.backends.postgresql.pools import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    _pool = None
+
+    def get_new_connection(self, conn_params):
+        self._pool = get_pool(self.settings_dict, conn_params)
+        if self._pool is None:
+            return super().get_new_connection(conn_params)
+        connection = self._pool.getconn()
+        # what the parent sets from a new connection
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level
+        )
+        return connection
+
+    def _close(self):
+        if self._pool is None or self.connection is None:
+            return super()._close()
+        # a connection closed inside atomic stays referenced by this
+        # wrapper, and one that raised may be broken, neither is reused
+        with self.wrap_database_errors:
+            self._pool.putconn(
+                self.connection,
+                discard=self.in_atomic_block or self.errors_occurred,
+            )
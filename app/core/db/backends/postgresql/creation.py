@@ -0,0 +1,16 @@
+from django.db.backends.postgresql import creation
+
+from core.db.backends.postgresql import pools
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """Close the pooled connections to a test database before it is
+    dropped or used as a template"""
+
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        pools.close_pools(self.connection.settings_dict['NAME'])
+        super()._clone_test_db(suffix, verbosity, keepdb)
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        pools.close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
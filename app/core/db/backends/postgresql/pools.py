@@ -0,0 +1,67 @@
+"""
+The connection pools of a process, one per set of connection parameters
+"""
+import json
+import os
+import threading
+
+import psycopg2.extras
+from django.db.backends.postgresql.base import Database
+
+from core.db.pool import ConnectionPool
+
+_lock = threading.Lock()
+_pools = {}
+_pid = os.getpid()
+# pools inherited through fork, closing or even collecting their
+# connections would end the sessions of the parent process
+_inherited = []
+
+
+def _connect(conn_params, options):
+    """a new connection set up like the postgresql backend does"""
+    connection = Database.connect(**conn_params)
+    isolation_level = options.get('isolation_level')
+    if isolation_level is not None and \
+            isolation_level != connection.isolation_level:
+        connection.set_session(isolation_level=isolation_level)
+    psycopg2.extras.register_default_jsonb(
+        conn_or_curs=connection, loads=lambda x: x
+    )
+    return connection
+
+
+def get_pool(settings_dict, conn_params):
+    """the pool of connections with these parameters, None when the
+    POOL MAX_SIZE of the database is 0"""
+    options = settings_dict.get('POOL') or {}
+    if not options.get('MAX_SIZE'):
+        return None
+    global _pid
+    key = json.dumps(conn_params, sort_keys=True, default=str)
+    with _lock:
+        if _pid != os.getpid():
+            _inherited.append(list(_pools.values()))
+            _pools.clear()
+            _pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None or pool.closed:
+            pool = _pools[key] = ConnectionPool(
+                lambda: _connect(conn_params, settings_dict['OPTIONS']),
+                min_size=options.get('MIN_SIZE', 0),
+                max_size=options['MAX_SIZE'],
+                timeout=options.get('TIMEOUT', 10),
+                max_lifetime=options.get('MAX_LIFETIME', 1800),
+                max_idle=options.get('MAX_IDLE', 300),
+                check_after=options.get('CHECK_AFTER', 10),
+            )
+    return pool
+
+
+def close_pools(database=None):
+    """close the pools of a database name, all of them by default"""
+    with _lock:
+        for key, pool in list(_pools.items()):
+            if database is None or json.loads(key).get('database') == database:
+                pool.close()
+                del _pools[key]
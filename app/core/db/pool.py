@@ -0,0 +1,220 @@
+"""
+Thread safe pool of psycopg2 connections
+
+Connections are handed out last in, first out, so a quiet process keeps
+reusing a few warm connections while the others age out. A checkout waits
+up to timeout for a connection when max_size are in use. A connection
+idle for longer than check_after is pinged before it is handed out, one
+that outlived max_lifetime is closed when it comes back, and a reaper
+thread closes connections idle for more than max_idle, keeping min_size
+open.
+
+A returned connection is rolled back and its session reset with DISCARD
+ALL, so the settings, temporary tables and session locks of one user are
+not seen by the next.
+"""
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """no connection became free in time"""
+
+
+class PooledConnection:
+    """A connection with its age and when it was last returned"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.returned = time.monotonic()
+
+
+class ConnectionPool:
+    """Pool of connections made by connect()"""
+
+    def __init__(self, connect, min_size=0, max_size=10, timeout=10.0,
+                 max_lifetime=1800.0, max_idle=300.0, check_after=10.0):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError('need 0 <= min_size <= max_size and max_size > 0')
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        # connections open or being opened, idle or in use
+        self.size = 0
+        self.closed = False
+        self._stopped = threading.Event()
+        self._reaper = threading.Thread(
+            target=self._reap_forever, name='db-pool-reaper', daemon=True
+        )
+        self._reaper.start()
+
+    def getconn(self):
+        """a connection for the caller only, give it back with putconn"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                entry = self._checkout(deadline)
+            if entry is None:
+                entry = self._open()
+            elif not self._healthy(entry):
+                self._discard(entry)
+                continue
+            with self._cond:
+                self._in_use[id(entry.connection)] = entry
+            return entry.connection
+
+    def _checkout(self, deadline):
+        """an idle entry, or None after reserving room for a new one"""
+        while True:
+            if self.closed:
+                raise psycopg2.OperationalError('the pool is closed')
+            if self._idle:
+                return self._idle.pop()
+            if self.size < self.max_size:
+                self.size += 1
+                return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PoolTimeout(
+                    f'no connection free in {self.timeout}s, all '
+                    f'{self.max_size} are in use'
+                )
+            self._cond.wait(remaining)
+
+    def _open(self):
+        try:
+            return PooledConnection(self._connect())
+        except BaseException:
+            with self._cond:
+                self.size -= 1
+                self._cond.notify()
+            raise
+
+    def _healthy(self, entry):
+        connection = entry.connection
+        if connection.closed:
+            return False
+        if time.monotonic() - entry.returned < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def putconn(self, connection, discard=False):
+        """take a connection back, closing it when it cannot be reused"""
+        with self._cond:
+            entry = self._in_use.pop(id(connection), None)
+        if entry is None:
+            connection.close()
+            return
+        if not discard and not self.closed and self._reusable(entry):
+            entry.returned = time.monotonic()
+            with self._cond:
+                if not self.closed:
+                    self._idle.append(entry)
+                    self._cond.notify()
+                    return
+        self._discard(entry)
+
+    def _reusable(self, entry):
+        """roll back what the user left open and reset the session, False
+        when unusable"""
+        connection = entry.connection
+        if connection.closed or \
+                time.monotonic() - entry.created >= self.max_lifetime:
+            return False
+        status = connection.get_transaction_status()
+        if status not in (extensions.TRANSACTION_STATUS_IDLE,
+                          extensions.TRANSACTION_STATUS_INTRANS,
+                          extensions.TRANSACTION_STATUS_INERROR):
+            return False
+        autocommit = connection.autocommit
+        try:
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            # DISCARD ALL cannot run in a transaction
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute('DISCARD ALL')
+            connection.autocommit = autocommit
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _discard(self, entry):
+        try:
+            entry.connection.close()
+        finally:
+            with self._cond:
+                self.size -= 1
+                self._cond.notify()
+
+    def reap(self):
+        """close idle connections past max_idle or max_lifetime, then open
+        connections up to min_size"""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            keep = deque()
+            for entry in self._idle:
+                if now - entry.created >= self.max_lifetime or (
+                    now - entry.returned >= self.max_idle and
+                    self.size - len(expired) > self.min_size
+                ):
+                    expired.append(entry)
+                else:
+                    keep.append(entry)
+            self._idle = keep
+            missing = max(self.min_size - self.size + len(expired), 0)
+            if self.closed:
+                missing = 0
+            self.size += missing
+        for entry in expired:
+            self._discard(entry)
+        for _ in range(missing):
+            try:
+                entry = self._open()
+            except psycopg2.Error:
+                continue
+            with self._cond:
+                self._idle.appendleft(entry)
+                self._cond.notify()
+
+    def _reap_forever(self):
+        interval = max(min(self.max_idle, self.max_lifetime) / 4, 0.05)
+        while not self._stopped.wait(interval):
+            self.reap()
+
+    def close(self):
+        """close the idle connections now and the others on return"""
+        with self._cond:
+            self.closed = True
+            idle, self._idle = self._idle, deque()
+            self._cond.notify_all()
+        self._stopped.set()
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+            }
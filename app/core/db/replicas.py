@@ -0,0 +1,133 @@
+"""
+Reads of safe requests from read replicas
+
+ReplicaRouter sends every write to the primary and the reads of the
+current request to the replica ReplicaReadMixin chose for it. The mixin
+chooses one once the user is authenticated, so tokens are always read
+from the primary. A replica is only used for GET, HEAD and OPTIONS, and
+not for a user who wrote in the last REPLICA_PIN_SECONDS. That keeps a
+user from missing their own edit while the replicas catch up. The pins
+are kept in the cache, use a shared cache with several processes.
+
+A replica that cannot be connected to, or whose queries fail on the
+connection, is left out for REPLICA_RETRY_AFTER seconds. With every
+replica left out, requests read from the primary. Reads inside a
+transaction of the primary read from the primary too, they must see its
+uncommitted writes.
+"""
+import contextvars
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+# the replica of the current request, None reads from the primary
+_replica = contextvars.ContextVar('replica', default=None)
+# replica alias to the monotonic time it may be tried again
+_down_until = {}
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_user(user_id):
+    """read from the primary for the user for REPLICA_PIN_SECONDS"""
+    cache.set(_pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id):
+    return cache.get(_pin_key(user_id)) is not None
+
+
+def mark_down(alias):
+    """leave a replica out for REPLICA_RETRY_AFTER seconds"""
+    _down_until[alias] = time.monotonic() + settings.REPLICA_RETRY_AFTER
+
+
+def choose_replica():
+    """a connected replica in random order, None when all are down"""
+    now = time.monotonic()
+    aliases = [
+        alias for alias in settings.DATABASE_REPLICAS
+        if _down_until.get(alias, 0) <= now
+    ]
+    random.shuffle(aliases)
+    for alias in aliases:
+        try:
+            connections[alias].ensure_connection()
+        except OperationalError:
+            logger.warning('replica %s is down, reading from the primary',
+                           alias, exc_info=True)
+            mark_down(alias)
+            continue
+        return alias
+    return None
+
+
+class ReplicaRouter:
+    """Reads from the replica of the current request, writes to the
+    primary, migrations on the primary only"""
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is not None and \
+                connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """the replicas hold the rows of the primary"""
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """Read from a replica in safe requests, pin the user to the primary
+    after unsafe ones"""
+
+    _replica_token = None
+    _writer = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            # authenticated and allowed, it may write
+            self._writer = request.user.pk
+        elif settings.DATABASE_REPLICAS and \
+                not connections[DEFAULT_DB_ALIAS].in_atomic_block and \
+                not is_pinned(request.user.pk):
+            self._replica_token = _replica.set(choose_replica())
+
+    def handle_exception(self, exc):
+        alias = _replica.get()
+        if alias is not None and isinstance(exc, OperationalError):
+            mark_down(alias)
+        return super().handle_exception(exc)
+
+    def dispatch(self, request, *args, **kwargs):
+        # finalize_response is skipped when handle_exception raises
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self._replica_token is not None:
+                _replica.reset(self._replica_token)
+            if self._writer is not None:
+                # the window starts once the writes are committed
+                pin_user(self._writer)
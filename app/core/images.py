@@ -0,0 +1,148 @@
+"""
+Resized variants of recipe images
+
+Uploads are stored as sent. A worker pool renders every variant listed in
+RECIPE_IMAGE_VARIANTS in each of RECIPE_IMAGE_FORMATS next to the original,
+off the request path. Variants that already exist are skipped, so running
+the pipeline again for an image only fills in what is missing.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from core.cache import bump_user_version
+from core.metrics import image_queue_depth
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_VARIANT_WORKERS,
+    thread_name_prefix='image-variants',
+)
+
+_lock = threading.Lock()
+_pending = {}
+
+
+def variant_name(image_name, variant, fmt):
+    """storage name of one variant of an image"""
+    root = os.path.splitext(image_name)[0]
+    return f'{root}/{variant}.{FORMAT_EXTENSIONS[fmt]}'
+
+
+def variant_names(image_name):
+    """(variant, format, storage name) of every configured variant"""
+    return [
+        (variant, fmt, variant_name(image_name, variant, fmt))
+        for variant in settings.RECIPE_IMAGE_VARIANTS
+        for fmt in settings.RECIPE_IMAGE_FORMATS
+    ]
+
+
+def variant_urls(image_name, storage=default_storage):
+    """urls of the variants that are ready, as {variant: {format: url}}"""
+    urls = {}
+    if not image_name:
+        return urls
+    for variant, fmt, name in variant_names(image_name):
+        if storage.exists(name):
+            urls.setdefault(variant, {})[fmt] = storage.url(name)
+    return urls
+
+
+def resize_image(image, width, height):
+    """fit into width x height, crop when both are set, never upscale"""
+    if height:
+        return ImageOps.fit(
+            image,
+            (min(width, image.width), min(height, image.height)),
+            Image.LANCZOS,
+        )
+    resized = image.copy()
+    resized.thumbnail((width, image.height), Image.LANCZOS)
+    return resized
+
+
+def encode_image(image, fmt):
+    """encode an image, jpeg has no alpha channel"""
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    buffer = io.BytesIO()
+    image.save(
+        buffer,
+        format=fmt.upper(),
+        quality=settings.RECIPE_IMAGE_QUALITY,
+    )
+    return ContentFile(buffer.getvalue())
+
+
+def load_image(image_name, storage=default_storage):
+    """open a stored image, upright according to its exif orientation"""
+    with storage.open(image_name, 'rb') as image_file:
+        with Image.open(image_file) as original:
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    return image
+
+
+def generate_variants(image_name, storage=default_storage):
+    """render the missing variants of an image, return the created names"""
+    missing = [
+        (variant, fmt, name)
+        for variant, fmt, name in variant_names(image_name)
+        if not storage.exists(name)
+    ]
+    if not missing:
+        return []
+
+    original = load_image(image_name, storage)
+    created = []
+    resized = {}
+    for variant, fmt, name in missing:
+        if variant not in resized:
+            width, height = settings.RECIPE_IMAGE_VARIANTS[variant]
+            resized[variant] = resize_image(original, width, height)
+        storage.save(name, encode_image(resized[variant], fmt))
+        created.append(name)
+    return created
+
+
+def _run(image_name, user_id):
+    try:
+        if generate_variants(image_name) and user_id is not None:
+            # cached detail responses were rendered without these urls
+            bump_user_version(user_id)
+    except Exception:
+        logger.exception('image variants failed for %s', image_name)
+    finally:
+        with _lock:
+            _pending.pop(image_name, None)
+            image_queue_depth.set(len(_pending))
+
+
+def schedule_variants(image_name, user_id=None):
+    """queue variant generation of an image, once per image name"""
+    with _lock:
+        future = _pending.get(image_name)
+        if future is None:
+            future = executor.submit(_run, image_name, user_id)
+            _pending[image_name] = future
+            image_queue_depth.set(len(_pending))
+    return future
+
+
+def queue_depth():
+    """number of images waiting for or in variant generation"""
+    with _lock:
+        return len(_pending)
@@ -0,0 +1,238 @@
+"""
+Compare the sync and async recipe read paths under concurrent load
+"""
+import asyncio
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from core.asgi import ASGIHandler
+from core.benchmark import percentile
+from core.models import Recipe, Tag, Ingredient
+
+# server, url name
+MODES = {
+    'wsgi': ('wsgi', 'recipe:recipe-list'),
+    'sync': ('asgi', 'recipe:recipe-list'),
+    'async': ('asgi', 'recipe:async-recipe-list'),
+}
+
+
+def start_response(status, headers):
+    """WSGI start_response keeping nothing"""
+
+
+async def asgi_get(application, path, headers):
+    """send one GET through the ASGI application, return the status"""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'testserver')] + headers,
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    sent = False
+    disconnect = asyncio.Event()
+    status = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        elif not message.get('more_body'):
+            disconnect.set()
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+async def run_load(application, path, headers, requests, concurrency):
+    """fire requests with bounded concurrency, return latencies"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            status = await asgi_get(application, path, headers)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_wsgi_load(handler, environ, requests, concurrency):
+    """send requests from a pool of threads as a threaded WSGI server
+    would, return latencies"""
+    def one(_):
+        start = time.perf_counter()
+        response = handler(dict(environ), start_response)
+        # request_finished, the connection is closed or returned
+        response.close()
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    errors = sum(status != 200 for _, status in results)
+    return [latency for latency, _ in results], errors, elapsed
+
+
+class Command(BaseCommand):
+    """Load compare the sync views under WSGI and ASGI and the async
+    views"""
+    help = (
+        'Create a test database and run concurrent GETs against the sync '
+        'recipe list through the WSGI handler with one thread per '
+        'concurrent request, then against the sync and async recipe lists '
+        'through the ASGI handler, and report throughput and latency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--recipes', type=int, default=50)
+        parser.add_argument(
+            '--db-latency-ms', type=float, default=0,
+            help='Sleep before every query to simulate a slow database',
+        )
+        parser.add_argument(
+            '--response-cache', action='store_true',
+            help='Keep the response cache on, by default every GET queries',
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the test database for the next run',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options['keepdb']
+        )
+        try:
+            self._bench(options)
+        finally:
+            teardown_databases(
+                old_config, verbosity=0, keepdb=options['keepdb']
+            )
+            teardown_test_environment()
+
+    def _bench(self, options):
+        """run every mode against the test database"""
+        if options['db_latency_ms']:
+            delay = options['db_latency_ms'] / 1000
+
+            def slow_query(execute, sql, params, many, context):
+                time.sleep(delay)
+                return execute(sql, params, many, context)
+
+            def add_latency(sender, connection, **kwargs):
+                connection.execute_wrappers.append(slow_query)
+
+            connection_created.connect(
+                add_latency, weak=False, dispatch_uid='bench-async-latency'
+            )
+
+        user, token = self._create_fixture(options['recipes'])
+        handlers = {'wsgi': WSGIHandler(), 'asgi': ASGIHandler()}
+        cache_timeout = settings.API_RESPONSE_CACHE_TIMEOUT
+        if not options['response_cache']:
+            cache_timeout = 0
+        try:
+            for name, (server, url_name) in MODES.items():
+                with override_settings(
+                    API_RESPONSE_CACHE_TIMEOUT=cache_timeout
+                ):
+                    result = self._run(
+                        handlers[server], server, reverse(url_name), token,
+                        options,
+                    )
+                self._report(name, *result)
+        finally:
+            connection_created.disconnect(dispatch_uid='bench-async-latency')
+            user.delete()
+
+    def _create_fixture(self, count):
+        """throwaway user with recipes and a token"""
+        user = get_user_model().objects.create_user(
+            f'bench-{uuid.uuid4().hex}@example.com',
+            uuid.uuid4().hex,
+        )
+        tags = Tag.objects.resolve(user, [f'Tag {i}' for i in range(5)])
+        ingredients = Ingredient.objects.resolve(
+            user, [f'Ingredient {i}' for i in range(5)]
+        )
+        for i in range(count):
+            recipe = Recipe.objects.create(
+                user=user,
+                title=f'Bench recipe {i}',
+                time_minutes=10,
+                price=Decimal('5.00'),
+            )
+            recipe.tags.add(*tags)
+            recipe.ingredients.add(*ingredients)
+        return user, Token.objects.create(user=user).key
+
+    def _run(self, handler, server, path, token, options):
+        """latencies, errors and elapsed seconds of the requests"""
+        if server == 'wsgi':
+            environ = RequestFactory().get(
+                path,
+                HTTP_AUTHORIZATION=f'Token {token}',
+            ).environ
+            return run_wsgi_load(
+                handler, environ, options['requests'], options['concurrency']
+            )
+        headers = [(b'authorization', f'Token {token}'.encode())]
+        return asyncio.run(run_load(
+            handler, path, headers, options['requests'],
+            options['concurrency'],
+        ))
+
+    def _report(self, name, latencies, errors, elapsed):
+        latencies = sorted(latencies)
+        self.stdout.write(
+            f'{name:>5}: {len(latencies) / elapsed:8.1f} req/s  '
+            f'p50 {statistics.median(latencies) * 1000:7.1f} ms  '
+            f'p95 {percentile(latencies, 95) * 1000:7.1f} ms  '
+            f'errors {errors}'
+        )
@@ -0,0 +1,136 @@
+"""
+Measure tag and ingredient autocomplete latency for a large user
+"""
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.benchmark import WORDS, percentile
+from core.models import Ingredient
+from recipe.views import IngredientViewSet
+
+BENCH_EMAIL = 'bench-autocomplete@example.com'
+
+SEED_SQL = """
+INSERT INTO core_ingredient (user_id, name)
+SELECT
+    %(user_id)s,
+    initcap(w[1 + i %% n]) || ' ' || w[1 + (i / n) %% n] || ' ' || i
+FROM generate_series(%(start)s, %(stop)s) AS i,
+     (SELECT %(words)s::text[] AS w, %(count)s AS n) AS words
+"""
+
+# recipes using ingredients, skewed so a few ingredients are used a lot
+SEED_USAGE_SQL = """
+INSERT INTO core_recipe (
+    user_id, title, description, time_minutes, price, link, image,
+    updated_at
+)
+SELECT %(user_id)s, 'Bench recipe ' || i, '', 10, 5, '', '', now()
+FROM generate_series(1, %(recipes)s) AS i;
+
+INSERT INTO core_recipe_ingredients (recipe_id, ingredient_id)
+SELECT DISTINCT r.id, ingredients.ids[1 + floor(
+    power(random(), 3) * array_length(ingredients.ids, 1)
+)::int]
+FROM core_recipe r,
+     generate_series(1, 8),
+     (SELECT array_agg(id ORDER BY id) AS ids FROM core_ingredient
+      WHERE user_id = %(user_id)s) AS ingredients
+WHERE r.user_id = %(user_id)s;
+
+ANALYZE core_ingredient;
+ANALYZE core_recipe_ingredients;
+"""
+
+QUERIES = ['s', 'sp', 'spi', 'spinach', 'spinch', 'curry rice', 'avocdo ban']
+
+
+class Command(BaseCommand):
+    """Seed one user with many ingredients and time autocomplete"""
+    help = (
+        'Create a test database, seed one user with many ingredients and '
+        'time the ingredient list api with ?q=.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', type=int, default=50000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the test database and its rows for the next run',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options['keepdb']
+        )
+        try:
+            self._run(options)
+        finally:
+            teardown_databases(
+                old_config, verbosity=0, keepdb=options['keepdb']
+            )
+            teardown_test_environment()
+
+    def _run(self, options):
+        user = self._seed(options['ingredients'], options['recipes'])
+        view = IngredientViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        path = reverse('recipe:ingredient-list')
+        with override_settings(API_RESPONSE_CACHE_TIMEOUT=0):
+            for q in QUERIES:
+                latencies = []
+                for _ in range(options['requests']):
+                    request = factory.get(path, {'q': q})
+                    force_authenticate(request, user)
+                    start = time.perf_counter()
+                    response = view(request)
+                    response.render()
+                    latencies.append(time.perf_counter() - start)
+                self._report(q, latencies, response)
+
+    def _seed(self, ingredients, recipes):
+        """bench user with ingredients used by skewed recipes"""
+        user, created = get_user_model().objects.get_or_create(
+            email=BENCH_EMAIL
+        )
+        if Ingredient.objects.filter(user=user).exists():
+            return user
+        with connection.cursor() as cursor:
+            cursor.execute(SEED_SQL, {
+                'user_id': user.id,
+                'start': 0,
+                'stop': ingredients - 1,
+                'words': WORDS,
+                'count': len(WORDS),
+            })
+            cursor.execute(SEED_USAGE_SQL, {
+                'user_id': user.id,
+                'recipes': recipes,
+            })
+        self.stdout.write(f'seeded {ingredients} ingredients')
+        return user
+
+    def _report(self, q, latencies, response):
+        latencies = sorted(latencies)
+        self.stdout.write(
+            f'{q!r:>14}: p50 {statistics.median(latencies) * 1000:6.2f} ms'
+            f'  p95 {percentile(latencies, 95) * 1000:6.2f} ms'
+            f'  p99 {percentile(latencies, 99) * 1000:6.2f} ms'
+            f'  results {len(response.data)}'
+        )
@@ -0,0 +1,192 @@
+"""
+Compare direct and pooled database connections under concurrent load
+"""
+import statistics
+import threading
+import time
+import uuid
+
+import psycopg2
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import RequestFactory
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from core.benchmark import percentile
+from core.db.backends.postgresql.pools import close_pools
+from core.models import Tag
+
+MODES = ('direct', 'pooled')
+
+
+def start_response(status, headers):
+    """WSGI start_response keeping nothing"""
+
+
+class ConnectionSampler(threading.Thread):
+    """Peak count of the sessions open on a database"""
+
+    def __init__(self, conn_params, interval=0.005):
+        super().__init__(daemon=True)
+        self.conn_params = conn_params
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        sampler = psycopg2.connect(**self.conn_params)
+        # each count in a transaction of its own, a transaction sees
+        # the same pg_stat_activity throughout
+        sampler.autocommit = True
+        try:
+            with sampler.cursor() as cursor:
+                while not self._stopped.wait(self.interval):
+                    cursor.execute(
+                        'SELECT count(*) FROM pg_stat_activity '
+                        'WHERE datname = current_database() '
+                        'AND pid <> pg_backend_pid()'
+                    )
+                    self.peak = max(self.peak, cursor.fetchone()[0])
+        finally:
+            sampler.close()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Command(BaseCommand):
+    """Load compare connecting per request and the connection pool"""
+    help = (
+        'Create a test database and run concurrent GETs through the WSGI '
+        'handler, one thread per worker, connecting per request and then '
+        'taking connections from the pool. Reports latency and the peak '
+        'number of sessions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=20)
+        parser.add_argument(
+            '--pool-size', type=int, default=5,
+            help='MAX_SIZE of the pool, fewer than threads to show waits',
+        )
+        parser.add_argument(
+            '--url', default='recipe:tag-list',
+            help='Name of the url to GET',
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the test database for the next run',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options['keepdb']
+        )
+        try:
+            self._bench(options)
+        finally:
+            teardown_databases(
+                old_config, verbosity=0, keepdb=options['keepdb']
+            )
+            teardown_test_environment()
+
+    def _bench(self, options):
+        """run every mode against the test database"""
+        user, token = self._create_fixture()
+        environ = RequestFactory().get(
+            reverse(options['url']),
+            HTTP_AUTHORIZATION=f'Token {token}',
+        ).environ
+        handler = WSGIHandler()
+        pool_options = connections.databases['default'].setdefault(
+            'POOL', {}
+        )
+        max_size = pool_options.get('MAX_SIZE', 0)
+        connection.ensure_connection()
+        conn_params = connection.get_connection_params()
+        connection.close()
+        try:
+            for mode in MODES:
+                pool_options['MAX_SIZE'] = (
+                    options['pool_size'] if mode == 'pooled' else 0
+                )
+                close_pools()
+                with override_settings(API_RESPONSE_CACHE_TIMEOUT=0):
+                    result = self._run(handler, environ, conn_params, options)
+                self._report(mode, *result)
+        finally:
+            pool_options['MAX_SIZE'] = max_size
+            close_pools()
+            user.delete()
+
+    def _create_fixture(self):
+        """throwaway user with tags and a token"""
+        user = get_user_model().objects.create_user(
+            f'bench-{uuid.uuid4().hex}@example.com',
+            uuid.uuid4().hex,
+        )
+        Tag.objects.resolve(user, [f'Tag {i}' for i in range(5)])
+        return user, Token.objects.create(user=user).key
+
+    def _run(self, handler, environ, conn_params, options):
+        """send the requests from the threads, return latencies, errors,
+        elapsed seconds and the peak number of sessions"""
+        latencies = []
+        errors = []
+        remaining = iter(range(options['requests']))
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        break
+                start = time.perf_counter()
+                response = handler(dict(environ), start_response)
+                # request_finished, the connection is closed or returned
+                response.close()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+
+        sampler = ConnectionSampler(conn_params)
+        sampler.start()
+        threads = [
+            threading.Thread(target=work) for _ in range(options['threads'])
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+        return latencies, len(errors), elapsed, sampler.peak
+
+    def _report(self, mode, latencies, errors, elapsed, peak):
+        latencies = sorted(latencies)
+        self.stdout.write(
+            f'{mode:>6}: {len(latencies) / elapsed:8.1f} req/s  '
+            f'p50 {statistics.median(latencies) * 1000:7.1f} ms  '
+            f'p95 {percentile(latencies, 95) * 1000:7.1f} ms  '
+            f'peak sessions {peak:3}  errors {errors}'
+        )
+        if settings.DATABASES['default'].get('CONN_MAX_AGE'):
+            self.stdout.write(self.style.WARNING(
+                'CONN_MAX_AGE is set, connections outlive requests'
+            ))
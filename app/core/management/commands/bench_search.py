@@ -0,0 +1,128 @@
+"""
+Measure recipe full text search latency on a large table
+"""
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.benchmark import WORDS, percentile
+from core.models import Recipe
+from recipe.views import RecipeViewSet
+
+BENCH_EMAIL = 'bench-search@example.com'
+
+SEED_SQL = """
+INSERT INTO core_recipe (
+    user_id, title, description, time_minutes, price, link, image,
+    updated_at
+)
+SELECT
+    %(user_id)s,
+    w[1 + i %% n] || ' ' || w[1 + (i / n) %% n] || ' ' || i,
+    w[1 + (i * 7) %% n] || ' ' || w[1 + (i * 13) %% n] || ' with '
+        || w[1 + (i * 31) %% n] || ' and ' || w[1 + (i * 37) %% n],
+    10 + i %% 120,
+    (i %% 9000) / 100.0,
+    '',
+    '',
+    now()
+FROM generate_series(%(start)s, %(stop)s) AS i,
+     (SELECT %(words)s::text[] AS w, %(count)s AS n) AS words
+"""
+
+SEARCHES = {
+    'common word': 'curry',
+    'two words': 'thai curry',
+    'phrase': '"green curry"',
+    'excluded word': 'curry -chicken',
+    'rare': '424242',
+    'no match': 'xylophone',
+}
+
+
+class Command(BaseCommand):
+    """Seed many recipes for one user and time the search list api"""
+    help = (
+        'Create a test database, seed it with many recipes and time the '
+        'recipe list api with ?search= over the large table.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1000000)
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--chunk', type=int, default=100000)
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the test database and its recipes for the next run',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options['keepdb']
+        )
+        try:
+            self._run(options)
+        finally:
+            teardown_databases(
+                old_config, verbosity=0, keepdb=options['keepdb']
+            )
+            teardown_test_environment()
+
+    def _run(self, options):
+        user = self._seed(options['recipes'], options['chunk'])
+        view = RecipeViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        path = reverse('recipe:recipe-list')
+        with override_settings(API_RESPONSE_CACHE_TIMEOUT=0):
+            for name, terms in SEARCHES.items():
+                latencies = []
+                for _ in range(options['requests']):
+                    request = factory.get(path, {'search': terms})
+                    force_authenticate(request, user)
+                    start = time.perf_counter()
+                    response = view(request)
+                    response.render()
+                    latencies.append(time.perf_counter() - start)
+                self._report(name, latencies, response)
+
+    def _seed(self, count, chunk):
+        """bench user with at least count recipes"""
+        user, created = get_user_model().objects.get_or_create(
+            email=BENCH_EMAIL
+        )
+        existing = Recipe.objects.filter(user=user).count()
+        with connection.cursor() as cursor:
+            for start in range(existing, count, chunk):
+                stop = min(start + chunk, count) - 1
+                cursor.execute(SEED_SQL, {
+                    'user_id': user.id,
+                    'start': start,
+                    'stop': stop,
+                    'words': WORDS,
+                    'count': len(WORDS),
+                })
+                self.stdout.write(f'seeded {stop + 1} recipes')
+            if existing < count:
+                cursor.execute('ANALYZE core_recipe')
+        return user
+
+    def _report(self, name, latencies, response):
+        latencies = sorted(latencies)
+        self.stdout.write(
+            f'{name:>14}: p50 {statistics.median(latencies) * 1000:7.1f} ms'
+            f'  p95 {percentile(latencies, 95) * 1000:7.1f} ms'
+            f'  results {len(response.data["results"])}'
+        )
@@ -0,0 +1,225 @@
+"""
+Benchmark the api endpoints against a seeded dataset
+"""
+import json
+import logging
+import os
+import platform
+import subprocess
+from io import StringIO
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.utils import timezone
+
+from core import benchmark
+from core.management.commands.generate_dataset import EMAIL_DOMAIN
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks',
+                                'baseline.json')
+
+
+class Command(BaseCommand):
+    """Run every endpoint scenario in process and report or compare"""
+    help = (
+        'Create a test database, seed it with generate_dataset and time the '
+        'recipe, tag, ingredient and user endpoints: latency percentiles, '
+        'SQL queries and allocated memory. Writes a JSON report and fails '
+        'on regressions against the baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument(
+            '--memory-iterations', type=int, default=5,
+            help='Traced requests per scenario for the memory figures',
+        )
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios',
+            help='Run only this scenario, can be repeated',
+        )
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the test database and its dataset for the next run',
+        )
+        parser.add_argument(
+            '--response-cache', action='store_true',
+            help='Keep the response cache on, by default every GET queries',
+        )
+        parser.add_argument(
+            '--server-timing', action='store_true',
+            help='Turn the Server-Timing middleware on, to measure its '
+                 'overhead, its log lines are dropped',
+        )
+        parser.add_argument(
+            '--output', default='benchmark-report.json',
+            help='Where to write the JSON report',
+        )
+        parser.add_argument(
+            '--baseline', default=DEFAULT_BASELINE,
+            help='Report to compare with',
+        )
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Write the report to the baseline instead of comparing',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Allowed p50 and p95 growth, 0.2 is 20%%',
+        )
+        parser.add_argument(
+            '--min-delta-ms', type=float, default=1.0,
+            help='Latency growth below this is noise',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options['keepdb']
+        )
+        try:
+            results = self._run(options)
+        finally:
+            teardown_databases(
+                old_config, verbosity=0, keepdb=options['keepdb']
+            )
+            teardown_test_environment()
+
+        report = {'meta': self._meta(options), 'results': results}
+        self._write(options['output'], report)
+        if options['save_baseline']:
+            self._write(options['baseline'], report)
+            self.stdout.write(f'baseline saved to {options["baseline"]}')
+            return
+        self._compare(results, options)
+
+    def _run(self, options):
+        users = get_user_model().objects.filter(
+            email__endswith=f'@{EMAIL_DOMAIN}'
+        )
+        if not users.exists():
+            self.stdout.write('seeding the benchmark dataset')
+            call_command(
+                'generate_dataset',
+                '--users', str(options['users']),
+                '--recipes', str(options['recipes']),
+                '--seed', str(options['seed']),
+                stdout=StringIO(),
+            )
+        # the first user has the most recipes
+        fixture = benchmark.Fixture(
+            users.get(email=f'dataset-0@{EMAIL_DOMAIN}')
+        )
+        unknown = set(options['scenarios'] or ()) - set(
+            benchmark.scenarios(fixture)
+        )
+        if unknown:
+            raise CommandError(f'unknown scenarios {", ".join(unknown)}')
+
+        cache.clear()
+        timeout = settings.API_RESPONSE_CACHE_TIMEOUT
+        if not options['response_cache']:
+            timeout = 0
+        self.stdout.write(
+            f'{"scenario":<26}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"queries":>9}{"sql ms":>9}{"KB":>8}'
+        )
+        server_timing = options['server_timing'] or settings.SERVER_TIMING
+        timing_logger = logging.getLogger('core.timing')
+        handlers = timing_logger.handlers
+        if server_timing:
+            timing_logger.handlers = [logging.NullHandler()]
+        with override_settings(API_RESPONSE_CACHE_TIMEOUT=timeout,
+                               SERVER_TIMING=server_timing):
+            try:
+                return benchmark.run(
+                    fixture,
+                    iterations=options['iterations'],
+                    warmup=options['warmup'],
+                    memory_iterations=options['memory_iterations'],
+                    names=options['scenarios'],
+                    progress=self._progress,
+                )
+            except benchmark.BenchmarkError as error:
+                raise CommandError(str(error))
+            finally:
+                timing_logger.handlers = handlers
+
+    def _progress(self, name, result):
+        self.stdout.write(
+            f'{name:<26}{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+            f'{result["p99_ms"]:>9.2f}{result["queries"]:>9}'
+            f'{result["query_ms"]:>9.2f}{result["memory_kb"]:>8.0f}'
+        )
+
+    def _meta(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        except OSError:
+            commit = ''
+        return {
+            'created': timezone.now().isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+            'dataset': {key: options[key] for key in
+                        ('users', 'recipes', 'seed')},
+            'response_cache': options['response_cache'],
+            'server_timing': options['server_timing'] or
+            settings.SERVER_TIMING,
+        }
+
+    def _write(self, path, report):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+            report_file.write('\n')
+
+    def _compare(self, results, options):
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(
+                f'no baseline at {options["baseline"]}, '
+                f'create one with --save-baseline'
+            )
+            return
+        with open(options['baseline']) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['meta'].get('dataset') != self._meta(options)['dataset']:
+            self.stdout.write(self.style.WARNING(
+                'the baseline was made with another dataset'
+            ))
+        regressions = benchmark.compare(
+            results,
+            baseline['results'],
+            threshold=options['threshold'],
+            min_delta_ms=options['min_delta_ms'],
+        )
+        if regressions:
+            raise CommandError(
+                'regressions against the baseline:\n  '
+                + '\n  '.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'no regression against the baseline'
+        ))
@@ -0,0 +1,249 @@
+"""
+Generate a seeded synthetic dataset of users, recipes, tags and ingredients
+"""
+import itertools
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from PIL import Image
+
+from core.benchmark import WORDS
+from core.bulk import (
+    RecipeLoader,
+    create_constraints,
+    deferrable_constraints,
+    drop_constraints,
+)
+from core.models import Ingredient, Recipe, Tag
+
+EMAIL_DOMAIN = 'dataset.example.com'
+
+TIME_MINUTES = [5, 10, 15, 20, 25, 30, 40, 45, 60, 75, 90, 120, 180, 240]
+
+
+def zipf_cum_weights(count, exponent):
+    """cumulative weights of ranks 1..count under Zipf's law"""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)
+    ))
+
+
+def vocabulary(prefix, count):
+    """count distinct names, the most used ones first"""
+    names = [word.capitalize() for word in WORDS]
+    for i in itertools.count(2):
+        if len(names) >= count:
+            return names[:count]
+        names += [f'{word.capitalize()} {prefix} {i}' for word in WORDS]
+
+
+class Command(BaseCommand):
+    """Bulk load a reproducible dataset for benchmarks and query plans"""
+    help = (
+        'Create users dataset-N@dataset.example.com with a skewed number of '
+        'recipes each, tags and ingredients reused following Zipf\'s law. '
+        'The same options and seed always give the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=100000,
+                            help='Total recipes over all users')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--user-skew', type=float, default=1.0,
+            help='Zipf exponent of the number of recipes per user',
+        )
+        parser.add_argument(
+            '--tags', type=int, default=200,
+            help='Distinct tag names a user may have',
+        )
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Distinct ingredient names a user may have',
+        )
+        parser.add_argument('--tags-per-recipe', type=int, default=3)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument(
+            '--name-skew', type=float, default=1.1,
+            help='Zipf exponent of tag and ingredient reuse',
+        )
+        parser.add_argument(
+            '--images', type=int, default=0,
+            help='Distinct images shared by the recipes having one',
+        )
+        parser.add_argument(
+            '--image-ratio', type=float, default=0.5,
+            help='Share of recipes with an image when --images is set',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE,
+        )
+        parser.add_argument(
+            '--defer-indexes', action='store_true',
+            help='Drop the plain indexes and foreign keys of the recipe, tag '
+                 'and ingredient tables during the load and build them at '
+                 'the end',
+        )
+        parser.add_argument(
+            '--flush', action='store_true',
+            help='Delete a previously generated dataset first',
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(
+            email__endswith=f'@{EMAIL_DOMAIN}'
+        )
+        if options['flush']:
+            self._flush(users)
+        elif users.exists():
+            raise CommandError(
+                'A dataset exists already, pass --flush to replace it.'
+            )
+
+        rng = random.Random(options['seed'])
+        user_ids = self._create_users(options['users'])
+        images = self._create_images(rng, options['images'])
+
+        deferred = []
+        if options['defer_indexes']:
+            with connection.cursor() as cursor:
+                deferred = deferrable_constraints(cursor)
+                drop_constraints(cursor, deferred)
+        try:
+            self._load(rng, user_ids, images, options)
+        finally:
+            if deferred:
+                start = time.monotonic()
+                with connection.cursor() as cursor:
+                    create_constraints(cursor, deferred)
+                self.stdout.write(
+                    f'built {len(deferred)} indexes and foreign keys in '
+                    f'{time.monotonic() - start:.1f}s'
+                )
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def _flush(self, users):
+        """raw deletes, the ORM would load every recipe for the signals"""
+        user_ids = list(users.values_list('id', flat=True))
+        if not user_ids:
+            return
+        with connection.cursor() as cursor:
+            for through in ('core_recipe_tags', 'core_recipe_ingredients'):
+                cursor.execute(
+                    f'DELETE FROM {through} WHERE recipe_id IN '
+                    f'(SELECT id FROM core_recipe WHERE user_id = ANY(%s))',
+                    [user_ids],
+                )
+            for table in ('core_recipe', 'core_tag', 'core_ingredient'):
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE user_id = ANY(%s)',
+                    [user_ids],
+                )
+        users.delete()
+        self.stdout.write(f'deleted {len(user_ids)} dataset users')
+
+    def _create_users(self, count):
+        password = make_password(None)
+        get_user_model().objects.bulk_create([
+            get_user_model()(
+                email=f'dataset-{i}@{EMAIL_DOMAIN}',
+                name=f'Dataset user {i}',
+                password=password,
+            )
+            for i in range(count)
+        ], batch_size=1000)
+        emails = {
+            email: user_id
+            for user_id, email in get_user_model().objects.filter(
+                email__endswith=f'@{EMAIL_DOMAIN}'
+            ).values_list('id', 'email')
+        }
+        return [emails[f'dataset-{i}@{EMAIL_DOMAIN}'] for i in range(count)]
+
+    def _create_images(self, rng, count):
+        """names of count small distinct JPEGs in the recipe image storage"""
+        field = Recipe._meta.get_field('image')
+        names = []
+        for _ in range(count):
+            image = Image.new('RGB', (64, 48), tuple(
+                rng.randrange(256) for _ in range(3)
+            ))
+            image.paste(
+                tuple(rng.randrange(256) for _ in range(3)),
+                (rng.randrange(32), rng.randrange(24), 64, 48),
+            )
+            content = ContentFile(b'')
+            image.save(content, format='JPEG')
+            names.append(field.storage.save(
+                field.generate_filename(None, 'dataset.jpg'), content
+            ))
+        return names
+
+    def _recipes(self, rng, user_ids, images, options):
+        """records for the loader, in a fixed order for a seed"""
+        owners = zipf_cum_weights(len(user_ids), options['user_skew'])
+        tags = vocabulary('tag', options['tags'])
+        ingredients = vocabulary('ingredient', options['ingredients'])
+        tag_weights = zipf_cum_weights(len(tags), options['name_skew'])
+        ingredient_weights = zipf_cum_weights(
+            len(ingredients), options['name_skew']
+        )
+        words = [word.capitalize() for word in WORDS]
+
+        def sample(names, cum_weights, mean):
+            count = rng.randint(max(mean - 2, 0), mean + 2)
+            return rng.choices(names, cum_weights=cum_weights, k=count)
+
+        for i in range(options['recipes']):
+            yield {
+                'user_id': rng.choices(user_ids, cum_weights=owners)[0],
+                'title': f'{" ".join(rng.choices(words, k=3))} {i}',
+                'description': ' '.join(rng.choices(WORDS, k=20)),
+                'time_minutes': rng.choice(TIME_MINUTES),
+                'price': f'{rng.randint(100, 9999) / 100:.2f}',
+                'link': '',
+                'image': rng.choice(images) if images and
+                rng.random() < options['image_ratio'] else None,
+                'tags': sample(tags, tag_weights, options['tags_per_recipe']),
+                'ingredients': sample(
+                    ingredients, ingredient_weights,
+                    options['ingredients_per_recipe'],
+                ),
+            }
+
+    def _load(self, rng, user_ids, images, options):
+        loader = RecipeLoader()
+        records = self._recipes(rng, user_ids, images, options)
+        start = time.monotonic()
+        loaded = 0
+        while True:
+            batch = list(itertools.islice(records, options['batch_size']))
+            if not batch:
+                break
+            loader.load(batch)
+            loaded += len(batch)
+            rate = loaded / max(time.monotonic() - start, 1e-9)
+            self.stdout.write(f'{loaded} recipes, {rate:.0f} rows/s')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'generated {len(user_ids)} users and {loaded} recipes in '
+            f'{time.monotonic() - start:.1f}s'
+        ))
+        busiest = Recipe.objects.filter(user_id__in=user_ids).values(
+            'user_id'
+        ).annotate(count=Count('id')).order_by('-count').first()
+        self.stdout.write(
+            f'most recipes for one user: {busiest and busiest["count"]}, '
+            f'tags: {Tag.objects.filter(user_id__in=user_ids).count()}, '
+            f'ingredients: '
+            f'{Ingredient.objects.filter(user_id__in=user_ids).count()}'
+        )
@@ -0,0 +1,26 @@
+"""
+Generate the missing resized variants of recipe images
+"""
+from django.core.management.base import BaseCommand
+
+from core.images import generate_variants
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    """render variants of every recipe image, existing ones are skipped"""
+    help = 'Generate missing thumbnail and medium variants of recipe images'
+
+    def handle(self, *args, **options):
+        # stored images are content-addressed and shared between recipes
+        images = Recipe.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).values_list('image', flat=True).order_by('image').distinct()
+        created = failed = 0
+        for image_name in images.iterator():
+            try:
+                created += len(generate_variants(image_name))
+            except (OSError, ValueError) as exc:
+                failed += 1
+                self.stderr.write(f'{image_name}: {exc}')
+        self.stdout.write(f'{created} variants created, {failed} failed')
@@ -0,0 +1,303 @@
+"""
+Bulk import recipes from NDJSON or CSV
+"""
+import csv
+import json
+import os
+import sys
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.bulk import (
+    RELATED_FIELDS,
+    RecipeLoader,
+    create_constraints,
+    deferrable_constraints,
+    drop_constraints,
+)
+from core.models import Recipe
+
+# recipe fields read from each record, the rest is ignored
+FIELDS = ['title', 'description', 'time_minutes', 'price', 'link']
+
+
+class InvalidRecord(Exception):
+    """a record that cannot be imported, with the reason"""
+
+
+class Command(BaseCommand):
+    """Load recipes with COPY in batched transactions"""
+    help = (
+        'Import recipes from an NDJSON or CSV file, in the format of the '
+        'recipe export api. Tags and ingredients are lists of names, the '
+        'owner is the "user" email of a record or --user. Ids and images '
+        'are not imported.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, - for stdin')
+        parser.add_argument(
+            '--format', choices=['ndjson', 'csv'],
+            help='Input format, from the file extension by default',
+        )
+        parser.add_argument(
+            '--user', help='Email of the owner of records without a user',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE,
+            help='Records per transaction',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Progress file, a rerun with the same file resumes after '
+                 'the last committed batch',
+        )
+        parser.add_argument(
+            '--defer-indexes', action='store_true',
+            help='Drop the plain indexes and foreign keys of the recipe, tag '
+                 'and ingredient tables during the load and build them once '
+                 'at the end, for cold loads. Needs --checkpoint, which '
+                 'keeps their definitions until they are built again',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if fmt not in ('ndjson', 'csv'):
+            raise CommandError('Use --format ndjson or csv.')
+        if options['defer_indexes'] and not options['checkpoint']:
+            raise CommandError(
+                '--defer-indexes needs --checkpoint, the dropped indexes '
+                'and foreign keys are rebuilt from it after a crash.'
+            )
+
+        self.default_user = options['user']
+        self.user_ids = {}
+        if self.default_user:
+            try:
+                self._user_id(self.default_user)
+            except InvalidRecord as error:
+                raise CommandError(str(error))
+        self.checkpoint_path = options['checkpoint']
+        self.checkpoint = self._read_checkpoint(path)
+        if self.checkpoint.get('done'):
+            self.stdout.write(f'{path} is already imported')
+            return
+
+        # what an interrupted run dropped is still pending
+        deferred = self.checkpoint.get('deferred') or []
+        if options['defer_indexes'] and not deferred:
+            with connection.cursor() as cursor:
+                deferred = deferrable_constraints(cursor)
+                self.checkpoint['deferred'] = deferred
+                self._write_checkpoint()
+                drop_constraints(cursor, deferred)
+            self.stdout.write(
+                f'deferred {len(deferred)} indexes and foreign keys'
+            )
+
+        stream = sys.stdin if path == '-' else \
+            open(path, encoding='utf-8', newline='')
+        try:
+            self._import(stream, fmt, options['batch_size'])
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if deferred:
+                self._create_constraints(deferred)
+                self.checkpoint['deferred'] = []
+                self._write_checkpoint()
+
+        self.checkpoint['done'] = True
+        self._write_checkpoint()
+
+    def _import(self, stream, fmt, batch_size):
+        loader = RecipeLoader()
+        skip = self.checkpoint.setdefault('records', 0)
+        self.checkpoint.setdefault('imported', 0)
+        self.skipped = self.checkpoint.setdefault('skipped', 0)
+        if skip:
+            self.stdout.write(f'resuming after record {skip}')
+
+        self.start = time.monotonic()
+        self.imported = 0
+        batch = []
+        number = skip
+        for number, data in enumerate(self._read(stream, fmt), 1):
+            if number <= skip:
+                continue
+            try:
+                batch.append(self._clean(data))
+            except InvalidRecord as error:
+                self.skipped += 1
+                self.stderr.write(f'record {number}: {error}')
+            if len(batch) == batch_size:
+                self._load(loader, batch, number)
+                batch = []
+        self._load(loader, batch, number)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'imported {self.checkpoint["imported"]} recipes, skipped '
+            f'{self.checkpoint["skipped"]}, {self._rate():.0f} rows/s'
+        ))
+
+    def _rate(self):
+        return self.imported / max(time.monotonic() - self.start, 1e-9)
+
+    def _load(self, loader, batch, number):
+        """commit a batch with the progress up to record number"""
+        progress = {
+            'records': number,
+            'imported': self.checkpoint['imported'] + len(batch),
+            'skipped': self.skipped,
+        }
+        with transaction.atomic():
+            loader.load(batch)
+            if self.checkpoint_path:
+                # the progress holds if this transaction commits, a rerun
+                # asks the database whether it did
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT txid_current()')
+                    progress['txid'] = cursor.fetchone()[0]
+                self.checkpoint['pending'] = progress
+                self._write_checkpoint()
+        self.checkpoint.pop('pending', None)
+        progress.pop('txid', None)
+        self.checkpoint.update(progress)
+        self._write_checkpoint()
+        self.imported += len(batch)
+        if batch:
+            self.stdout.write(
+                f'{self.checkpoint["imported"]} recipes imported, '
+                f'{self._rate():.0f} rows/s'
+            )
+
+    def _read(self, stream, fmt):
+        """records as dicts, or the error of a record that cannot be read"""
+        if fmt == 'ndjson':
+            for line in stream:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as error:
+                    yield InvalidRecord(f'invalid JSON, {error}')
+            return
+
+        for row in csv.DictReader(stream):
+            for field_name in RELATED_FIELDS:
+                value = (row.get(field_name) or '').strip()
+                try:
+                    row[field_name] = json.loads(value) if value else []
+                except ValueError:
+                    row[field_name] = InvalidRecord(
+                        f'{field_name} must be a JSON list of names'
+                    )
+            yield row
+
+    def _user_id(self, email):
+        if not email:
+            raise InvalidRecord('no user, pass --user')
+        if email not in self.user_ids:
+            user_id = get_user_model().objects.filter(
+                email=email
+            ).values_list('id', flat=True).first()
+            if user_id is None:
+                raise InvalidRecord(f'unknown user {email}')
+            self.user_ids[email] = user_id
+        return self.user_ids[email]
+
+    def _clean(self, data):
+        """record for the loader, raise InvalidRecord"""
+        if isinstance(data, InvalidRecord):
+            raise data
+        if not isinstance(data, dict):
+            raise InvalidRecord('not an object')
+
+        record = {'user_id': self._user_id(
+            data.get('user') or self.default_user
+        )}
+        errors = {}
+        for name in FIELDS:
+            field = Recipe._meta.get_field(name)
+            value = data.get(name)
+            if value is None and field.blank:
+                value = ''
+            try:
+                record[name] = field.clean(value, None)
+            except ValidationError as error:
+                errors[name] = ' '.join(error.messages)
+
+        for name in RELATED_FIELDS:
+            names = data.get(name) or []
+            if isinstance(names, InvalidRecord):
+                raise names
+            name_field = Recipe._meta.get_field(name) \
+                .related_model._meta.get_field('name')
+            try:
+                if not isinstance(names, list):
+                    raise ValidationError('Must be a list of names.')
+                record[name] = [
+                    name_field.clean(
+                        item.get('name') if isinstance(item, dict) else item,
+                        None,
+                    )
+                    for item in names
+                ]
+            except ValidationError as error:
+                errors[name] = ' '.join(error.messages)
+
+        if errors:
+            raise InvalidRecord(json.dumps(errors))
+        return record
+
+    def _read_checkpoint(self, path):
+        source = os.path.abspath(path)
+        if not self.checkpoint_path or \
+                not os.path.exists(self.checkpoint_path):
+            return {'source': source}
+        with open(self.checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint.get('source') != source:
+            raise CommandError(
+                f'{self.checkpoint_path} records the import of '
+                f'{checkpoint.get("source")}'
+            )
+        pending = checkpoint.pop('pending', None)
+        if pending:
+            # interrupted between the commit of a batch and the checkpoint
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT txid_status(%s)', [pending['txid']])
+                status = cursor.fetchone()[0]
+            if status == 'committed':
+                del pending['txid']
+                checkpoint.update(pending)
+            elif status != 'aborted':
+                raise CommandError(
+                    f'cannot tell whether the batch up to record '
+                    f'{pending["records"]} was committed ({status})'
+                )
+        return checkpoint
+
+    def _write_checkpoint(self):
+        """replace the progress file atomically"""
+        if not self.checkpoint_path:
+            return
+        temp_path = f'{self.checkpoint_path}.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(self.checkpoint, checkpoint_file)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _create_constraints(self, deferred):
+        start = time.monotonic()
+        with connection.cursor() as cursor:
+            create_constraints(cursor, deferred)
+        self.stdout.write(
+            f'built {len(deferred)} indexes and foreign keys in '
+            f'{time.monotonic() - start:.1f}s'
+        )
@@ -0,0 +1,136 @@
+"""
+List and aggregate the request profiles of the profiling middleware
+"""
+import collections
+import pstats
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.profiling import list_profiles, prune_profiles, sign_profile_token
+
+
+class Command(BaseCommand):
+    """Inspect the profile ring buffer in PROFILE_DIR"""
+    help = (
+        'list: the stored profiles, newest last. aggregate: the cProfile '
+        'stats of the matching profiles merged, and their sampled stacks '
+        'merged into one collapsed stack file. sign EMAIL: an X-Profile '
+        'header value that gets the requests of a staff user profiled. '
+        'clear: delete every profile.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'action', choices=['list', 'aggregate', 'sign', 'clear'],
+            nargs='?', default='list',
+        )
+        parser.add_argument('email', nargs='?', help='Staff user to sign')
+        parser.add_argument(
+            '--path', help='Only profiles of request paths containing this',
+        )
+        parser.add_argument(
+            '--min-ms', type=float, default=0,
+            help='Only profiles of requests that took at least this long',
+        )
+        parser.add_argument(
+            '--sort', default='cumulative',
+            help='pstats sort key of the aggregated cProfile stats',
+        )
+        parser.add_argument(
+            '--limit', type=int, default=30,
+            help='Functions or frames shown by aggregate',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the merged collapsed stacks to this file, for '
+                 'flamegraph.pl or speedscope',
+        )
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'sign':
+            self.stdout.write(self._sign(options['email']))
+            return
+        if action == 'clear':
+            prune_profiles(settings.PROFILE_DIR, 0)
+            return
+
+        profiles = [
+            profile for profile in list_profiles()
+            if (options['path'] or '') in profile['path']
+            and profile['duration_ms'] >= options['min_ms']
+        ]
+        if action == 'list':
+            self._list(profiles)
+        else:
+            self._aggregate(profiles, options)
+
+    def _sign(self, email):
+        if not email:
+            raise CommandError('sign needs the email of a staff user.')
+        user = get_user_model().objects.filter(email=email).first()
+        if user is None or not user.is_staff or not user.is_active:
+            raise CommandError(f'{email} is not an active staff user.')
+        return sign_profile_token(user)
+
+    def _list(self, profiles):
+        for profile in profiles:
+            query = f'?{profile["query"]}' if profile['query'] else ''
+            self.stdout.write(
+                f'{profile["created"][:19]}  {profile["duration_ms"]:>9.1f} '
+                f'ms  {profile["status"]}  {profile["reason"]:<9}  '
+                f'{profile["file"]}  {profile["method"]} '
+                f'{profile["path"]}{query}'
+            )
+        self.stdout.write(f'{len(profiles)} profiles')
+
+    def _aggregate(self, profiles, options):
+        pstats_paths = [profile['file_path'] for profile in profiles
+                        if profile['profiler'] == 'cprofile']
+        sampled = [profile['file_path'] for profile in profiles
+                   if profile['profiler'] == 'sampler']
+        if not pstats_paths and not sampled:
+            raise CommandError('No profile matches.')
+
+        if pstats_paths:
+            self.stdout.write(f'cProfile stats of {len(pstats_paths)} '
+                              f'requests')
+            stats = pstats.Stats(*pstats_paths, stream=self.stdout)
+            stats.sort_stats(options['sort']).print_stats(options['limit'])
+
+        if sampled:
+            stacks = collections.Counter()
+            for path in sampled:
+                with open(path) as stacks_file:
+                    for line in stacks_file:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        stacks[stack] += int(count)
+            self._frames(stacks, len(sampled), options['limit'])
+            if options['output']:
+                with open(options['output'], 'w') as output:
+                    for stack, count in stacks.most_common():
+                        output.write(f'{stack} {count}\n')
+                self.stdout.write(f'merged stacks written to '
+                                  f'{options["output"]}')
+
+    def _frames(self, stacks, requests, limit):
+        """the frames most samples stopped in, with their total share"""
+        total = sum(stacks.values())
+        inclusive = collections.Counter()
+        own = collections.Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        self.stdout.write(f'{total} samples of {requests} requests')
+        if not total:
+            return
+        self.stdout.write(f'{"self %":>8}{"total %":>8}  frame')
+        for frame, count in own.most_common(limit):
+            self.stdout.write(
+                f'{count / total:>8.1%}{inclusive[frame] / total:>8.1%}  '
+                f'{frame}'
+            )
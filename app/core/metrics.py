@@ -0,0 +1,461 @@
+"""
+Prometheus metrics shared by the worker processes
+
+Every process keeps its values in its own memory mapped files in
+METRICS_DIR, one for counters and histograms and one for gauges. An update
+is a dict lookup and an 8 byte write under a lock of the process, never a
+lock between processes. The /metrics view reads the files of all the
+processes and adds them up. Counters of exited processes keep counting
+towards the totals, gauges of exited processes are dropped.
+
+METRICS_DIR is meant to be emptied when the service starts, a new process
+with the pid of an old one would add to the old counters.
+"""
+import asyncio
+import functools
+import glob
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from core.timing import request_queries, watch_queries
+
+# request latency buckets, in seconds
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf,
+)
+
+_INITIAL_SIZE = 64 * 1024
+
+
+def _padded(length):
+    """length of a key with its length prefix padded to 8 bytes"""
+    return length + (8 - (length + 4) % 8) % 8
+
+
+class MmapedValues:
+    """float values by key in a file, updated in place
+
+    The file starts with the number of bytes used, followed by entries of
+    a key length, the padded utf-8 key and an aligned double.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'a+b')
+        capacity = os.fstat(self._file.fileno()).st_size
+        if capacity == 0:
+            capacity = _INITIAL_SIZE
+            self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+        self._positions = {}
+        used = struct.unpack_from('i', self._map, 0)[0]
+        if used == 0:
+            used = 8
+            struct.pack_into('i', self._map, 0, used)
+        self._used = used
+        for key, _, position in _entries(self._map, used):
+            self._positions[key] = position
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            encoded = key.encode()
+            padded = _padded(len(encoded))
+            size = 4 + padded + 8
+            while self._used + size > len(self._map):
+                self._grow()
+            struct.pack_into(
+                f'i{padded}sd', self._map, self._used,
+                len(encoded), encoded, 0.0,
+            )
+            position = self._positions[key] = self._used + 4 + padded
+            # readers only see the entry once it is complete
+            self._used += size
+            struct.pack_into('i', self._map, 0, self._used)
+        return position
+
+    def _grow(self):
+        capacity = len(self._map) * 2
+        self._map.close()
+        self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+
+    def add(self, key, amount):
+        position = self._position(key)
+        value = struct.unpack_from('d', self._map, position)[0]
+        struct.pack_into('d', self._map, position, value + amount)
+
+    def set(self, key, value):
+        struct.pack_into('d', self._map, self._position(key), value)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def _entries(data, used):
+    """(key, value, value position) of the entries of a values file"""
+    position = 8
+    while position < used:
+        length = struct.unpack_from('i', data, position)[0]
+        position += 4
+        key = bytes(data[position:position + length]).decode()
+        position += _padded(length)
+        yield key, struct.unpack_from('d', data, position)[0], position
+        position += 8
+
+
+def read_values(path):
+    """the values of a file written by another process"""
+    with open(path, 'rb') as values_file:
+        data = values_file.read()
+    if len(data) < 8:
+        return {}
+    used = min(struct.unpack_from('i', data, 0)[0], len(data))
+    return {key: value for key, value, _ in _entries(data, used)}
+
+
+class MetricStore:
+    """The values files of the current process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._files = {}
+
+    def _values(self, kind):
+        # a forked worker gets files of its own
+        if self._pid != os.getpid():
+            for values in self._files.values():
+                values.close()
+            self._files = {}
+            self._pid = os.getpid()
+        values = self._files.get(kind)
+        if values is None:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            values = self._files[kind] = MmapedValues(os.path.join(
+                settings.METRICS_DIR, f'{kind}_{self._pid}.db'
+            ))
+        return values
+
+    def add(self, kind, items):
+        """add the amounts of (key, amount) items"""
+        if not settings.METRICS:
+            return
+        with self._lock:
+            values = self._values(kind)
+            for key, amount in items:
+                values.add(key, amount)
+
+    def set(self, kind, key, value):
+        if not settings.METRICS:
+            return
+        with self._lock:
+            self._values(kind).set(key, value)
+
+    def reset(self):
+        """forget the open files, after METRICS_DIR changed"""
+        with self._lock:
+            for values in self._files.values():
+                values.close()
+            self._files = {}
+            self._pid = None
+
+
+store = MetricStore()
+
+REGISTRY = []
+
+
+@functools.lru_cache(maxsize=4096)
+def _key(sample, labels):
+    """key of a sample in the files, labels as sorted (name, value)"""
+    return json.dumps([sample, labels])
+
+
+class Metric:
+    """A metric family, updates take the label values as keywords"""
+    type = None
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._labelset = set(labelnames)
+        REGISTRY.append(self)
+
+    def _labels(self, labels):
+        if labels.keys() != self._labelset:
+            raise ValueError(
+                f'{self.name} takes the labels {", ".join(self.labelnames)}'
+            )
+        return tuple(sorted(
+            (name, str(value)) for name, value in labels.items()
+        ))
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        store.add(self.kind, [(_key(self.name, self._labels(labels)), amount)])
+
+
+class Gauge(Counter):
+    """Gauge summed over the live processes"""
+    type = 'gauge'
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        store.set(self.kind, _key(self.name, self._labels(labels)), value)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        bucket = next(bound for bound in self.buckets if value <= bound)
+        # buckets are stored apart and made cumulative when exposed
+        store.add(self.kind, [
+            (_key(f'{self.name}_bucket',
+                  tuple(sorted(labels + (('le', _number(bucket)),)))), 1),
+            (_key(f'{self.name}_sum', labels), value),
+            (_key(f'{self.name}_count', labels), 1),
+        ])
+
+
+request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Latency of the requests by view, action and status code.',
+    ['view', 'action', 'status'],
+)
+requests_in_flight = Gauge(
+    'http_requests_in_flight', 'Requests being served.',
+)
+db_queries = Counter(
+    'db_queries_total', 'SQL queries run by the requests of a view.',
+    ['view'],
+)
+db_query_duration = Counter(
+    'db_query_duration_seconds_total',
+    'Time spent in the SQL queries of the requests of a view.',
+    ['view'],
+)
+cache_requests = Counter(
+    'cache_requests_total', 'Cache lookups by cache and result.',
+    ['cache', 'result'],
+)
+image_queue_depth = Gauge(
+    'image_variant_queue_depth',
+    'Images waiting for or in variant generation.',
+)
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect(directory=None):
+    """{sample key: value} added up over the files of all processes"""
+    directory = directory or settings.METRICS_DIR
+    totals = {}
+    for path in glob.glob(os.path.join(directory, '*.db')):
+        match = re.search(r'(\w+)_(\d+)\.db$', path)
+        if not match:
+            continue
+        if match.group(1) == 'gauge' and not _alive(int(match.group(2))):
+            continue
+        try:
+            values = read_values(path)
+        except OSError:
+            continue
+        for key, value in values.items():
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _sample(name, labels, value):
+    if labels:
+        label_text = ','.join(
+            f'{label}="{_escape(label_value)}"'
+            for label, label_value in labels
+        )
+        name = f'{name}{{{label_text}}}'
+    return f'{name} {_number(value)}'
+
+
+def _histogram_lines(metric, samples):
+    """cumulative buckets, sum and count of every label set"""
+    series = {}
+    for (name, labels), value in samples.items():
+        labels = dict(labels)
+        le = labels.pop('le', None)
+        entry = series.setdefault(
+            tuple(sorted(labels.items())), {'buckets': {}}
+        )
+        if name.endswith('_bucket'):
+            entry['buckets'][float(le)] = value
+        else:
+            entry[name[len(metric.name) + 1:]] = value
+    lines = []
+    for labels, entry in sorted(series.items()):
+        cumulative = 0.0
+        for bound in metric.buckets:
+            cumulative += entry['buckets'].get(bound, 0.0)
+            lines.append(_sample(
+                f'{metric.name}_bucket',
+                labels + (('le', _number(bound)),),
+                cumulative,
+            ))
+        lines.append(_sample(f'{metric.name}_sum', labels,
+                             entry.get('sum', 0.0)))
+        lines.append(_sample(f'{metric.name}_count', labels,
+                             entry.get('count', 0.0)))
+    return lines
+
+
+def exposition(directory=None):
+    """all metrics in the Prometheus text format"""
+    families = {}
+    for key, value in collect(directory).items():
+        name, labels = json.loads(key)
+        families.setdefault(name, {})[
+            (name, tuple(tuple(label) for label in labels))
+        ] = value
+
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        if metric.type == 'histogram':
+            samples = {}
+            for suffix in ('_bucket', '_sum', '_count'):
+                samples.update(families.get(metric.name + suffix, {}))
+            lines += _histogram_lines(metric, samples)
+        else:
+            lines += [
+                _sample(name, labels, value) for (name, labels), value
+                in sorted(families.get(metric.name, {}).items())
+            ]
+    lines += _hit_ratio_lines(families.get(cache_requests.name, {}))
+    return '\n'.join(lines) + '\n'
+
+
+def _hit_ratio_lines(samples):
+    """hit share of the lookups of each cache since the start"""
+    lookups = {}
+    for (_, labels), value in samples.items():
+        labels = dict(labels)
+        hits, total = lookups.get(labels['cache'], (0.0, 0.0))
+        if labels['result'] == 'hit':
+            hits += value
+        lookups[labels['cache']] = (hits, total + value)
+    lines = [
+        '# HELP cache_hit_ratio Share of the cache lookups that hit.',
+        '# TYPE cache_hit_ratio gauge',
+    ]
+    for cache_name, (hits, total) in sorted(lookups.items()):
+        if total:
+            lines.append(_sample(
+                'cache_hit_ratio', (('cache', cache_name),), hits / total
+            ))
+    return lines
+
+
+def route(request):
+    """view name and action labels of a request"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched', request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return match.view_name, actions.get(
+        request.method.lower(), request.method.lower()
+    )
+
+
+@sync_and_async_middleware
+class MetricsMiddleware:
+    """Record latency, in flight requests and queries, unless METRICS
+
+    Async under ASGI, the async views keep serving requests concurrently.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = asyncio.iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        watch_queries()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            with request_queries() as queries:
+                response = self.get_response(request)
+        finally:
+            requests_in_flight.dec()
+        self._observe(request, response, start, queries)
+        return response
+
+    async def __acall__(self, request):
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            with request_queries() as queries:
+                response = await self.get_response(request)
+        finally:
+            requests_in_flight.dec()
+        self._observe(request, response, start, queries)
+        return response
+
+    def _observe(self, request, response, start, queries):
+        view, action = route(request)
+        request_duration.observe(
+            time.perf_counter() - start,
+            view=view, action=action, status=response.status_code,
+        )
+        if queries.count:
+            db_queries.inc(queries.count, view=view)
+            db_query_duration.inc(queries.time, view=view)
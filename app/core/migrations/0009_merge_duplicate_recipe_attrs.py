@@ -0,0 +1,51 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:56
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_names(apps, schema_editor):
+    """merge tags and ingredients sharing a name for the same user"""
+    Recipe = apps.get_model('core', 'Recipe')
+    for field_name in ('tags', 'ingredients'):
+        field = Recipe._meta.get_field(field_name)
+        model = field.related_model
+        through = field.remote_field.through
+        attr = field.m2m_reverse_field_name()
+
+        duplicates = model.objects.values('user_id', 'name').annotate(
+            keep_id=Min('id'),
+            total=Count('id'),
+        ).filter(total__gt=1)
+        for dup in duplicates:
+            others = model.objects.filter(
+                user_id=dup['user_id'],
+                name=dup['name'],
+            ).exclude(id=dup['keep_id'])
+            recipe_ids = set(through.objects.filter(
+                **{f'{attr}__in': others}
+            ).values_list('recipe_id', flat=True))
+            through.objects.bulk_create(
+                [
+                    through(recipe_id=recipe_id, **{
+                        f'{attr}_id': dup['keep_id']
+                    })
+                    for recipe_id in recipe_ids
+                ],
+                ignore_conflicts=True,
+            )
+            others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_recipe_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_names,
+            migrations.RunPython.noop,
+        ),
+    ]
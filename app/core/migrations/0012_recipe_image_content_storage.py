@@ -0,0 +1,20 @@
+# Generated by Django 3.2.25 on 2026-10-18 03:14
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, null=True, storage=core.storage.get_recipe_image_storage, upload_to=core.models.get_media_url_path),
+        ),
+    ]
@@ -0,0 +1,40 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import (
+    BtreeGinExtension,
+    TrigramExtension,
+)
+from django.db import migrations
+
+# case insensitive prefix match and order, UPPER(name) COLLATE "C" LIKE 'Q%'
+PREFIX_INDEXES = """
+CREATE INDEX core_tag_name_prefix
+    ON core_tag (user_id, (UPPER(name) COLLATE "C"));
+CREATE INDEX core_ingredient_name_prefix
+    ON core_ingredient (user_id, (UPPER(name) COLLATE "C"));
+"""
+
+DROP_PREFIX_INDEXES = """
+DROP INDEX core_tag_name_prefix;
+DROP INDEX core_ingredient_name_prefix;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_recipe_search_vector'),
+    ]
+
+    operations = [
+        BtreeGinExtension(),
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='tag',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['user', 'name'], name='tag_name_trgm', opclasses=['int8_ops', 'gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['user', 'name'], name='ingredient_name_trgm', opclasses=['int8_ops', 'gin_trgm_ops']),
+        ),
+        migrations.RunSQL(PREFIX_INDEXES, DROP_PREFIX_INDEXES),
+    ]
@@ -3,8 +3,11 @@
 import uuid
 import os
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.conf import settings
+from core.storage import get_recipe_image_storage
 from django.contrib.auth.models import  (
     BaseUserManager,
     AbstractBaseUser,
@@ -68,11 +71,52 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank=True)
     tags = models.ManyToManyField('Tag')
     ingredients = models.ManyToManyField('Ingredient')
-    image = models.ImageField(null=True, upload_to=get_media_url_path)
+    image = models.ImageField(
+        null=True,
+        upload_to=get_media_url_path,
+        storage=get_recipe_image_storage,
+        db_index=True,
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    # weighted title (A) and description (B), kept by a database trigger
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='recipe_search_gin'),
+        ]
 
     def __str__(self):
         return self.title
 
+
+class RecipeAttrManager(models.Manager):
+    """Manage tags and ingredients by name"""
+
+    def resolve(self, user, names):
+        """return objects for names, creating the missing ones in bulk"""
+        user_id = getattr(user, 'pk', user)
+        names = list(dict.fromkeys(names))
+        if not names:
+            return []
+
+        found = {
+            obj.name: obj
+            for obj in self.filter(user_id=user_id, name__in=names)
+        }
+        missing = [name for name in names if name not in found]
+        if missing:
+            self.bulk_create(
+                [self.model(user_id=user_id, name=name) for name in missing],
+                ignore_conflicts=True,
+            )
+            found.update(
+                (obj.name, obj)
+                for obj in self.filter(user_id=user_id, name__in=missing)
+            )
+
+        return [found[name] for name in names]
+
 class Tag(models.Model):
     """create tag model"""
     name = models.CharField(max_length=255)
@@ -82,6 +126,24 @@ class Tag(models.Model):
         on_delete=models.CASCADE,
     )
 
+    objects = RecipeAttrManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='unique_tag_name_per_user',
+            ),
+        ]
+        indexes = [
+            # fuzzy autocomplete, user_id through btree_gin
+            GinIndex(
+                fields=['user', 'name'],
+                opclasses=['int8_ops', 'gin_trgm_ops'],
+                name='tag_name_trgm',
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -94,5 +156,23 @@ class Ingredient(models.Model):
         on_delete=models.CASCADE,
     )
 
+    objects = RecipeAttrManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='unique_ingredient_name_per_user',
+            ),
+        ]
+        indexes = [
+            # fuzzy autocomplete, user_id through btree_gin
+            GinIndex(
+                fields=['user', 'name'],
+                opclasses=['int8_ops', 'gin_trgm_ops'],
+                name='ingredient_name_trgm',
+            ),
+        ]
+
     def __str__(self):
         return self.name
\ No newline at end of file
@@ -0,0 +1,247 @@
+"""
+Opt-in profiling of production requests
+
+With PROFILING on, ProfilingMiddleware profiles a PROFILE_SAMPLE_RATE
+fraction of the requests, and every request with an X-Profile header
+signed for an active staff user, see sign_profile_token. PROFILER picks
+cProfile, saved as pstats, or a stack sampler thread, saved as collapsed
+stacks for flame graphs. Each profile has a JSON description next to it
+and PROFILE_DIR only keeps the last PROFILE_MAX_COUNT of them.
+
+A process profiles one request at a time, requests sampled meanwhile are
+served as usual. Unsampled requests only cost a random number and a
+header lookup. Only the thread serving the request is profiled, the
+thread pool work of the async views is not seen. Under ASGI the middleware
+is async, so the async views keep serving requests concurrently, and that
+thread is the one of the event loop.
+"""
+import asyncio
+import cProfile
+import collections
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = {'cprofile': 'pstats', 'sampler': 'collapsed'}
+
+TOKEN_SALT = 'core.profiling'
+
+_lock = threading.Lock()
+
+
+def sign_profile_token(user):
+    """X-Profile header value asking to profile the requests of user"""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(str(user.pk))
+
+
+def profile_token_user_id(token):
+    """id of the active staff user a token was signed for, or None"""
+    try:
+        user_id = signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=settings.PROFILE_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        return None
+    if get_user_model().objects.filter(
+        pk=user_id, is_staff=True, is_active=True
+    ).exists():
+        return int(user_id)
+    return None
+
+
+def frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}' \
+           f':{code.co_firstlineno})'
+
+
+def collapse(frame):
+    """the stack of a frame in collapsed form, outermost frame first"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Count the stacks of a thread, sampled from a background thread"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='profile-sampler', daemon=True
+        )
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def enable(self):
+        self._thread.start()
+
+    def disable(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def dump_stats(self, path):
+        with open(path, 'w') as stacks_file:
+            for stack, count in self.stacks.most_common():
+                stacks_file.write(f'{stack} {count}\n')
+
+
+def list_profiles(directory=None):
+    """descriptions of the stored profiles, oldest first"""
+    directory = directory or settings.PROFILE_DIR
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        try:
+            with open(path) as meta_file:
+                profile = json.load(meta_file)
+        except (OSError, ValueError):
+            continue
+        profile['file_path'] = os.path.join(directory, profile['file'])
+        profiles.append(profile)
+    return profiles
+
+
+def prune_profiles(directory, keep):
+    """delete all but the keep most recent profiles"""
+    metas = sorted(glob.glob(os.path.join(directory, '*.json')))
+    for meta_path in metas[:max(len(metas) - keep, 0)]:
+        base = meta_path[:-len('.json')]
+        for path in [meta_path] + [
+            f'{base}.{extension}' for extension in PROFILERS.values()
+        ]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def save_profile(profiler, kind, meta):
+    """write a profile and its description, then prune the oldest"""
+    directory = settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    profile_id = f'{now:%Y%m%dT%H%M%S%f}-{os.getpid()}'
+    meta = dict(meta, id=profile_id, created=now.isoformat(),
+                profiler=kind, file=f'{profile_id}.{PROFILERS[kind]}')
+    profiler.dump_stats(os.path.join(directory, meta['file']))
+    # the description goes last, listings only see complete profiles
+    temp_path = os.path.join(directory, f'.{profile_id}.tmp')
+    with open(temp_path, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(temp_path, os.path.join(directory, f'{profile_id}.json'))
+    prune_profiles(directory, settings.PROFILE_MAX_COUNT)
+
+
+@sync_and_async_middleware
+class ProfilingMiddleware:
+    """Profile sampled and explicitly requested requests, unless off"""
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        if settings.PROFILER not in PROFILERS:
+            raise ImproperlyConfigured(
+                f'PROFILER must be one of {", ".join(PROFILERS)}'
+            )
+        self.get_response = get_response
+        self.async_mode = asyncio.iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() < settings.PROFILE_SAMPLE_RATE:
+            reason = 'sampled'
+        elif 'HTTP_X_PROFILE' in request.META and profile_token_user_id(
+            request.META['HTTP_X_PROFILE']
+        ) is not None:
+            reason = 'requested'
+        else:
+            return self.get_response(request)
+
+        if not _lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler, kind = self._profiler()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - start
+            self._save(profiler, kind, request, response, reason, duration)
+            return response
+        finally:
+            _lock.release()
+
+    async def __acall__(self, request):
+        if random.random() < settings.PROFILE_SAMPLE_RATE:
+            reason = 'sampled'
+        elif 'HTTP_X_PROFILE' in request.META and await sync_to_async(
+            profile_token_user_id
+        )(request.META['HTTP_X_PROFILE']) is not None:
+            reason = 'requested'
+        else:
+            return await self.get_response(request)
+
+        if not _lock.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            profiler, kind = self._profiler()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - start
+            await sync_to_async(self._save, thread_sensitive=False)(
+                profiler, kind, request, response, reason, duration
+            )
+            return response
+        finally:
+            _lock.release()
+
+    def _profiler(self):
+        kind = settings.PROFILER
+        if kind == 'cprofile':
+            return cProfile.Profile(), kind
+        return StackSampler(settings.PROFILE_SAMPLE_INTERVAL), kind
+
+    def _save(self, profiler, kind, request, response, reason, duration):
+        try:
+            save_profile(profiler, kind, {
+                'method': request.method,
+                'path': request.path,
+                'query': request.META.get('QUERY_STRING', ''),
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'reason': reason,
+            })
+        except OSError:
+            logger.exception('could not save the profile of %s', request.path)
@@ -0,0 +1,209 @@
+"""
+On disk cache of recipe images resized on demand
+
+Renders live under MEDIA_ROOT/RESIZE_CACHE_DIR, one directory per source
+image. The total size is kept under RESIZE_CACHE_MAX_BYTES by deleting the
+least recently used renders. Concurrent requests for the same render wait
+for the first one instead of rendering it again.
+
+The bound holds across processes: every store rescans the directory, so
+renders written by other workers count against the limit, and the last
+access time is kept in the file mtime. Between stores a process only tracks
+its own writes, and a file deleted by another process is treated as a miss.
+"""
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core.cache import CacheStats
+from core.images import (
+    FORMAT_EXTENSIONS,
+    encode_image,
+    load_image,
+    resize_image,
+)
+
+
+class ResizeCacheStats(CacheStats):
+    """hit and miss counters plus evictions and collapsed renders"""
+
+    def __init__(self):
+        super().__init__('resize')
+        self.evictions = 0
+        self.collapsed = 0
+
+    def evicted(self, count=1):
+        with self._lock:
+            self.evictions += count
+
+    def collapse(self):
+        with self._lock:
+            self.collapsed += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'collapsed': self.collapsed,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.collapsed = 0
+
+
+class ResizeCache:
+    """LRU cache of resized images, bounded by total bytes on disk"""
+
+    def __init__(self):
+        self.stats = ResizeCacheStats()
+        self._lock = threading.Lock()
+        self._renders = {}
+        self._index = None
+        self._root = None
+        self.size = 0
+
+    @property
+    def root(self):
+        return os.path.join(settings.MEDIA_ROOT, settings.RESIZE_CACHE_DIR)
+
+    @staticmethod
+    def key(image_name):
+        """content key of a source image, its name without the extension"""
+        return os.path.splitext(os.path.basename(image_name))[0]
+
+    def path(self, image_name, width, fmt):
+        """file of one render of an image"""
+        return os.path.join(
+            self.root,
+            self.key(image_name),
+            f'{width}.{FORMAT_EXTENSIONS[fmt]}',
+        )
+
+    def _load_index(self, reload=False):
+        """index of the files on disk, oldest access first"""
+        if not reload and self._index is not None and \
+                self._root == self.root:
+            return
+        entries = []
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    # still being written
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, path, stat.st_size))
+        # mtimes are coarse, ties keep the access order known here
+        rank = {path: i for i, path in enumerate(self._index or ())}
+        entries.sort(key=lambda entry: (entry[0], rank.get(entry[1], -1)))
+        self._index = OrderedDict((path, size) for _, path, size in entries)
+        self._root = self.root
+        self.size = sum(self._index.values())
+
+    def _touch(self, path):
+        """mark a render as used, None when it is not on disk"""
+        with self._lock:
+            self._load_index()
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                self.size -= self._index.pop(path, 0)
+                return None
+            if path not in self._index:
+                size = os.path.getsize(path)
+                self._index[path] = size
+                self.size += size
+            self._index.move_to_end(path)
+            return path
+
+    def _store(self, path, data):
+        """write a render and evict the oldest ones over the size limit"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix='.tmp'
+        )
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+        evicted = 0
+        with self._lock:
+            self._load_index(reload=True)
+            while self.size > settings.RESIZE_CACHE_MAX_BYTES and \
+                    len(self._index) > 1:
+                old_path, old_size = self._index.popitem(last=False)
+                self.size -= old_size
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+                evicted += 1
+        if evicted:
+            self.stats.evicted(evicted)
+
+    def _render(self, image_name, storage, width, fmt):
+        image = load_image(image_name, storage)
+        resized = resize_image(image, width, None)
+        return encode_image(resized, fmt).read()
+
+    def get(self, image_name, storage, width, fmt):
+        """return (path, hit) of a render, rendering it when missing"""
+        path = self.path(image_name, width, fmt)
+        if self._touch(path):
+            self.stats.hit()
+            return path, True
+
+        with self._lock:
+            render_lock = self._renders.get(path)
+            if render_lock is None:
+                render_lock = self._renders[path] = threading.Lock()
+        with render_lock:
+            try:
+                if self._touch(path):
+                    # rendered by a concurrent request while we waited
+                    self.stats.collapse()
+                    self.stats.hit()
+                    return path, True
+                self.stats.miss()
+                self._store(
+                    path, self._render(image_name, storage, width, fmt)
+                )
+                return path, False
+            finally:
+                with self._lock:
+                    if self._renders.get(path) is render_lock:
+                        del self._renders[path]
+
+    def open(self, image_name, storage, width, fmt, attempts=3):
+        """return (file, hit) of a render, rendering it again when it is
+        evicted before it is opened"""
+        for attempt in range(attempts):
+            path, hit = self.get(image_name, storage, width, fmt)
+            try:
+                return open(path, 'rb'), hit
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+
+    def discard(self, image_name):
+        """delete every render of an image"""
+        directory = os.path.dirname(self.path(image_name, 0, 'jpeg'))
+        prefix = directory + os.sep
+        with self._lock:
+            self._load_index()
+            for path in [p for p in self._index if p.startswith(prefix)]:
+                self.size -= self._index.pop(path)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+resize_cache = ResizeCache()
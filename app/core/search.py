@@ -0,0 +1,31 @@
+"""
+pg_trgm word similarity for Django 3.2
+
+Django 4.0 ships these as TrigramWordSimilarity and the
+trigram_word_similar lookup, the names match so they can be dropped on
+upgrade.
+"""
+from django.contrib.postgres.lookups import PostgresOperatorLookup
+from django.db.models import CharField, FloatField, Func, TextField, Value
+
+
+class TrigramWordSimilarity(Func):
+    """greatest similarity between string and any part of expression"""
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, 'resolve_expression'):
+            string = Value(string)
+        super().__init__(string, expression, **extra)
+
+
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """field %> string, true over pg_trgm.word_similarity_threshold"""
+    lookup_name = 'trigram_word_similar'
+    postgres_operator = '%%>'
+
+
+def register_lookups():
+    CharField.register_lookup(TrigramWordSimilar)
+    TextField.register_lookup(TrigramWordSimilar)
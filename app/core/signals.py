@@ -0,0 +1,121 @@
+"""
+Signal receivers for core models
+"""
+from django.db import transaction
+from django.db.models import DEFERRED
+from django.db.models.signals import (
+    post_init,
+    post_save,
+    post_delete,
+    pre_save,
+    pre_delete,
+    m2m_changed,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.cache import invalidate_user
+from core.images import schedule_variants
+from core.models import Recipe, Tag, Ingredient
+from core.storage import release_image
+
+RECIPE_ATTR_FIELDS = {
+    Tag: 'tags',
+    Ingredient: 'ingredients',
+    Recipe.tags.through: 'tags',
+    Recipe.ingredients.through: 'ingredients',
+}
+
+
+def touch_recipes(**lookups):
+    """mark recipes modified when their tags or ingredients change"""
+    Recipe.objects.filter(**lookups).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_owner_cache(sender, instance, **kwargs):
+    """new cache version for the owner of a changed row"""
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(sender, instance, **kwargs):
+    """drop the image file of a deleted recipe when nothing else uses it"""
+    release_image(instance.image.name)
+
+
+def image_changed(instance, update_fields):
+    """False when a save cannot have changed the image of a recipe"""
+    return update_fields is None or 'image' in update_fields
+
+
+@receiver(post_init, sender=Recipe)
+def remember_stored_image(sender, instance, **kwargs):
+    """the image name as loaded, DEFERRED when it was not"""
+    value = instance.__dict__.get('image', DEFERRED)
+    instance._stored_image = getattr(value, 'name', value) \
+        if instance.pk is not None else None
+
+
+@receiver(pre_save, sender=Recipe)
+def load_stored_image(sender, instance, update_fields=None, **kwargs):
+    """read the stored image name when the recipe was loaded without it"""
+    if instance._stored_image is DEFERRED and \
+            image_changed(instance, update_fields):
+        instance._stored_image = Recipe.objects.filter(
+            pk=instance.pk
+        ).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(sender, instance, update_fields=None, **kwargs):
+    """drop the file of a replaced image when nothing else uses it and
+    render the variants of the new one once committed"""
+    if not image_changed(instance, update_fields):
+        return
+    stored, name = instance._stored_image, instance.image.name
+    instance._stored_image = name
+    if stored == name:
+        return
+    if stored:
+        release_image(stored)
+    if name:
+        user_id = instance.user_id
+        transaction.on_commit(lambda: schedule_variants(name, user_id))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def touch_renamed_attr_recipes(sender, instance, created, **kwargs):
+    """recipes showing a renamed tag or ingredient are modified"""
+    if not created:
+        touch_recipes(**{RECIPE_ATTR_FIELDS[sender]: instance})
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def touch_deleted_attr_recipes(sender, instance, **kwargs):
+    """recipes losing a deleted tag or ingredient are modified"""
+    touch_recipes(**{RECIPE_ATTR_FIELDS[sender]: instance})
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_links_changed(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    """touch recipes and invalidate the owner when links change"""
+    if action not in ('pre_clear', 'post_add', 'post_remove'):
+        return
+
+    if not reverse:
+        touch_recipes(pk=instance.pk)
+    elif action == 'pre_clear':
+        touch_recipes(**{RECIPE_ATTR_FIELDS[sender]: instance})
+    else:
+        touch_recipes(pk__in=pk_set)
+    invalidate_user(instance.user_id)
@@ -0,0 +1,109 @@
+"""
+Content addressed storage for uploaded recipe images
+
+Files are named after the sha256 of their bytes, so the same photo uploaded
+many times is stored once and its url never changes meaning. The hash is
+computed while the upload is streamed to a temporary file, which is then
+moved in place, so the bytes are only read once.
+
+Saving a file that may already exist and releasing a file that may be
+unused both hold lock_image on its name until their transaction ends. A
+release therefore never deletes a file that a new row is about to use.
+Save images inside a transaction, the lock is gone at once without one.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+
+from core import images
+from core.resize_cache import resize_cache
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage naming files by the sha256 of their content
+
+    The directory and extension of the requested name are kept, the file
+    name is replaced by the hash: uploads/recipe/ab/abcd...ef.jpg
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # the name is only known once the content is hashed, see _save
+        return name
+
+    def _content_name(self, name, digest):
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], f'{digest}{ext}')
+
+    def _save(self, name, content):
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+
+            name = self._content_name(name, digest.hexdigest())
+            lock_image(name)
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                return name
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            file_move_safe(temp_path, full_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+            return name
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+recipe_image_storage = ContentAddressedStorage()
+
+
+def get_recipe_image_storage():
+    """storage of Recipe.image"""
+    return recipe_image_storage
+
+
+def lock_image(name):
+    """lock an image name until the current transaction ends"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [name])
+
+
+def image_references(name):
+    """number of recipes using an image file"""
+    from core.models import Recipe
+
+    return Recipe.objects.filter(image=name).count()
+
+
+def release_image(name):
+    """delete an image and its variants once no recipe uses it
+
+    Runs after the current transaction commits so a rolled back change
+    never removes a file that is still referenced.
+    """
+    if not name:
+        return
+
+    def release():
+        with transaction.atomic():
+            lock_image(name)
+            if image_references(name):
+                return
+            storage = get_recipe_image_storage()
+            for _, _, variant in images.variant_names(name):
+                storage.delete(variant)
+            storage.delete(name)
+            resize_cache.discard(name)
+
+    transaction.on_commit(release)
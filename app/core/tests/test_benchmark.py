@@ -0,0 +1,84 @@
+"""
+Tests for the endpoint benchmarks
+"""
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from core import benchmark
+from core.management.commands.generate_dataset import EMAIL_DOMAIN
+
+
+def result(**values):
+    data = {'queries': 3, 'p50_ms': 10.0, 'p95_ms': 20.0, 'memory_kb': 500}
+    data.update(values)
+    return data
+
+
+class CompareTests(SimpleTestCase):
+    """percentiles and baseline comparison"""
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 95), 95)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile([7], 99), 7)
+
+    def test_no_regression(self):
+        """small and noisy differences pass"""
+        baseline = {'recipe-list': result()}
+        results = {
+            'recipe-list': result(p50_ms=10.9, p95_ms=23.0, memory_kb=540),
+            'new-scenario': result(),
+        }
+
+        self.assertEqual(benchmark.compare(results, baseline), [])
+
+    def test_more_queries(self):
+        """any extra query is a regression"""
+        regressions = benchmark.compare(
+            {'recipe-list': result(queries=4)},
+            {'recipe-list': result()},
+        )
+
+        self.assertEqual(regressions, ['recipe-list: 3 -> 4 queries'])
+
+    def test_slower_and_bigger(self):
+        """latency and memory over their thresholds are regressions"""
+        regressions = benchmark.compare(
+            {'recipe-list': result(p95_ms=30.0, memory_kb=1000)},
+            {'recipe-list': result()},
+        )
+
+        self.assertEqual(len(regressions), 2)
+        self.assertIn('p95_ms 20.00 -> 30.00', regressions[0])
+        self.assertIn('memory', regressions[1])
+
+
+class RunTests(TestCase):
+    """every scenario answers as expected on a small dataset"""
+
+    def test_all_scenarios(self):
+        call_command(
+            'generate_dataset', '--users', '2', '--recipes', '30',
+            stdout=StringIO(),
+        )
+        fixture = benchmark.Fixture(get_user_model().objects.get(
+            email=f'dataset-0@{EMAIL_DOMAIN}'
+        ))
+
+        results = benchmark.run(
+            fixture, iterations=2, warmup=0, memory_iterations=1
+        )
+
+        self.assertEqual(
+            set(results), set(benchmark.scenarios(fixture))
+        )
+        for name, data in results.items():
+            self.assertLessEqual(data['p50_ms'], data['p99_ms'], name)
+            self.assertGreater(data['memory_kb'], 0, name)
+        self.assertGreater(results['recipe-create']['queries'], 0)
@@ -0,0 +1,40 @@
+"""
+Tests for user cache versions
+"""
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from core.cache import get_user_version, bump_user_version
+
+
+class UserVersionTests(SimpleTestCase):
+    """user cache version counters"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_version_is_stable_until_bumped(self):
+        """reading the version does not change it"""
+        version = get_user_version(1)
+        self.assertEqual(get_user_version(1), version)
+
+        bump_user_version(1)
+        self.assertGreater(get_user_version(1), version)
+
+    def test_versions_are_per_user(self):
+        """bumping a user leaves others alone"""
+        version = get_user_version(2)
+        bump_user_version(1)
+        self.assertEqual(get_user_version(2), version)
+
+    def test_lost_version_is_not_reused(self):
+        """a counter evicted from the cache starts above old versions"""
+        version = get_user_version(1)
+        bump_user_version(1)
+        cache.clear()
+        self.assertGreater(get_user_version(1), version + 1)
+
+    def test_bump_without_version(self):
+        """bumping a user without a version creates one"""
+        bump_user_version(3)
+        self.assertIsNotNone(cache.get('user-version:3'))
@@ -0,0 +1,208 @@
+"""
+Tests for the connection pool and the pooled postgresql backend
+"""
+import threading
+import time
+
+import psycopg2
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase
+
+from core.db.backends.postgresql import pools
+from core.db.pool import ConnectionPool, PoolTimeout
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """checkout, return and reaping"""
+
+    def make_pool(self, **options):
+        params = connection.get_connection_params()
+        pool = ConnectionPool(lambda: psycopg2.connect(**params), **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_connection_reused(self):
+        """a returned connection is handed out again"""
+        pool = self.make_pool()
+        conn = pool.getconn()
+        pool.putconn(conn)
+
+        self.assertIs(pool.getconn(), conn)
+        self.assertEqual(pool.stats(), {'size': 1, 'idle': 0, 'in_use': 1})
+
+    def test_open_transaction_rolled_back(self):
+        """what a user left open is rolled back, errors included"""
+        pool = self.make_pool()
+        conn = pool.getconn()
+        with conn.cursor() as cursor:
+            with self.assertRaises(psycopg2.DataError):
+                cursor.execute('SELECT 1 / 0')
+        self.assertEqual(
+            conn.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_INERROR,
+        )
+        pool.putconn(conn)
+
+        self.assertIs(pool.getconn(), conn)
+        self.assertEqual(
+            conn.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE,
+        )
+
+    def test_session_reset(self):
+        """settings, temporary tables and session locks do not carry over
+        to the next user"""
+        pool = self.make_pool()
+        conn = pool.getconn()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('SHOW TimeZone')
+            timezone = cursor.fetchone()[0]
+            cursor.execute("SET TimeZone TO 'Asia/Kolkata'")
+            cursor.execute('SET search_path TO pg_catalog')
+            cursor.execute('CREATE TEMPORARY TABLE leftover (id int)')
+            cursor.execute('SELECT pg_advisory_lock(42)')
+        pool.putconn(conn)
+
+        self.assertIs(pool.getconn(), conn)
+        self.assertTrue(conn.autocommit)
+        with conn.cursor() as cursor:
+            cursor.execute('SHOW TimeZone')
+            self.assertEqual(cursor.fetchone()[0], timezone)
+            cursor.execute('SHOW search_path')
+            self.assertEqual(cursor.fetchone()[0], '"$user", public')
+            cursor.execute("SELECT to_regclass('pg_temp.leftover')")
+            self.assertIsNone(cursor.fetchone()[0])
+            cursor.execute(
+                "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' "
+                "AND pid = pg_backend_pid()"
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_max_size_waits_then_times_out(self):
+        pool = self.make_pool(max_size=1, timeout=0.05)
+        conn = pool.getconn()
+
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+
+        threading.Timer(0.02, pool.putconn, [conn]).start()
+        pool.timeout = 2
+        self.assertIs(pool.getconn(), conn)
+
+    def test_health_check(self):
+        """a dead idle connection is replaced on checkout"""
+        pool = self.make_pool(check_after=0)
+        conn, other = pool.getconn(), pool.getconn()
+        pool.putconn(conn)
+        with other.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_terminate_backend(%s)', [conn.get_backend_pid()]
+            )
+        pool.putconn(other)
+
+        # other is now the most recent, take it first
+        self.assertIs(pool.getconn(), other)
+        new = pool.getconn()
+
+        self.assertIsNot(new, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['size'], 2)
+
+    def test_max_lifetime(self):
+        """an old connection is closed when it comes back"""
+        pool = self.make_pool(max_lifetime=0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+
+    def test_reap_idle_keeps_min_size(self):
+        pool = self.make_pool(min_size=1, max_idle=0)
+        conns = [pool.getconn() for _ in range(3)]
+        for conn in conns:
+            pool.putconn(conn)
+
+        pool.reap()
+
+        self.assertEqual(pool.stats(), {'size': 1, 'idle': 1, 'in_use': 0})
+
+    def test_reap_opens_min_size(self):
+        pool = self.make_pool(min_size=2)
+
+        pool.reap()
+
+        self.assertEqual(pool.stats(), {'size': 2, 'idle': 2, 'in_use': 0})
+
+    def test_threads_stay_within_max_size(self):
+        """many threads share at most max_size connections"""
+        pool = self.make_pool(max_size=3)
+        backends = set()
+        errors = []
+
+        def work():
+            try:
+                for _ in range(20):
+                    conn = pool.getconn()
+                    backends.add(conn.get_backend_pid())
+                    time.sleep(0.001)
+                    pool.putconn(conn)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(backends), 3)
+        self.assertLessEqual(pool.stats()['size'], 3)
+
+    def test_closed_pool(self):
+        """closing drops idle connections and those given back later"""
+        pool = self.make_pool()
+        idle, busy = pool.getconn(), pool.getconn()
+        pool.putconn(idle)
+
+        pool.close()
+        pool.putconn(busy)
+
+        self.assertTrue(idle.closed and busy.closed)
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.getconn()
+
+
+class PooledBackendTests(TransactionTestCase):
+    """the database backend"""
+
+    def test_close_returns_to_pool(self):
+        """closing the connection of a request keeps the session"""
+        connection.close()
+        connection.ensure_connection()
+        raw = connection.connection
+        connection.close()
+        connection.ensure_connection()
+
+        self.assertIs(connection.connection, raw)
+
+    def test_closed_in_atomic_is_discarded(self):
+        """a connection closed mid transaction is not reused"""
+        connection.ensure_connection()
+        raw = connection.connection
+        with transaction.atomic():
+            connection.close()
+        connection.ensure_connection()
+
+        self.assertTrue(raw.closed)
+        self.assertIsNot(connection.connection, raw)
+
+    def test_pool_off(self):
+        """a MAX_SIZE of 0 connects directly"""
+        settings_dict = dict(connection.settings_dict, POOL={'MAX_SIZE': 0})
+
+        self.assertIsNone(pools.get_pool(
+            settings_dict, connection.get_connection_params()
+        ))
@@ -0,0 +1,145 @@
+"""
+Tests for the read replica router
+"""
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.db import replicas
+from core.models import Tag
+
+TAGS_URL = reverse('recipe:tag-list')
+
+# two more aliases on the test database
+ALIASES = {
+    'replica': {},
+    'broken': {'HOST': '/nonexistent'},
+}
+
+
+@override_settings(
+    DATABASE_REPLICAS=['replica'],
+    REPLICA_PIN_SECONDS=60,
+    API_RESPONSE_CACHE_TIMEOUT=0,
+)
+class ReplicaRoutingTests(TransactionTestCase):
+    """which alias the reads of a request go to"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # added once the test case is set up, the runner only knows the
+        # aliases of the settings
+        for alias, settings_dict in ALIASES.items():
+            connections.databases[alias] = dict(
+                connection.settings_dict, **settings_dict
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in ALIASES:
+            connections[alias].close()
+            del connections[alias]
+            del connections.databases[alias]
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        replicas._down_until.clear()
+        self.user = get_user_model().objects.create_user(
+            'replica@example.com', 'pass@123',
+        )
+        Tag.objects.create(user=self.user, name='Vegan')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_tags(self, alias='replica'):
+        """tag names of a GET and the queries alias ran"""
+        with CaptureQueriesContext(connections[alias]) as queries:
+            res = self.client.get(TAGS_URL)
+        self.assertEqual(res.status_code, 200)
+        return [tag['name'] for tag in res.data['results']], queries
+
+    def test_safe_request_reads_replica(self):
+        names, queries = self.get_tags()
+
+        self.assertEqual(names, ['Vegan'])
+        self.assertTrue(any('core_tag' in q['sql'] for q in queries))
+        self.assertIsNone(replicas._replica.get())
+
+    def test_writer_pinned_to_primary(self):
+        """a user reads their own edit from the primary"""
+        tag = Tag.objects.get(user=self.user)
+        res = self.client.patch(
+            reverse('recipe:tag-detail', args=[tag.id]), {'name': 'Keto'}
+        )
+        self.assertEqual(res.status_code, 200)
+
+        names, queries = self.get_tags()
+
+        self.assertEqual(names, ['Keto'])
+        self.assertEqual(len(queries), 0)
+        self.assertTrue(replicas.is_pinned(self.user.pk))
+
+    def test_other_users_not_pinned(self):
+        replicas.pin_user(self.user.pk + 1)
+
+        names, queries = self.get_tags()
+
+        self.assertTrue(queries)
+
+    def test_rejected_write_does_not_pin(self):
+        """only requests allowed to write pin"""
+        self.client.force_authenticate(None)
+        self.client.post(TAGS_URL, {'name': 'Keto'})
+
+        self.assertFalse(replicas.is_pinned(None))
+
+    @override_settings(DATABASE_REPLICAS=['broken', 'replica'])
+    def test_replica_down(self):
+        """a replica that cannot connect is left out for a while"""
+        # in the order of the setting, broken first
+        shuffle = mock.patch('core.db.replicas.random.shuffle')
+        shuffle.start()
+        self.addCleanup(shuffle.stop)
+        with self.assertLogs('core.db.replicas', 'WARNING') as logs:
+            for _ in range(3):
+                names, queries = self.get_tags()
+                self.assertEqual(names, ['Vegan'])
+                self.assertTrue(queries)
+
+        self.assertEqual(len(logs.records), 1)
+
+    @override_settings(DATABASE_REPLICAS=['broken'])
+    def test_all_replicas_down(self):
+        """requests read from the primary"""
+        with self.assertLogs('core.db.replicas', 'WARNING'):
+            names, queries = self.get_tags(DEFAULT_DB_ALIAS)
+
+        self.assertEqual(names, ['Vegan'])
+        self.assertTrue(any('core_tag' in q['sql'] for q in queries))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        names, queries = self.get_tags()
+
+        self.assertEqual(len(queries), 0)
+
+    def test_router(self):
+        """writes and reads in a transaction of the primary stay on it"""
+        router = replicas.ReplicaRouter()
+        token = replicas._replica.set('replica')
+        self.addCleanup(replicas._replica.reset, token)
+
+        self.assertEqual(router.db_for_read(Tag), 'replica')
+        self.assertEqual(router.db_for_write(Tag), DEFAULT_DB_ALIAS)
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Tag), DEFAULT_DB_ALIAS)
+        self.assertIs(router.allow_migrate('replica', 'core'), False)
+        self.assertIsNone(router.allow_migrate(DEFAULT_DB_ALIAS, 'core'))
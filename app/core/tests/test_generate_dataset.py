@@ -0,0 +1,88 @@
+"""
+Tests for the generate_dataset command
+"""
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db.models import Count
+from django.test import TestCase
+
+from core.management.commands.generate_dataset import EMAIL_DOMAIN
+from core.models import Recipe, Tag
+from core.tests.test_images import TempMediaMixin
+
+
+def generate(*args):
+    call_command(
+        'generate_dataset', '--users', '5', '--recipes', '60',
+        '--batch-size', '25', *args, stdout=StringIO(),
+    )
+
+
+def dataset():
+    """the generated content, without ids"""
+    return [
+        (r.user.email, r.title, r.price, r.time_minutes,
+         sorted(t.name for t in r.tags.all()),
+         sorted(i.name for i in r.ingredients.all()))
+        for r in Recipe.objects.select_related('user').prefetch_related(
+            'tags', 'ingredients'
+        ).order_by('title')
+    ]
+
+
+class GenerateDatasetTests(TempMediaMixin, TestCase):
+    """seeded synthetic data"""
+
+    def test_counts_and_skew(self):
+        """users and recipes as requested, the first user has the most"""
+        generate()
+
+        users = get_user_model().objects.filter(
+            email__endswith=f'@{EMAIL_DOMAIN}'
+        ).annotate(recipes=Count('recipe')).order_by('-recipes')
+        self.assertEqual(users.count(), 5)
+        self.assertEqual(Recipe.objects.count(), 60)
+        self.assertEqual(users[0].email, f'dataset-0@{EMAIL_DOMAIN}')
+        self.assertGreater(users[0].recipes, users[4].recipes)
+
+    def test_names_follow_zipf(self):
+        """the first names of the vocabulary are used the most"""
+        generate('--users', '1', '--recipes', '200')
+
+        tags = list(Tag.objects.annotate(
+            used=Count('recipe')
+        ).order_by('-used').values_list('name', flat=True))
+        self.assertEqual(tags[0], 'Curry')
+
+    def test_same_seed_same_data(self):
+        """a seed always gives the same dataset, another seed does not"""
+        generate('--seed', '7')
+        first = dataset()
+
+        generate('--seed', '7', '--flush')
+        self.assertEqual(dataset(), first)
+
+        generate('--seed', '8', '--flush')
+        self.assertNotEqual(dataset(), first)
+
+    def test_existing_dataset(self):
+        """a second run needs --flush"""
+        generate()
+
+        with self.assertRaises(CommandError):
+            generate()
+
+    def test_images_are_shared(self):
+        """a few stored images are shared by the recipes having one"""
+        generate('--images', '3', '--image-ratio', '0.5')
+
+        images = Recipe.objects.exclude(image=None).values_list(
+            'image', flat=True
+        )
+        self.assertTrue(0 < len(images) < 60)
+        self.assertLessEqual(len(set(images)), 3)
+        storage = Recipe._meta.get_field('image').storage
+        for name in set(images):
+            self.assertTrue(storage.exists(name))
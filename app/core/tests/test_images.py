@@ -0,0 +1,165 @@
+"""
+Tests for recipe image variants
+"""
+import io
+import tempfile
+from concurrent.futures import wait
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+
+from core import images
+from core.models import Recipe
+
+VARIANTS = {'thumbnail': (50, 50), 'medium': (120, None)}
+
+
+def save_image(name, size=(300, 200), mode='RGB'):
+    """save a generated image to the default storage"""
+    image_file = tempfile.SpooledTemporaryFile()
+    Image.new(mode, size).save(image_file, format='PNG')
+    image_file.seek(0)
+    return default_storage.save(name, ContentFile(image_file.read()))
+
+
+class TempMediaMixin:
+    """store media files in a temporary directory"""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+        super().tearDown()
+
+
+@override_settings(RECIPE_IMAGE_VARIANTS=VARIANTS)
+class ImageVariantTests(TempMediaMixin, SimpleTestCase):
+    """generate resized copies of images"""
+
+    def test_generate_variants(self):
+        """every variant is created in every format"""
+        name = save_image('uploads/recipe/photo.png')
+
+        created = images.generate_variants(name)
+
+        self.assertEqual(len(created), 4)
+        thumb = images.variant_name(name, 'thumbnail', 'webp')
+        self.assertEqual(thumb, 'uploads/recipe/photo/thumbnail.webp')
+        with Image.open(default_storage.path(thumb)) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (50, 50)))
+        medium = images.variant_name(name, 'medium', 'jpeg')
+        with Image.open(default_storage.path(medium)) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (120, 80)))
+
+    def test_generate_skips_existing(self):
+        """running again only renders what is missing"""
+        name = save_image('uploads/recipe/photo.png')
+        images.generate_variants(name)
+        default_storage.delete(images.variant_name(name, 'medium', 'webp'))
+
+        created = images.generate_variants(name)
+
+        self.assertEqual(
+            created, [images.variant_name(name, 'medium', 'webp')]
+        )
+        self.assertEqual(images.generate_variants(name), [])
+
+    def test_small_image_not_upscaled(self):
+        """variants are never larger than the original"""
+        name = save_image('uploads/recipe/small.png', (30, 20), 'RGBA')
+        images.generate_variants(name)
+
+        medium = images.variant_name(name, 'medium', 'jpeg')
+        with Image.open(default_storage.path(medium)) as image:
+            self.assertEqual(image.size, (30, 20))
+
+    def test_variant_urls_only_ready(self):
+        """urls are listed once a variant exists"""
+        name = save_image('uploads/recipe/photo.png')
+        self.assertEqual(images.variant_urls(name), {})
+
+        images.generate_variants(name)
+
+        urls = images.variant_urls(name)
+        self.assertEqual(set(urls), {'thumbnail', 'medium'})
+        self.assertTrue(
+            urls['thumbnail']['jpeg'].endswith('photo/thumbnail.jpg')
+        )
+
+    @patch('core.images.bump_user_version')
+    def test_schedule_variants(self, patched_bump):
+        """scheduled work runs in the pool and bumps the user cache"""
+        name = save_image('uploads/recipe/photo.png')
+
+        wait([images.schedule_variants(name, 7)])
+
+        self.assertEqual(len(images.variant_urls(name)), 2)
+        patched_bump.assert_called_once_with(7)
+        self.assertEqual(images.queue_depth(), 0)
+
+    @patch(
+        'core.management.commands.generate_image_variants.generate_variants',
+        return_value=[],
+    )
+    def test_schedule_once_per_image(self, patched_generate):
+        """an image already queued is not queued again"""
+        with patch.object(images, 'executor') as patched_executor:
+            first = images.schedule_variants('a.png')
+            second = images.schedule_variants('a.png')
+            self.assertEqual(images.queue_depth(), 1)
+        self.assertIs(first, second)
+        patched_executor.submit.assert_called_once()
+        images._pending.clear()
+
+
+@override_settings(RECIPE_IMAGE_VARIANTS=VARIANTS)
+class GenerateImageVariantsCommandTests(TempMediaMixin, TestCase):
+    """backfill variants of stored recipe images"""
+
+    def test_command_generates_missing(self):
+        """the command renders variants of every recipe image"""
+        user = get_user_model().objects.create_user(
+            'variants@example.com',
+            'pass@123',
+        )
+        name = save_image('uploads/recipe/photo.png')
+        Recipe.objects.create(
+            user=user, title='Photo', time_minutes=5, price=5, image=name,
+        )
+        Recipe.objects.create(
+            user=user, title='No photo', time_minutes=5, price=5,
+        )
+
+        call_command('generate_image_variants', stdout=io.StringIO())
+
+        self.assertEqual(len(images.variant_urls(name)), 2)
+
+    @patch(
+        'core.management.commands.generate_image_variants.generate_variants',
+        return_value=[],
+    )
+    def test_command_renders_shared_image_once(self, patched_generate):
+        """recipes sharing an image are rendered once"""
+        user = get_user_model().objects.create_user(
+            'shared@example.com',
+            'pass@123',
+        )
+        name = save_image('uploads/recipe/photo.png')
+        for title in ('One', 'Two'):
+            Recipe.objects.create(
+                user=user, title=title, time_minutes=5, price=5, image=name,
+            )
+
+        call_command('generate_image_variants', stdout=io.StringIO())
+
+        patched_generate.assert_called_once_with(name)
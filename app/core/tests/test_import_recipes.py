@@ -0,0 +1,268 @@
+"""
+Tests for the import_recipes command
+"""
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+
+from core.models import Recipe, Tag, Ingredient
+
+
+def recipe_record(title, **params):
+    """a record as written by the export api"""
+    record = {
+        'title': title,
+        'description': '',
+        'time_minutes': 10,
+        'price': '4.50',
+        'link': '',
+        'tags': [],
+        'ingredients': [],
+    }
+    record.update(params)
+    return record
+
+
+class ImportRecipesTests(TestCase):
+    """bulk import from NDJSON and CSV"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'import@example.com', 'pass@123'
+        )
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, lines):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    def write_ndjson(self, records, name='recipes.ndjson'):
+        return self.write(name, [
+            r if isinstance(r, str) else json.dumps(r) for r in records
+        ])
+
+    def run_import(self, path, *args):
+        out, err = StringIO(), StringIO()
+        call_command(
+            'import_recipes', path, '--user', self.user.email, *args,
+            stdout=out, stderr=err,
+        )
+        return out.getvalue(), err.getvalue()
+
+    def test_import_ndjson(self):
+        """recipes and links are loaded, names resolved once per user"""
+        existing = Tag.objects.create(user=self.user, name='Dinner')
+        path = self.write_ndjson([
+            recipe_record('Thai curry', description='Green and hot',
+                          tags=['Dinner', 'Thai'], ingredients=['Rice']),
+            recipe_record('Fried rice', tags=['Thai', {'name': 'Quick'}],
+                          ingredients=['Rice', 'Rice']),
+        ])
+
+        out, err = self.run_import(path, '--batch-size', '1')
+
+        self.assertEqual(err, '')
+        self.assertIn('imported 2 recipes', out)
+        curry = Recipe.objects.get(title='Thai curry')
+        self.assertEqual(curry.user, self.user)
+        self.assertEqual(curry.price, Decimal('4.50'))
+        self.assertEqual(
+            sorted(t.name for t in curry.tags.all()), ['Dinner', 'Thai']
+        )
+        self.assertIn(existing, curry.tags.all())
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(Ingredient.objects.filter(name='Rice').count(), 1)
+        fried = Recipe.objects.get(title='Fried rice')
+        self.assertEqual(fried.ingredients.count(), 1)
+        # the search vector trigger runs for COPY too
+        self.assertTrue(
+            Recipe.objects.filter(search_vector='green').exists()
+        )
+
+    def test_ids_come_from_the_sequence(self):
+        """recipes created after an import get fresh ids"""
+        path = self.write_ndjson([recipe_record('Imported')])
+        self.run_import(path)
+
+        recipe = Recipe.objects.create(
+            user=self.user, title='Later', time_minutes=1, price=1
+        )
+
+        self.assertGreater(recipe.id, Recipe.objects.get(title='Imported').id)
+
+    def test_import_csv_export_format(self):
+        """CSV with tags and ingredients as JSON lists"""
+        path = self.write('recipes.csv', [
+            'id,title,description,time_minutes,price,link,image,tags,'
+            'ingredients',
+            '7,"Soup, hot","Line one\nline two",15,3.20,,,"[""a,b""]",[]',
+        ])
+
+        self.run_import(path)
+
+        recipe = Recipe.objects.get(title='Soup, hot')
+        self.assertEqual(recipe.description, 'Line one\nline two')
+        self.assertEqual([t.name for t in recipe.tags.all()], ['a,b'])
+
+    def test_invalid_records_are_skipped(self):
+        """bad records are reported and the others imported"""
+        path = self.write_ndjson([
+            recipe_record('Good'),
+            recipe_record('', price='abc'),
+            '{not json',
+            recipe_record('Nobody', user='nobody@example.com'),
+            recipe_record('Bad tags', tags='Dinner'),
+        ])
+
+        out, err = self.run_import(path)
+
+        self.assertEqual(list(Recipe.objects.values_list('title', flat=True)),
+                         ['Good'])
+        self.assertIn('skipped 4', out)
+        for number in (2, 3, 4, 5):
+            self.assertIn(f'record {number}:', err)
+
+    def test_unknown_default_user(self):
+        """--user must name an existing user"""
+        path = self.write_ndjson([recipe_record('Good')])
+
+        with self.assertRaises(CommandError):
+            call_command('import_recipes', path, '--user', 'no@example.com')
+
+    def test_resume_from_checkpoint(self):
+        """a rerun skips the committed records, a finished import is kept"""
+        path = self.write_ndjson(
+            [recipe_record(f'Recipe {i}') for i in range(5)]
+        )
+        checkpoint = os.path.join(self.dir.name, 'checkpoint.json')
+        with open(checkpoint, 'w') as f:
+            json.dump({'source': os.path.abspath(path), 'records': 3,
+                       'imported': 3, 'skipped': 0}, f)
+
+        out, _ = self.run_import(path, '--checkpoint', checkpoint)
+
+        self.assertIn('resuming after record 3', out)
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('title', flat=True)),
+            ['Recipe 3', 'Recipe 4'],
+        )
+        with open(checkpoint) as f:
+            state = json.load(f)
+        self.assertEqual(state['records'], 5)
+        self.assertEqual(state['imported'], 5)
+        self.assertTrue(state['done'])
+
+        out, _ = self.run_import(path, '--checkpoint', checkpoint)
+        self.assertIn('already imported', out)
+        self.assertEqual(Recipe.objects.count(), 2)
+
+
+class DeferIndexesTests(TransactionTestCase):
+    """cold loads, committed batches as in a real run"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'cold@example.com', 'pass@123'
+        )
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_defer_indexes(self):
+        """indexes and foreign keys are dropped and built again"""
+        def schema():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT indexname FROM pg_indexes "
+                    "WHERE tablename LIKE 'core_recipe%' "
+                    "UNION ALL SELECT conname FROM pg_constraint "
+                    "WHERE conrelid::regclass::text LIKE 'core_recipe%'"
+                )
+                return {row[0] for row in cursor.fetchall()}
+
+        before = schema()
+        path = os.path.join(self.dir.name, 'recipes.ndjson')
+        with open(path, 'w') as f:
+            f.write(json.dumps(recipe_record('Cold load', tags=['A'])))
+        out = StringIO()
+
+        call_command('import_recipes', path, '--user', self.user.email,
+                     '--defer-indexes', '--checkpoint',
+                     os.path.join(self.dir.name, 'checkpoint.json'),
+                     stdout=out)
+
+        out = out.getvalue()
+
+        self.assertIn('recipe_search_gin', before)
+        self.assertIn('deferred', out)
+        self.assertEqual(schema(), before)
+        self.assertTrue(Recipe.objects.filter(title='Cold load').exists())
+
+    def test_defer_indexes_needs_checkpoint(self):
+        """the dropped definitions are never only in memory"""
+        with self.assertRaisesMessage(CommandError, '--checkpoint'):
+            call_command('import_recipes', 'recipes.ndjson',
+                         '--user', self.user.email, '--defer-indexes')
+
+    def interrupted_batch(self, commit):
+        """checkpoint of a run stopped after the batch of record 2 was
+        sent, committed or not"""
+        path = os.path.join(self.dir.name, 'recipes.ndjson')
+        with open(path, 'w') as f:
+            f.write('\n'.join(
+                json.dumps(recipe_record(f'Recipe {i}')) for i in range(3)
+            ))
+        try:
+            with transaction.atomic():
+                Recipe.objects.bulk_create([
+                    Recipe(user=self.user, title=f'Recipe {i}',
+                           time_minutes=10, price='4.50')
+                    for i in range(2)
+                ])
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT txid_current()')
+                    txid = cursor.fetchone()[0]
+                if not commit:
+                    raise RuntimeError
+        except RuntimeError:
+            pass
+        checkpoint = os.path.join(self.dir.name, 'checkpoint.json')
+        with open(checkpoint, 'w') as f:
+            json.dump({
+                'source': path, 'records': 0, 'imported': 0, 'skipped': 0,
+                'pending': {'records': 2, 'imported': 2, 'skipped': 0,
+                            'txid': txid},
+            }, f)
+        call_command('import_recipes', path, '--user', self.user.email,
+                     '--checkpoint', checkpoint, stdout=StringIO())
+        with open(checkpoint) as f:
+            state = json.load(f)
+        self.assertNotIn('pending', state)
+        self.assertEqual(state['imported'], 3)
+
+    def test_resume_after_committed_batch(self):
+        """a batch committed before its checkpoint is not loaded again"""
+        self.interrupted_batch(commit=True)
+
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('title', flat=True)),
+            ['Recipe 0', 'Recipe 1', 'Recipe 2'],
+        )
+
+    def test_resume_after_rolled_back_batch(self):
+        """a batch that never committed is loaded again"""
+        self.interrupted_batch(commit=False)
+
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('title', flat=True)),
+            ['Recipe 0', 'Recipe 1', 'Recipe 2'],
+        )
@@ -0,0 +1,228 @@
+"""
+Tests for the multi process metrics store and the metrics endpoint
+"""
+import multiprocessing
+import os
+import re
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import metrics, timing
+from core.cache import response_cache_stats
+from core.models import Recipe
+
+RECIPES_URL = reverse('recipe:recipe-list')
+METRICS_URL = reverse('metrics')
+
+
+def sample(text, name, **labels):
+    """value of one sample of an exposition, None when missing"""
+    wanted = {label: str(value) for label, value in labels.items()}
+    for line in text.splitlines():
+        match = re.match(r'^(\w+)(?:\{(.*)\})? (\S+)$', line)
+        if not match or match.group(1) != name:
+            continue
+        found = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2) or ''))
+        if found == wanted:
+            return float(match.group(3))
+    return None
+
+
+def count_in_child():
+    """a worker process counting once"""
+    metrics.store.reset()
+    metrics.cache_requests.inc(cache='test', result='hit')
+    metrics.image_queue_depth.set(5)
+
+
+class MetricsDirMixin:
+    """a fresh METRICS_DIR with metrics on"""
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        settings = override_settings(METRICS=True, METRICS_DIR=self.dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        metrics.store.reset()
+        self.addCleanup(metrics.store.reset)
+
+
+class MetricStoreTests(MetricsDirMixin, SimpleTestCase):
+    """values files and their aggregation"""
+
+    def test_counter_and_gauge(self):
+        """counters add up, a gauge keeps the last value"""
+        metrics.cache_requests.inc(cache='test', result='hit')
+        metrics.cache_requests.inc(2, cache='test', result='hit')
+        metrics.image_queue_depth.set(4)
+        metrics.image_queue_depth.set(2)
+
+        text = metrics.exposition()
+        self.assertEqual(
+            sample(text, 'cache_requests_total', cache='test', result='hit'),
+            3,
+        )
+        self.assertEqual(sample(text, 'image_variant_queue_depth'), 2)
+        self.assertIn('# TYPE cache_requests_total counter', text)
+
+    def test_file_grows(self):
+        """more keys than the initial file holds"""
+        for i in range(3000):
+            metrics.cache_requests.inc(cache=f'cache-{i}', result='miss')
+
+        text = metrics.exposition()
+        self.assertEqual(
+            sample(text, 'cache_requests_total', cache='cache-2999',
+                   result='miss'),
+            1,
+        )
+
+    def test_histogram_buckets_are_cumulative(self):
+        labels = {'view': 'v', 'action': 'list', 'status': 200}
+        for value in (0.003, 0.02, 0.02, 20):
+            metrics.request_duration.observe(value, **labels)
+
+        text = metrics.exposition()
+        name = 'http_request_duration_seconds'
+        labels['status'] = '200'
+        self.assertEqual(sample(text, f'{name}_bucket', le='0.005',
+                                **labels), 1)
+        self.assertEqual(sample(text, f'{name}_bucket', le='0.025',
+                                **labels), 3)
+        self.assertEqual(sample(text, f'{name}_bucket', le='10.0',
+                                **labels), 3)
+        self.assertEqual(sample(text, f'{name}_bucket', le='+Inf',
+                                **labels), 4)
+        self.assertEqual(sample(text, f'{name}_count', **labels), 4)
+        self.assertAlmostEqual(sample(text, f'{name}_sum', **labels), 20.043)
+
+    def test_processes_add_up(self):
+        """each process writes its own files, the endpoint adds them"""
+        metrics.cache_requests.inc(cache='test', result='hit')
+        metrics.cache_requests.inc(cache='test', result='miss')
+        metrics.image_queue_depth.set(1)
+        child = multiprocessing.get_context('fork').Process(
+            target=count_in_child
+        )
+        child.start()
+        child.join()
+
+        text = metrics.exposition()
+        self.assertEqual(len(os.listdir(self.dir.name)), 4)
+        self.assertEqual(
+            sample(text, 'cache_requests_total', cache='test', result='hit'),
+            2,
+        )
+        self.assertAlmostEqual(
+            sample(text, 'cache_hit_ratio', cache='test'), 2 / 3
+        )
+        # the gauge of the exited child is dropped
+        self.assertEqual(sample(text, 'image_variant_queue_depth'), 1)
+
+    def test_label_names_checked(self):
+        with self.assertRaises(ValueError):
+            metrics.cache_requests.inc(cache='test')
+
+    @override_settings(METRICS=False)
+    def test_disabled(self):
+        """nothing is written and the middleware leaves the chain"""
+        metrics.cache_requests.inc(cache='test', result='hit')
+
+        self.assertEqual(os.listdir(self.dir.name), [])
+        with self.assertRaises(MiddlewareNotUsed):
+            metrics.MetricsMiddleware(lambda request: None)
+
+
+class MetricsEndpointTests(MetricsDirMixin, TestCase):
+    """request metrics and the /metrics view"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'metrics@example.com', 'pass@123',
+        )
+        Recipe.objects.create(
+            user=self.user, title='Counted', time_minutes=5, price='5.00',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_request_metrics(self):
+        """latency by view, action and status, queries by view"""
+        response_cache_stats.reset()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(RECIPES_URL)
+        self.client.get(RECIPES_URL)
+        self.client.get(reverse('recipe:recipe-detail', args=[0]))
+
+        text = self.client.get(METRICS_URL).content.decode()
+        self.assertEqual(sample(
+            text, 'http_request_duration_seconds_count',
+            view='recipe:recipe-list', action='list', status='200',
+        ), 2)
+        self.assertEqual(sample(
+            text, 'http_request_duration_seconds_count',
+            view='recipe:recipe-detail', action='retrieve', status='404',
+        ), 1)
+        self.assertGreaterEqual(
+            sample(text, 'db_queries_total', view='recipe:recipe-list'),
+            len(queries),
+        )
+        self.assertGreater(sample(
+            text, 'db_query_duration_seconds_total', view='recipe:recipe-list'
+        ), 0)
+        stats = response_cache_stats.snapshot()
+        self.assertEqual(stats['hits'], 1)
+        self.assertAlmostEqual(
+            sample(text, 'cache_hit_ratio', cache='response'),
+            stats['hits'] / (stats['hits'] + stats['misses']),
+        )
+        # the metrics request itself is in flight
+        self.assertEqual(sample(text, 'http_requests_in_flight'), 1)
+
+    @override_settings(SERVER_TIMING=True)
+    def test_queries_shared_with_server_timing(self):
+        """one execute wrapper counts the queries for both middlewares"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertLogs('core.timing', 'INFO'):
+            res = client.get(RECIPES_URL)
+
+        self.assertEqual(connection.execute_wrappers, [timing.time_query])
+        queries = int(re.search(r'"(\d+) queries"', res['Server-Timing'])[1])
+        text = self.client.get(METRICS_URL).content.decode()
+        self.assertEqual(
+            sample(text, 'db_queries_total', view='recipe:recipe-list'),
+            queries,
+        )
+
+    def test_unmatched_route(self):
+        """unknown paths share one label"""
+        self.client.get('/api/nothing-here/')
+
+        text = self.client.get(METRICS_URL).content.decode()
+        self.assertEqual(sample(
+            text, 'http_request_duration_seconds_count',
+            view='unmatched', action='get', status='404',
+        ), 1)
+
+    def test_content_type(self):
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+
+    @override_settings(METRICS=False)
+    def test_endpoint_off(self):
+        self.assertEqual(self.client.get(METRICS_URL).status_code, 404)
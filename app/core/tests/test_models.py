@@ -87,6 +87,20 @@ class ModelTests(TestCase):
             name= "ingrediant name",
         )
         self.assertEqual(str(in_gre), in_gre.name)
+    def test_resolve_tags_creates_missing_only(self):
+        """resolve reuses existing tags and creates the rest"""
+        user = create_user()
+        other = create_user(email='other@example.com')
+        existing = models.Tag.objects.create(user=user, name='Lunch')
+        models.Tag.objects.create(user=other, name='Dinner')
+
+        tags = models.Tag.objects.resolve(user, ['Lunch', 'Dinner', 'Lunch'])
+
+        self.assertEqual([t.name for t in tags], ['Lunch', 'Dinner'])
+        self.assertEqual(tags[0], existing)
+        self.assertEqual(tags[1].user, user)
+        self.assertEqual(models.Tag.objects.filter(user=user).count(), 2)
+
     @patch('core.models.uuid.uuid4')
     def test_media_url_path(self, mock_uuid):
         """test media file path"""
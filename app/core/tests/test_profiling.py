@@ -0,0 +1,236 @@
+"""
+Tests for request profiling and the profiles command
+"""
+import os
+import tempfile
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from core.profiling import (
+    ProfilingMiddleware,
+    StackSampler,
+    list_profiles,
+    sign_profile_token,
+)
+
+ME_URL = reverse('user:me')
+
+
+def busy(seconds):
+    """keep the thread on the cpu"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class StackSamplerTests(SimpleTestCase):
+    """the sampler thread"""
+
+    def test_samples_the_calling_thread(self):
+        """stacks of the thread that made the sampler, outermost first"""
+        sampler = StackSampler(0.001)
+        sampler.enable()
+        busy(0.05)
+        sampler.disable()
+
+        self.assertTrue(sampler.stacks)
+        stack = sampler.stacks.most_common(1)[0][0]
+        self.assertIn('test_samples_the_calling_thread', stack)
+        self.assertTrue(stack.split(';')[-1].startswith('busy '))
+
+    @override_settings(PROFILING=False)
+    def test_disabled_middleware_is_unused(self):
+        """turned off, the middleware leaves the chain"""
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+
+    @override_settings(PROFILING=True, PROFILER='yappi')
+    def test_unknown_profiler(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ProfilingMiddleware(lambda request: None)
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """which requests are profiled and what is kept"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        settings = override_settings(
+            PROFILING=True,
+            PROFILE_SAMPLE_RATE=0,
+            PROFILER='cprofile',
+            PROFILE_DIR=self.dir.name,
+            PROFILE_MAX_COUNT=3,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.staff = get_user_model().objects.create_user(
+            'staff@example.com', 'pass@123', is_staff=True,
+        )
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'pass@123',
+        )
+
+    def test_unsampled_request(self):
+        """no sampling and no header, nothing is written"""
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_sampled_request(self):
+        """a pstats file and its description"""
+        with self.settings(PROFILE_SAMPLE_RATE=1):
+            self.client.get(ME_URL, {'a': 1})
+
+        profiles = list_profiles(self.dir.name)
+        self.assertEqual(len(profiles), 1)
+        profile = profiles[0]
+        self.assertEqual(profile['path'], ME_URL)
+        self.assertEqual(profile['query'], 'a=1')
+        self.assertEqual(profile['status'], 401)
+        self.assertEqual(profile['reason'], 'sampled')
+        self.assertTrue(profile['file'].endswith('.pstats'))
+        self.assertTrue(os.path.getsize(profile['file_path']))
+
+    def test_signed_header_of_staff(self):
+        """a header signed for a staff user profiles the request"""
+        self.client.get(
+            ME_URL, HTTP_X_PROFILE=sign_profile_token(self.staff)
+        )
+
+        profiles = list_profiles(self.dir.name)
+        self.assertEqual([p['reason'] for p in profiles], ['requested'])
+
+    def test_header_ignored(self):
+        """headers of other users, tampered or expired, are ignored"""
+        token = sign_profile_token(self.staff)
+        for header in (
+            sign_profile_token(self.user),
+            token[:-1] + ('A' if token[-1] != 'A' else 'B'),
+            'garbage',
+        ):
+            self.client.get(ME_URL, HTTP_X_PROFILE=header)
+        with self.settings(PROFILE_TOKEN_MAX_AGE=-1):
+            self.client.get(ME_URL, HTTP_X_PROFILE=token)
+
+        self.assertEqual(list_profiles(self.dir.name), [])
+
+    def test_ring_buffer(self):
+        """only the most recent profiles are kept"""
+        with self.settings(PROFILE_SAMPLE_RATE=1):
+            for i in range(5):
+                self.client.get(ME_URL, {'i': i})
+
+        profiles = list_profiles(self.dir.name)
+        self.assertEqual(
+            [p['query'] for p in profiles], ['i=2', 'i=3', 'i=4']
+        )
+        self.assertEqual(len(os.listdir(self.dir.name)), 6)
+
+    def test_sampler_profile(self):
+        """the sampler writes collapsed stacks"""
+        with self.settings(PROFILE_SAMPLE_RATE=1, PROFILER='sampler',
+                           PROFILE_SAMPLE_INTERVAL=0.0005):
+            self.client.get(ME_URL)
+
+        profile = list_profiles(self.dir.name)[0]
+        self.assertTrue(profile['file'].endswith('.collapsed'))
+        with open(profile['file_path']) as stacks_file:
+            for line in stacks_file:
+                stack, count = line.rsplit(' ', 1)
+                self.assertGreater(int(count), 0)
+
+
+class ProfilesCommandTests(TestCase):
+    """manage.py profiles"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        settings = override_settings(
+            PROFILING=True, PROFILE_SAMPLE_RATE=1, PROFILE_DIR=self.dir.name,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def command(self, *args):
+        out = StringIO()
+        call_command('profiles', *args, stdout=out)
+        return out.getvalue()
+
+    def test_list(self):
+        """one line per profile, filtered by path"""
+        self.client.get(ME_URL)
+        self.client.get('/api/docs/')
+
+        out = self.command('list')
+        self.assertIn(f'GET {ME_URL}', out)
+        self.assertIn('2 profiles', out)
+        self.assertIn('1 profiles', self.command('list', '--path', '/me'))
+
+    def test_aggregate_pstats(self):
+        """the cProfile stats of all matching requests merged"""
+        for _ in range(2):
+            self.client.get(ME_URL)
+
+        out = self.command('aggregate', '--limit', '5')
+
+        self.assertIn('cProfile stats of 2 requests', out)
+        self.assertIn('function calls', out)
+
+    def test_aggregate_collapsed(self):
+        """sampled stacks merged into one file"""
+        with self.settings(PROFILER='sampler'):
+            for _ in range(2):
+                self.client.get(ME_URL)
+        stacks = {}
+        for profile in list_profiles(self.dir.name):
+            with open(profile['file_path']) as stacks_file:
+                for line in stacks_file:
+                    stack, count = line.rsplit(' ', 1)
+                    stacks[stack] = stacks.get(stack, 0) + int(count)
+        output = os.path.join(self.dir.name, 'merged.txt')
+
+        out = self.command('aggregate', '--output', output)
+
+        self.assertIn(f'{sum(stacks.values())} samples of 2 requests', out)
+        with open(output) as merged:
+            self.assertEqual(
+                {stack: int(count) for stack, count in
+                 (line.rsplit(' ', 1) for line in merged)},
+                stacks,
+            )
+
+    def test_aggregate_nothing(self):
+        with self.assertRaises(CommandError):
+            self.command('aggregate')
+
+    def test_sign(self):
+        """a header value for staff users only"""
+        get_user_model().objects.create_user(
+            'staff@example.com', 'pass@123', is_staff=True,
+        )
+        get_user_model().objects.create_user('user@example.com', 'pw')
+
+        token = self.command('sign', 'staff@example.com').strip()
+        with self.settings(PROFILE_SAMPLE_RATE=0):
+            self.client.get(ME_URL, HTTP_X_PROFILE=token)
+
+        self.assertEqual(len(list_profiles(self.dir.name)), 1)
+        with self.assertRaises(CommandError):
+            self.command('sign', 'user@example.com')
+
+    def test_clear(self):
+        self.client.get(ME_URL)
+
+        self.command('clear')
+
+        self.assertEqual(os.listdir(self.dir.name), [])
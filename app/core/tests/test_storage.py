@@ -0,0 +1,190 @@
+"""
+Tests for content addressed image storage
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections, transaction
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+
+from core import images
+from core.models import Recipe
+from core.resize_cache import resize_cache
+from core.storage import lock_image, recipe_image_storage, release_image
+from core.views import serve_media
+
+
+class ContentAddressedStorageTests(TestCase):
+    """images are stored once per content"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.user = get_user_model().objects.create_user(
+            'storage@example.com',
+            'pass@123',
+        )
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def create_recipe(self, content=b'photo', name='photo.JPG'):
+        """create a recipe with an uploaded image"""
+        recipe = Recipe.objects.create(
+            user=self.user, title='Photo', time_minutes=5, price=5,
+        )
+        recipe.image.save(name, SimpleUploadedFile(name, content))
+        return recipe
+
+    def test_name_is_content_hash(self):
+        """the file name is the sha256 of the bytes"""
+        name = recipe_image_storage.save(
+            'uploads/recipe/upload.JPG', ContentFile(b'photo')
+        )
+
+        digest = hashlib.sha256(b'photo').hexdigest()
+        self.assertEqual(
+            name, f'uploads/recipe/{digest[:2]}/{digest}.jpg'
+        )
+        with recipe_image_storage.open(name) as image_file:
+            self.assertEqual(image_file.read(), b'photo')
+        self.assertEqual(
+            os.listdir(os.path.dirname(recipe_image_storage.path(name))),
+            [f'{digest}.jpg'],
+        )
+
+    def test_same_content_stored_once(self):
+        """recipes uploading the same bytes share one file"""
+        first = self.create_recipe()
+        second = self.create_recipe(name='copy.jpg')
+        other = self.create_recipe(content=b'other')
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+
+    def test_release_keeps_referenced_image(self):
+        """a file used by another recipe is not deleted"""
+        first = self.create_recipe()
+        second = self.create_recipe()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+
+        self.assertTrue(recipe_image_storage.exists(second.image.name))
+
+    def test_release_deletes_unused_image_and_variants(self):
+        """the last recipe going away removes the file and variants"""
+        recipe = self.create_recipe()
+        name = recipe.image.name
+        variant = images.variant_name(name, 'thumbnail', 'webp')
+        recipe_image_storage.save(variant, ContentFile(b'variant'))
+        render = resize_cache.path(name, 160, 'webp')
+        os.makedirs(os.path.dirname(render))
+        with open(render, 'wb') as render_file:
+            render_file.write(b'render')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+
+        self.assertFalse(recipe_image_storage.exists(name))
+        self.assertFalse(recipe_image_storage.exists(variant))
+        self.assertFalse(os.path.exists(render))
+
+    def test_release_waits_for_commit(self):
+        """nothing is deleted before the transaction commits"""
+        recipe = self.create_recipe()
+        Recipe.objects.filter(id=recipe.id).update(image='')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            release_image(recipe.image.name)
+            self.assertTrue(recipe_image_storage.exists(recipe.image.name))
+        callbacks[0]()
+
+        self.assertFalse(recipe_image_storage.exists(recipe.image.name))
+
+    def test_replaced_image_released(self):
+        """saving a recipe with another image releases the old file"""
+        recipe = self.create_recipe()
+        old_name = recipe.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image.save('new.jpg', SimpleUploadedFile('n', b'new'))
+
+        self.assertFalse(recipe_image_storage.exists(old_name))
+        self.assertTrue(recipe_image_storage.exists(recipe.image.name))
+
+    def test_replaced_deferred_image_released(self):
+        """the old name is read when the recipe was loaded without it"""
+        old_name = self.create_recipe().image.name
+        recipe = Recipe.objects.only('title').get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image = None
+            recipe.save()
+
+        self.assertFalse(recipe_image_storage.exists(old_name))
+
+
+class ImageLockTests(TransactionTestCase):
+    """releases and saves of the same file"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_release_waits_for_reuse(self):
+        """a file reused while it is being released is kept"""
+        name = recipe_image_storage.save(
+            'uploads/recipe/photo.jpg', ContentFile(b'photo')
+        )
+        recipe = Recipe.objects.create(
+            user=get_user_model().objects.create_user('lock@example.com'),
+            title='Photo', time_minutes=5, price=5,
+        )
+
+        def release():
+            release_image(name)
+            connections.close_all()
+
+        with transaction.atomic():
+            # what saving the same bytes again does
+            lock_image(name)
+            releasing = threading.Thread(target=release)
+            releasing.start()
+            releasing.join(0.2)
+            self.assertTrue(releasing.is_alive())
+            Recipe.objects.filter(id=recipe.id).update(image=name)
+        releasing.join()
+
+        self.assertTrue(recipe_image_storage.exists(name))
+
+
+class ServeMediaTests(TestCase):
+    """media responses can be cached forever"""
+
+    def test_immutable_cache_headers(self):
+        with tempfile.TemporaryDirectory() as media:
+            with open(os.path.join(media, 'photo.jpg'), 'wb') as image_file:
+                image_file.write(b'photo')
+            request = RequestFactory().get('/static/media/photo.jpg')
+
+            res = serve_media(request, 'photo.jpg', document_root=media)
+
+            self.assertIn('immutable', res['Cache-Control'])
+            self.assertIn('max-age=31536000', res['Cache-Control'])
+            res.close()
@@ -0,0 +1,149 @@
+"""
+Tests for the Server-Timing instrumentation
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+from core.timing import ServerTimingMiddleware, Timing, _current, timed
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def metrics(response):
+    """Server-Timing metrics of a response as {name: (ms, desc)}"""
+    result = {}
+    for metric in response['Server-Timing'].split(', '):
+        name, *params = metric.split(';')
+        params = dict(param.split('=', 1) for param in params)
+        result[name] = (float(params['dur']), params.get('desc'))
+    return result
+
+
+class TimingTests(SimpleTestCase):
+    """phase bookkeeping of one request"""
+
+    def test_nested_phase_counted_once(self):
+        """a phase entered again while running adds nothing"""
+        timing = Timing()
+        token = _current.set(timing)
+        try:
+            with timed('serialize'):
+                with timed('serialize'):
+                    pass
+                self.assertEqual(timing.durations, {})
+            with timed('serialize'):
+                pass
+        finally:
+            _current.reset(token)
+
+        self.assertEqual(list(timing.durations), ['serialize'])
+
+    def test_timed_without_request(self):
+        """outside a timed request the block just runs"""
+        with timed('serialize'):
+            pass
+
+    def test_header(self):
+        """phases in a fixed order, the query count as description"""
+        timing = Timing()
+        timing.add('view', 0.0125)
+        timing.add('db', 0.002)
+        timing.queries = 3
+        timing.finish()
+
+        self.assertRegex(
+            timing.header(),
+            r'^db;dur=2\.00;desc="3 queries", view;dur=12\.50, '
+            r'total;dur=\d+\.\d\d$',
+        )
+
+    @override_settings(SERVER_TIMING=False)
+    def test_disabled_middleware_is_unused(self):
+        """turned off, the middleware leaves the chain"""
+        with self.assertRaises(MiddlewareNotUsed):
+            ServerTimingMiddleware(lambda request: None)
+
+
+class ServerTimingApiTests(TestCase):
+    """Server-Timing headers and log lines of api requests"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'timing@example.com',
+            'pass@123',
+        )
+        Token.objects.create(user=self.user)
+        recipe = Recipe.objects.create(
+            user=self.user, title='Timed', time_minutes=5, price='5.00',
+        )
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Dinner'))
+
+    def client_for(self):
+        """a client made under the current settings"""
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.user.auth_token.key}'
+        )
+        return client
+
+    def test_no_header_when_disabled(self):
+        """the default settings add nothing to responses"""
+        res = self.client_for().get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Server-Timing', res)
+
+    @override_settings(SERVER_TIMING=True)
+    def test_recipe_list_phases(self):
+        """every phase of a viewset request, queries counted"""
+        client = self.client_for()
+        with CaptureQueriesContext(connection) as queries, \
+                self.assertLogs('core.timing', 'INFO') as logs:
+            res = client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, 200)
+        timings = metrics(res)
+        self.assertEqual(
+            list(timings),
+            ['auth', 'db', 'serialize', 'view', 'render', 'total'],
+        )
+        self.assertEqual(timings['db'][1], f'"{len(queries)} queries"')
+        self.assertLessEqual(timings['serialize'][0], timings['view'][0])
+        self.assertLessEqual(timings['view'][0], timings['total'][0])
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['path'], RECIPES_URL)
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['queries'], len(queries))
+        self.assertIn('render_ms', record)
+
+    @override_settings(API_RESPONSE_CACHE_TIMEOUT=0)
+    def test_timed_serializer_keeps_output(self):
+        """the timed serializer class renders the same data"""
+        expected = self.client_for().get(RECIPES_URL).json()
+        with self.settings(SERVER_TIMING=True), \
+                self.assertLogs('core.timing', 'INFO'):
+            res = self.client_for().get(RECIPES_URL)
+
+        self.assertIn('serialize;dur=', res['Server-Timing'])
+        self.assertEqual(res.json(), expected)
+
+    @override_settings(SERVER_TIMING=True)
+    def test_unresolved_url(self):
+        """a request that never reaches a view only has a total"""
+        with self.assertLogs('core.timing', 'INFO'):
+            res = self.client.get('/api/does-not-exist/')
+
+        self.assertEqual(res.status_code, 404)
+        self.assertRegex(res['Server-Timing'], r'^total;dur=\d+\.\d\d$')
@@ -0,0 +1,73 @@
+"""
+Tests for bounded image uploads
+"""
+import io
+from unittest.mock import patch
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from PIL import Image, ImageFile
+
+from core.uploads import InvalidImage, clean_image, probe_image
+
+
+def image_upload(size=(40, 20), fmt='JPEG', name='photo.jpeg', exif=None):
+    """uploaded file holding a generated image"""
+    buffer = io.BytesIO()
+    image = Image.new('RGB', size, 'red')
+    image.save(buffer, format=fmt, **({'exif': exif} if exif else {}))
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ImageUploadTests(SimpleTestCase):
+    """probe and re-encode uploaded images"""
+
+    def test_probe_reads_header_only(self):
+        """format and size are known without decoding pixels"""
+        with patch.object(ImageFile.ImageFile, 'load') as patched:
+            self.assertEqual(
+                probe_image(image_upload()), ('JPEG', (40, 20))
+            )
+        patched.assert_not_called()
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=799)
+    def test_too_many_pixels(self):
+        """images over the pixel limit are refused before decoding"""
+        with patch('core.uploads._reencode') as patched:
+            with self.assertRaisesMessage(InvalidImage, 'too many pixels'):
+                clean_image(image_upload())
+        patched.assert_not_called()
+
+    def test_unsupported_format(self):
+        """only jpeg, png and webp are accepted"""
+        for upload in (
+            image_upload(fmt='GIF', name='photo.gif'),
+            SimpleUploadedFile('photo.jpg', b'not an image'),
+        ):
+            with self.assertRaises(InvalidImage):
+                clean_image(upload)
+
+    def test_truncated_image(self):
+        """a valid header with broken data is refused"""
+        buffer = io.BytesIO()
+        Image.effect_noise((200, 200), 64).save(buffer, format='JPEG')
+        data = buffer.getvalue()
+        upload = SimpleUploadedFile('photo.jpg', data[:len(data) // 2])
+
+        with self.assertRaisesMessage(InvalidImage, 'valid image'):
+            clean_image(upload)
+
+    def test_exif_stripped_and_orientation_applied(self):
+        """the copy is upright and has no exif"""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotated 90 degrees clockwise
+        exif[0x010f] = 'Camera'
+        upload = image_upload(exif=exif.tobytes())
+
+        cleaned = clean_image(upload)
+
+        self.assertEqual(cleaned.name, 'photo.jpg')
+        with Image.open(cleaned) as image:
+            self.assertEqual(image.size, (20, 40))
+            self.assertEqual(dict(image.getexif()), {})
+        cleaned.close()
@@ -0,0 +1,280 @@
+"""
+Per request timing reported as Server-Timing headers and log lines
+
+With SERVER_TIMING on, ServerTimingMiddleware times each request in these
+phases:
+
+  auth       authentication, permissions and throttling of DRF views
+  db         every SQL query, with their count
+  serialize  serializer to_representation of DRF views
+  view       the view, including the phases above
+  render     rendering of the response
+  total      the whole request, other middlewares included
+
+and sends them as a Server-Timing header and one JSON line on the
+core.timing logger. Turned off, the middleware leaves the chain when it is
+loaded and the view hooks only read an empty context variable.
+
+The queries of a request are counted by one execute wrapper, shared with
+the metrics middleware through request_queries(). Under ASGI the
+middleware and its view hooks are async, so the async views keep serving
+requests concurrently.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+# Server-Timing order of the phases
+PHASES = ['auth', 'db', 'serialize', 'view', 'render', 'total']
+
+_current = contextvars.ContextVar('server_timing', default=None)
+_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+class Timing:
+    """Durations of the phases of one request, in seconds"""
+
+    def __init__(self):
+        self.durations = {}
+        self.queries = 0
+        self._started = {'total': time.perf_counter()}
+
+    def begin(self, phase):
+        """start a phase, False when it is running already"""
+        if phase in self._started:
+            return False
+        self._started[phase] = time.perf_counter()
+        return True
+
+    def end(self, phase):
+        start = self._started.pop(phase, None)
+        if start is not None:
+            self.add(phase, time.perf_counter() - start)
+
+    def add(self, phase, seconds):
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+
+    def finish(self):
+        """end the phases still running, the view of a plain response"""
+        for phase in list(self._started):
+            self.end(phase)
+
+    def header(self):
+        """the Server-Timing header value, durations in milliseconds"""
+        metrics = []
+        for phase in PHASES:
+            if phase not in self.durations:
+                continue
+            metric = f'{phase};dur={self.durations[phase] * 1000:.2f}'
+            if phase == 'db':
+                metric += f';desc="{self.queries} queries"'
+            metrics.append(metric)
+        return ', '.join(metrics)
+
+    def record(self, request, response):
+        """fields of the log line of a request"""
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': self.queries,
+        }
+        for phase in PHASES:
+            if phase in self.durations:
+                record[f'{phase}_ms'] = round(self.durations[phase] * 1000, 2)
+        return record
+
+
+@contextmanager
+def timed(phase):
+    """add the time of the block to a phase of the current request
+
+    Nested blocks of a phase, like the serializers of nested fields, are
+    only counted once.
+    """
+    timing = _current.get()
+    if timing is None or not timing.begin(phase):
+        yield
+        return
+    try:
+        yield
+    finally:
+        timing.end(phase)
+
+
+class RequestQueries:
+    """SQL queries of the request being served"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+
+def time_query(execute, sql, params, many, context):
+    """execute wrapper adding queries to the current request"""
+    queries = _queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.time += time.perf_counter() - start
+        queries.count += 1
+
+
+def install_query_timer(connection, **kwargs):
+    """wrap the queries of a connection, once"""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def watch_queries():
+    """time the queries of the connections of every thread, async workers
+    too"""
+    connection_created.connect(install_query_timer)
+    for connection in connections.all():
+        install_query_timer(connection)
+
+
+@contextmanager
+def request_queries():
+    """the RequestQueries of the block, the one of an outer block when
+    nested, so every middleware of a request reads the same counts"""
+    queries = _queries.get()
+    if queries is not None:
+        yield queries
+        return
+    queries = RequestQueries()
+    token = _queries.set(queries)
+    try:
+        yield queries
+    finally:
+        _queries.reset(token)
+
+
+class TimedSerializerMixin:
+    """Time to_representation as the serialize phase"""
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+_timed_serializers = {}
+
+
+def timed_serializer(serializer_class):
+    """subclass of serializer_class timing its representation"""
+    timed_class = _timed_serializers.get(serializer_class)
+    if timed_class is None:
+        timed_class = _timed_serializers[serializer_class] = type(
+            serializer_class.__name__,
+            (TimedSerializerMixin, serializer_class),
+            {'__module__': serializer_class.__module__},
+        )
+    return timed_class
+
+
+class ServerTimingMixin:
+    """Time the auth and serialize phases of a DRF view"""
+
+    def initial(self, request, *args, **kwargs):
+        with timed('auth'):
+            super().initial(request, *args, **kwargs)
+
+    def get_serializer(self, *args, **kwargs):
+        if _current.get() is None:
+            return super().get_serializer(*args, **kwargs)
+        # get_serializer_class is overridden by the views themselves
+        serializer_class = timed_serializer(self.get_serializer_class())
+        kwargs.setdefault('context', self.get_serializer_context())
+        return serializer_class(*args, **kwargs)
+
+
+@sync_and_async_middleware
+class ServerTimingMiddleware:
+    """Report the phases of each request, unused unless SERVER_TIMING
+
+    The header tells clients how long the queries of a request take, only
+    turn it on where they are trusted.
+    """
+
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = asyncio.iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Django would run sync hooks in the thread of the sync code
+            self.process_view = self._process_view_async
+            self.process_template_response = \
+                self._process_template_response_async
+        watch_queries()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timing = Timing()
+        token = _current.set(timing)
+        try:
+            with request_queries() as queries:
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._report(request, response, timing, queries)
+
+    async def __acall__(self, request):
+        timing = Timing()
+        token = _current.set(timing)
+        try:
+            with request_queries() as queries:
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._report(request, response, timing, queries)
+
+    def _report(self, request, response, timing, queries):
+        timing.finish()
+        if queries.count:
+            timing.add('db', queries.time)
+            timing.queries = queries.count
+        response['Server-Timing'] = timing.header()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(timing.record(request, response)))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timing = _current.get()
+        if timing is not None:
+            timing.begin('view')
+
+    async def _process_view_async(self, *args):
+        ServerTimingMiddleware.process_view(self, *args)
+
+    def process_template_response(self, request, response):
+        """the view returned, rendering comes right after this hook"""
+        timing = _current.get()
+        if timing is not None:
+            timing.end('view')
+            timing.begin('render')
+            response.add_post_render_callback(lambda _: timing.end('render'))
+        return response
+
+    async def _process_template_response_async(self, request, response):
+        return ServerTimingMiddleware.process_template_response(
+            self, request, response
+        )
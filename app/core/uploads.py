@@ -0,0 +1,106 @@
+"""
+Bounded upload handling for recipe images
+
+Uploads are always streamed to a temporary file and stop as soon as they
+pass UPLOAD_MAX_FILE_SIZE. Images are then checked from their header only,
+format and pixel count, before anything is decoded. Accepted images are
+decoded once in a small worker pool, so at most IMAGE_UPLOAD_WORKERS images
+are held in memory at a time, and re-encoded without their EXIF data.
+"""
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.translation import gettext as _
+from django.utils.translation import gettext_lazy
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_UPLOAD_WORKERS,
+    thread_name_prefix='image-upload',
+)
+
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+
+class UploadTooLarge(APIException):
+    """the request body or one of its files is over the size limit"""
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = gettext_lazy('Upload is too large.')
+    default_code = 'upload_too_large'
+
+
+class InvalidImage(ValueError):
+    """the upload is not an acceptable image"""
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """write uploads to disk and stop past UPLOAD_MAX_FILE_SIZE"""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        # other form fields are already capped by DATA_UPLOAD_MAX_MEMORY_SIZE
+        limit = settings.UPLOAD_MAX_FILE_SIZE + \
+            settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        if content_length and content_length > limit:
+            raise UploadTooLarge()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.UPLOAD_MAX_FILE_SIZE:
+            self.file.close()
+            raise UploadTooLarge()
+        return super().receive_data_chunk(raw_data, start)
+
+
+def probe_image(image_file):
+    """return (format, size) from the image header, nothing is decoded"""
+    image_file.seek(0)
+    try:
+        with Image.open(image_file, formats=list(FORMAT_EXTENSIONS)) as image:
+            fmt, size = image.format, image.size
+    except Image.DecompressionBombError:
+        raise InvalidImage(_('Image has too many pixels.'))
+    except (UnidentifiedImageError, OSError):
+        raise InvalidImage(_('Upload a JPEG, PNG or WebP image.'))
+    if size[0] * size[1] > settings.RECIPE_IMAGE_MAX_PIXELS:
+        raise InvalidImage(_('Image has too many pixels.'))
+    return fmt, size
+
+
+def _reencode(image_file, fmt):
+    """decode, apply the orientation and encode again without exif"""
+    image_file.seek(0)
+    output = tempfile.NamedTemporaryFile(
+        suffix=FORMAT_EXTENSIONS[fmt], dir=settings.FILE_UPLOAD_TEMP_DIR
+    )
+    try:
+        with Image.open(image_file, formats=[fmt]) as image:
+            image = ImageOps.exif_transpose(image)
+            if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(
+                output,
+                format=fmt,
+                quality=settings.RECIPE_IMAGE_UPLOAD_QUALITY,
+            )
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+
+def clean_image(image_file):
+    """return a re-encoded copy of an uploaded image, raise InvalidImage"""
+    fmt = probe_image(image_file)[0]
+    try:
+        output = executor.submit(_reencode, image_file, fmt).result()
+    except (OSError, SyntaxError, ValueError):
+        raise InvalidImage(_('Upload a valid image.'))
+    root = os.path.splitext(os.path.basename(image_file.name or ''))[0]
+    return File(output, name=f'{root or "image"}{FORMAT_EXTENSIONS[fmt]}')
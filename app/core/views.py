@@ -0,0 +1,36 @@
+"""
+Views for serving media files and metrics
+"""
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+from core.metrics import exposition
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """serve a media file with far future immutable cache headers
+
+    Recipe images are named by the hash of their content, so a url always
+    points at the same bytes and clients never need to revalidate.
+    """
+    response = serve(request, path, document_root, show_indexes)
+    if response.status_code == 200:
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=settings.MEDIA_CACHE_MAX_AGE,
+            immutable=True,
+        )
+    return response
+
+
+def metrics(request):
+    """the metrics of every process in the Prometheus text format"""
+    if not settings.METRICS:
+        raise Http404
+    return HttpResponse(
+        exposition(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
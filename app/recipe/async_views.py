@@ -0,0 +1,58 @@
+"""
+Async read views for the recipe apis
+
+Django 3.2 has no async ORM and, under ASGI, runs every sync view on one
+shared thread, so a slow query or slow client holds up every other request
+of the process. These views stay on the event loop and hand the blocking
+viewset work (queries, serialization and rendering) to a bounded thread
+pool, each worker with its own database connection.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from recipe import views
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_VIEW_WORKERS,
+    thread_name_prefix='async-view',
+)
+
+
+def _run_view(view, request, *args, **kwargs):
+    """run a sync view and render it in a worker thread"""
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_view(viewset, actions):
+    """async view serving viewset actions from the thread pool"""
+    view = viewset.as_view(actions)
+
+    async def wrapper(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            executor,
+            functools.partial(
+                context.run, _run_view, view, request, *args, **kwargs
+            ),
+        )
+
+    # keeps csrf_exempt and the viewset attributes of the drf view
+    return functools.wraps(view)(wrapper)
+
+
+recipe_list = async_view(views.RecipeViewSet, {'get': 'list'})
+recipe_detail = async_view(views.RecipeViewSet, {'get': 'retrieve'})
+tag_list = async_view(views.TagViewSet, {'get': 'list'})
+ingredient_list = async_view(views.IngredientViewSet, {'get': 'list'})
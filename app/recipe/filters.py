@@ -0,0 +1,27 @@
+"""
+Filter backends for the recipe apis
+"""
+from rest_framework.filters import OrderingFilter
+
+
+class StableOrderingFilter(OrderingFilter):
+    """OrderingFilter with -id as last key, so ties keep a fixed order
+
+    Cursor pagination needs a stable order to page through rows sharing
+    the value of the first ordering field. Autocomplete lists are ranked
+    by the view and left alone, as are single objects, whose querysets
+    lack the annotations of the list.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view))
+        if '-id' not in ordering and 'id' not in ordering:
+            ordering.append('-id')
+        return ordering
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'autocomplete', ''):
+            return queryset
+        if getattr(view, 'action', 'list') != 'list':
+            return queryset
+        return super().filter_queryset(request, queryset, view)
@@ -0,0 +1,87 @@
+"""
+Viewset mixins for recipe apis
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, urlencode
+from rest_framework.response import Response
+
+from core.cache import get_user_version, response_cache_stats
+
+
+def request_fingerprint(request):
+    """digest of what a GET response depends on, for the current version"""
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    version = get_user_version(request.user.pk)
+    renderer = request.accepted_renderer.format
+    return hashlib.md5(
+        f'{request.user.pk}:{version}:{renderer}:{request.path}?{query}'
+        .encode()
+    ).hexdigest()
+
+
+class ReadResponseMixin:
+    """Route list reads through read_response so mixins can wrap them"""
+
+    def read_response(self, handler, request, *args, **kwargs):
+        """return the response of a read handler"""
+        return handler(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return self.read_response(super().list, request, *args, **kwargs)
+
+
+class CachedResponseMixin(ReadResponseMixin):
+    """Cache GET responses per user, path, query and user version"""
+
+    def read_response(self, handler, request, *args, **kwargs):
+        """return the cached response or run handler and cache it"""
+        key = f'response:{request_fingerprint(request)}'
+        data = cache.get(key)
+        if data is not None:
+            response_cache_stats.hit()
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response_cache_stats.miss()
+        response = super().read_response(handler, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(
+                key, response.data, settings.API_RESPONSE_CACHE_TIMEOUT
+            )
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class ConditionalGetMixin(ReadResponseMixin):
+    """ETag and Last-Modified validators, 304 when they still match"""
+
+    def get_last_modified(self, request, *args, **kwargs):
+        """modification time of the resource, None when unknown"""
+        return None
+
+    def read_response(self, handler, request, *args, **kwargs):
+        """answer 304 without building the body when validators match"""
+        etag = f'"{request_fingerprint(request)}"'
+        last_modified = self.get_last_modified(request, *args, **kwargs)
+        timestamp = last_modified and int(last_modified.timestamp())
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=timestamp,
+        )
+        if response is None:
+            response = super().read_response(
+                handler, request, *args, **kwargs
+            )
+
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp:
+                response['Last-Modified'] = http_date(timestamp)
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
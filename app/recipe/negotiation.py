@@ -0,0 +1,18 @@
+"""
+Content negotiation for the recipe apis
+"""
+from rest_framework.negotiation import BaseContentNegotiation
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """Use the first renderer whatever the Accept header says
+
+    For views returning files, where the renderer is only used for errors
+    and image/* requests must not fail with 406.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
@@ -0,0 +1,28 @@
+"""
+Pagination for recipe apis
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class BaseCursorPagination(CursorPagination):
+    """Keyset pagination, no OFFSET scans and no COUNT(*)"""
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class RecipeCursorPagination(BaseCursorPagination):
+    """Newest recipes first, best matches first for searches"""
+    ordering = '-id'
+    search_ordering = ('-rank', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        if 'rank' in queryset.query.annotations:
+            return self.search_ordering
+        return super().get_ordering(request, queryset, view)
+
+
+class NameCursorPagination(BaseCursorPagination):
+    """Tags and ingredients by name, names are unique per user"""
+    ordering = '-name'
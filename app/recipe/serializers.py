@@ -2,8 +2,92 @@
 serializers for recipe
 """
 
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext as _
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
+from core.cache import invalidate_user
+from core.images import variant_urls
 from core.models import Recipe, Tag, Ingredient
+from core.uploads import InvalidImage, clean_image
+
+
+def link_recipe_attrs(field_name, user_id, names_by_recipe, replace_ids=()):
+    """resolve tag or ingredient names once and link them to recipes
+
+    names_by_recipe maps recipe ids to names, links of replace_ids are
+    cleared first.
+    """
+    field = Recipe._meta.get_field(field_name)
+    through = field.remote_field.through
+    attr = field.m2m_reverse_field_name()
+    if replace_ids:
+        through.objects.filter(recipe_id__in=replace_ids).delete()
+
+    objs = {
+        obj.name: obj
+        for obj in field.related_model.objects.resolve(
+            user_id,
+            [name for names in names_by_recipe.values() for name in names],
+        )
+    }
+    through.objects.bulk_create(
+        [
+            through(recipe_id=recipe_id, **{f'{attr}_id': objs[name].id})
+            for recipe_id, names in names_by_recipe.items()
+            for name in names
+        ],
+        ignore_conflicts=True,
+    )
+
+
+@extend_schema_field(OpenApiTypes.OBJECT)
+class ImageVariantsField(serializers.Field):
+    """urls of the resized copies of an image that are ready"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'image')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        urls = variant_urls(value.name, value.storage) if value else {}
+        request = self.context.get('request')
+        if request is None:
+            return urls
+        return {
+            variant: {
+                fmt: request.build_absolute_uri(url)
+                for fmt, url in formats.items()
+            }
+            for variant, formats in urls.items()
+        }
+
+
+class CleanImageField(serializers.FileField):
+    """image upload checked from its header and re-encoded without exif"""
+
+    def to_internal_value(self, data):
+        upload = super().to_internal_value(data)
+        try:
+            return clean_image(upload)
+        except InvalidImage as exc:
+            raise serializers.ValidationError(str(exc))
+
+
+class CleanImageMixin:
+    """Close the re-encoded copy of an uploaded image once it is stored"""
+
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -23,6 +107,22 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
         read_only_fields = ['id']
 
+
+class IngredientCountSerializer(IngredientSerializer):
+    """Ingredient with the number of recipes using it"""
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(IngredientSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields + ['recipe_count']
+
+
+class TagCountSerializer(TagSerializer):
+    """Tag with the number of recipes using it"""
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ['recipe_count']
+
 class RecipeSerializer(serializers.ModelSerializer):
     """
        RecipeSerializer
@@ -35,33 +135,24 @@ class RecipeSerializer(serializers.ModelSerializer):
         fields = ['id', 'title','time_minutes', 'price', 'link', 'tags', 'ingredients']
         # read_only_fields = ['id']
 
-    def _get_or_create_tags(self, tags, recipe):
-        """upate or create tags"""
-        auth_user = self.context['request'].user
-        for t in tags:
-            tag_obj, created = Tag.objects.get_or_create(
-                user=auth_user,
-                **t,
-            )
-            recipe.tags.add(tag_obj)
-
-    def _get_or_create_ingredients(self, ingredients, recipe):
-        """upate or create tags"""
-        auth_user = self.context['request'].user
-        for ingre in ingredients:
-            ingredient_obj, created = Ingredient.objects.get_or_create(
-                user=auth_user,
-                **ingre,
-            )
-            recipe.ingredients.add(ingredient_obj)
+    def _add_attrs(self, recipe, field_name, items, replace=False):
+        """resolve tags or ingredients by name and link them in bulk"""
+        link_recipe_attrs(
+            field_name,
+            recipe.user_id,
+            {recipe.id: [item['name'] for item in items]},
+            replace_ids=[recipe.id] if replace else (),
+        )
+        getattr(recipe, '_prefetched_objects_cache', {}).pop(field_name, None)
 
     def create(self, validated_data):
         """create recipe with tags"""
         tags = validated_data.pop('tags', [])
         ingredients = validated_data.pop('ingredients', [])
-        recipe = Recipe.objects.create(**validated_data)
-        self._get_or_create_tags(tags, recipe)
-        self._get_or_create_ingredients(ingredients, recipe)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(**validated_data)
+            self._add_attrs(recipe, 'tags', tags)
+            self._add_attrs(recipe, 'ingredients', ingredients)
 
         return recipe
 
@@ -69,31 +160,196 @@ class RecipeSerializer(serializers.ModelSerializer):
         """upate or patch method"""
         tags = validated_data.pop('tags', None)
         ingredients = validated_data.pop('ingredients', None)
-        if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(tags, instance)
+        with transaction.atomic():
+            if tags is not None:
+                self._add_attrs(instance, 'tags', tags, replace=True)
 
-        if ingredients is not None:
-            instance.ingredients.clear()
-            self._get_or_create_ingredients(ingredients, instance)
+            if ingredients is not None:
+                self._add_attrs(
+                    instance, 'ingredients', ingredients, replace=True
+                )
 
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
 
-        instance.save()
+            instance.save()
         return instance
 
 
-class RecipeDetailSerializer(RecipeSerializer):
+class RecipeDetailSerializer(CleanImageMixin, RecipeSerializer):
     """details serializer"""
+    image = CleanImageField(required=False, allow_null=True)
+    image_variants = ImageVariantsField()
+
     class Meta(RecipeSerializer.Meta):
-        fields = RecipeSerializer.Meta.fields + ['description', 'image']
+        fields = RecipeSerializer.Meta.fields + [
+            'description', 'image', 'image_variants'
+        ]
 
-class RecipeImageSerializer(serializers.ModelSerializer):
+class RecipeImageSerializer(CleanImageMixin, serializers.ModelSerializer):
     """image serializer"""
+    image = CleanImageField(required=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'image_variants']
         read_only_fields = ['id']
-        extra_kwargs = {'image': {'required': 'True'}}
+
+    def update(self, instance, validated_data):
+        """replace the image, see core.storage.lock_image"""
+        with transaction.atomic():
+            return super().update(instance, validated_data)
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    """Create, update and delete many recipes in one transaction
+
+    Each operation is {"op": "create", "data": {...}},
+    {"op": "update", "id": 1, "data": {...}} or {"op": "delete", "id": 1}.
+    Items are validated with the RecipeDetailSerializer rules, errors are
+    reported per item and nothing is applied unless every item is valid.
+    """
+    OPERATIONS = ('create', 'update', 'delete')
+
+    operations = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.API_MAX_BATCH_SIZE,
+    )
+
+    def _validate_item(self, item, recipes, seen_ids):
+        """return (op, recipe, validated data) or raise for one item"""
+        op = item.get('op')
+        if op not in self.OPERATIONS:
+            raise serializers.ValidationError(
+                {'op': [_('Must be create, update or delete.')]}
+            )
+        if op == 'create':
+            detail = RecipeDetailSerializer(
+                data=item.get('data', {}), context=self.context
+            )
+            detail.is_valid(raise_exception=True)
+            return op, None, detail.validated_data
+
+        recipe = recipes.get(item.get('id'))
+        if recipe is None:
+            raise serializers.ValidationError({'id': [_('Not found.')]})
+        if recipe.id in seen_ids:
+            raise serializers.ValidationError(
+                {'id': [_('Recipe is used by more than one operation.')]}
+            )
+        seen_ids.add(recipe.id)
+        if op == 'delete':
+            return op, recipe, None
+
+        detail = RecipeDetailSerializer(
+            recipe, data=item.get('data', {}),
+            partial=True, context=self.context,
+        )
+        detail.is_valid(raise_exception=True)
+        return op, recipe, detail.validated_data
+
+    def validate_operations(self, operations):
+        """validate every item, errors are listed by item index"""
+        ids = [
+            item.get('id') for item in operations
+            if isinstance(item.get('id'), int)
+        ]
+        recipes = Recipe.objects.filter(
+            user=self.context['request'].user,
+            id__in=ids,
+        ).in_bulk()
+
+        validated, errors, seen_ids = [], [], set()
+        for item in operations:
+            try:
+                validated.append(self._validate_item(item, recipes, seen_ids))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                errors.append(exc.detail)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated
+
+    def create(self, validated_data):
+        """apply all operations with bulk queries"""
+        user = validated_data['user']
+        operations = validated_data['operations']
+        attr_names = {'tags': {}, 'ingredients': {}}
+        replace_ids = {'tags': [], 'ingredients': []}
+
+        def collect_attrs(recipe, data, replace):
+            for field_name in attr_names:
+                items = data.pop(field_name, None)
+                if items is None:
+                    continue
+                attr_names[field_name][recipe.id] = [
+                    item['name'] for item in items
+                ]
+                if replace:
+                    replace_ids[field_name].append(recipe.id)
+
+        with transaction.atomic():
+            # bulk queries skip FileField.pre_save and the image signals,
+            # so operations that set an image are saved one by one
+            created, bulk_created = [], []
+            for op, recipe, data in operations:
+                if op == 'create':
+                    fields = {
+                        k: v for k, v in data.items()
+                        if k not in attr_names
+                    }
+                    recipe = Recipe(user=user, **fields)
+                    created.append(recipe)
+                    if 'image' in fields:
+                        recipe.save()
+                    else:
+                        bulk_created.append(recipe)
+            Recipe.objects.bulk_create(bulk_created)
+            created_iter = iter(created)
+
+            results, updated, update_fields = [], [], {'updated_at'}
+            delete_ids = []
+            now = timezone.now()
+            for index, (op, recipe, data) in enumerate(operations):
+                if op == 'create':
+                    recipe = next(created_iter)
+                    collect_attrs(recipe, data, replace=False)
+                    status = 201
+                elif op == 'update':
+                    collect_attrs(recipe, data, replace=True)
+                    for attr, value in data.items():
+                        setattr(recipe, attr, value)
+                    recipe.updated_at = now
+                    if 'image' in data:
+                        recipe.save(update_fields=['updated_at', *data])
+                    else:
+                        update_fields.update(data)
+                        updated.append(recipe)
+                    status = 200
+                else:
+                    delete_ids.append(recipe.id)
+                    status = 204
+                results.append({
+                    'index': index,
+                    'op': op,
+                    'id': recipe.id,
+                    'status': status,
+                })
+
+            if updated:
+                Recipe.objects.bulk_update(updated, sorted(update_fields))
+            if delete_ids:
+                Recipe.objects.filter(id__in=delete_ids).delete()
+            for field_name, names_by_recipe in attr_names.items():
+                if names_by_recipe:
+                    link_recipe_attrs(
+                        field_name,
+                        user.id,
+                        names_by_recipe,
+                        replace_ids[field_name],
+                    )
+            invalidate_user(user.id)
+
+        return results
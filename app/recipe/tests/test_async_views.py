@@ -0,0 +1,140 @@
+"""
+Tests for the async recipe read views
+"""
+import asyncio
+import tempfile
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.metrics import MetricsMiddleware
+from core.models import Recipe, Tag, Ingredient
+from core.profiling import ProfilingMiddleware, list_profiles
+from core.timing import ServerTimingMiddleware
+
+ASYNC_RECIPE_URL = reverse('recipe:async-recipe-list')
+ASYNC_TAG_URL = reverse('recipe:async-tag-list')
+ASYNC_INGREDIENT_URL = reverse('recipe:async-ingredient-list')
+RECIPE_URL = reverse('recipe:recipe-list')
+
+
+def async_detail_url(recipe_id):
+    """async detail page url"""
+    return reverse('recipe:async-recipe-detail', args=[recipe_id])
+
+
+def create_recipe(user, **params):
+    """create recipe data"""
+    defaults = {
+        'title': 'Async recipe',
+        'time_minutes': 5,
+        'price': Decimal('5.55'),
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class AsyncReadViewTests(TransactionTestCase):
+    """async views serve the same data as the sync views
+
+    The views query from worker threads with their own connections, so
+    the data has to be committed.
+    """
+    # reads go to the replicas when DB_REPLICA_HOSTS is set
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'async@example.com',
+            'pass@123',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def test_authentication_required(self):
+        """the async views keep the viewset permissions"""
+        res = APIClient().get(ASYNC_RECIPE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_recipe_list_matches_sync_view(self):
+        """async list returns the sync list data"""
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Lunch'))
+        res = self.client.get(ASYNC_RECIPE_URL)
+        cache.clear()
+        sync_res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()['results'], sync_res.json()['results'])
+
+    def test_recipe_detail(self):
+        """async detail returns the recipe"""
+        recipe = create_recipe(user=self.user)
+        res = self.client.get(async_detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()['id'], recipe.id)
+
+    def test_recipe_detail_other_user(self):
+        """recipes of other users are not found"""
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'pass@123',
+        )
+        recipe = create_recipe(user=other)
+        res = self.client.get(async_detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tag_and_ingredient_lists(self):
+        """async tag and ingredient lists"""
+        Tag.objects.create(user=self.user, name='Lunch')
+        Ingredient.objects.create(user=self.user, name='Salt')
+        tags = self.client.get(ASYNC_TAG_URL)
+        ingredients = self.client.get(ASYNC_INGREDIENT_URL)
+
+        self.assertEqual(tags.json()['results'][0]['name'], 'Lunch')
+        self.assertEqual(ingredients.json()['results'][0]['name'], 'Salt')
+
+    def test_observability_middleware_stays_async(self):
+        """metrics, timing and profiling do not force the ASGI chain into
+        the thread of the sync code"""
+        async def view(request):
+            return HttpResponse()
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        create_recipe(user=self.user)
+        with override_settings(
+            METRICS=True, METRICS_DIR=directory.name,
+            SERVER_TIMING=True,
+            PROFILING=True, PROFILE_SAMPLE_RATE=1, PROFILE_DIR=directory.name,
+        ), self.assertLogs('core.timing', 'INFO'):
+            for middleware_class in (
+                MetricsMiddleware, ServerTimingMiddleware, ProfilingMiddleware,
+            ):
+                self.assertTrue(middleware_class.async_capable)
+                self.assertTrue(
+                    asyncio.iscoroutinefunction(middleware_class(view))
+                )
+            res = async_to_sync(AsyncClient().get)(
+                ASYNC_RECIPE_URL, AUTHORIZATION=f'Token {self.token.key}'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.json()['results']), 1)
+        self.assertIn('db;dur=', res['Server-Timing'])
+        self.assertEqual(len(list_profiles(directory.name)), 1)
@@ -0,0 +1,136 @@
+"""
+Tests for ETag and Last-Modified on recipe apis
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+
+RECIPE_URL = reverse('recipe:recipe-list')
+TAG_URL = reverse('recipe:tag-list')
+INGREDIENT_URL = reverse('recipe:ingredient-list')
+
+
+def detail_url(recipe_id):
+    """detail page url"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def create_recipe(user, **params):
+    """create recipe data"""
+    defaults = {
+        'title': 'Conditional recipe',
+        'time_minutes': 5,
+        'price': Decimal('5.55'),
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class ConditionalGetTests(TestCase):
+    """conditional GET on recipe, tag and ingredient reads"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'etag@example.com',
+            'pass@123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_lists_return_304_for_matching_etag(self):
+        """a matching If-None-Match is answered with 304"""
+        for url in (RECIPE_URL, TAG_URL, INGREDIENT_URL):
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertIn('ETag', res)
+
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+            self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(res.content, b'')
+
+    def test_list_304_runs_no_queries(self):
+        """the list etag does not touch the database"""
+        create_recipe(user=self.user)
+        etag = self.client.get(RECIPE_URL)['ETag']
+
+        with self.assertNumQueries(0):
+            res = self.client.get(RECIPE_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_changes_after_write(self):
+        """writes give a new etag"""
+        recipe = create_recipe(user=self.user)
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+
+        recipe.title = 'Renamed'
+        recipe.save()
+        res = self.client.get(detail_url(recipe.id), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertEqual(res.data['title'], 'Renamed')
+
+    def test_etag_depends_on_query(self):
+        """filtered lists have their own etag"""
+        etag = self.client.get(RECIPE_URL)['ETag']
+        res = self.client.get(RECIPE_URL, {'page_size': 1})
+
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_etag_is_per_user(self):
+        """another user never gets a 304 for a foreign etag"""
+        etag = self.client.get(RECIPE_URL)['ETag']
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'pass@123',
+        )
+        self.client.force_authenticate(other)
+        res = self.client.get(RECIPE_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_detail_last_modified(self):
+        """detail sends Last-Modified and honours If-Modified-Since"""
+        recipe = create_recipe(user=self.user)
+        res = self.client.get(detail_url(recipe.id))
+        recipe.refresh_from_db()
+
+        self.assertEqual(
+            res['Last-Modified'],
+            http_date(recipe.updated_at.timestamp()),
+        )
+        res = self.client.get(
+            detail_url(recipe.id),
+            HTTP_IF_MODIFIED_SINCE=res['Last-Modified'],
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_tag_rename_touches_recipes(self):
+        """renaming a tag moves the recipe modification time"""
+        recipe = create_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='Lunch')
+        recipe.tags.add(tag)
+        recipe.refresh_from_db()
+        before = recipe.updated_at
+
+        tag.name = 'Dinner'
+        tag.save()
+        recipe.refresh_from_db()
+
+        self.assertGreater(recipe.updated_at, before)
+
+    def test_missing_recipe_has_no_etag(self):
+        """404 responses carry no validators"""
+        res = self.client.get(detail_url(0))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('ETag', res)
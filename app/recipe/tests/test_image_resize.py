@@ -0,0 +1,222 @@
+"""
+Tests for the on demand recipe image resize api
+"""
+import io
+import os
+import tempfile
+import threading
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.resize_cache import resize_cache
+
+
+def resize_url(recipe_id, **params):
+    """resized image url"""
+    url = reverse('recipe:recipe-resized-image', args=[recipe_id])
+    query = '&'.join(f'{key}={value}' for key, value in params.items())
+    return f'{url}?{query}'
+
+
+def image_upload(size=(800, 600), color='red'):
+    """png upload of a plain image"""
+    image_file = tempfile.SpooledTemporaryFile()
+    Image.new('RGB', size, color).save(image_file, format='PNG')
+    image_file.seek(0)
+    return SimpleUploadedFile('photo.png', image_file.read())
+
+
+class ImageResizeApiTests(TestCase):
+    """resize recipe images to whitelisted widths"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        resize_cache.stats.reset()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'resize@example.com',
+            'pass@123',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Photo', time_minutes=5, price=5,
+        )
+        self.recipe.image.save('photo.png', image_upload())
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def test_resize_and_cache(self):
+        """the first request renders, the next one reads from disk"""
+        url = resize_url(self.recipe.id, width=320, type='jpeg')
+        res = self.client.get(url, HTTP_ACCEPT='image/webp,image/*')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertIn('max-age=86400', res['Cache-Control'])
+        image = Image.open(io.BytesIO(_read(res)))
+        self.assertEqual(image.size, (320, 240))
+
+        res = self.client.get(url)
+        self.assertEqual(res['X-Cache'], 'HIT')
+        _read(res)
+        self.assertEqual(
+            resize_cache.stats.snapshot(),
+            {'hits': 1, 'misses': 1, 'evictions': 0, 'collapsed': 0},
+        )
+
+    def test_etag_not_modified(self):
+        """a matching ETag answers 304 without rendering"""
+        url = resize_url(self.recipe.id, width=160)
+        res = self.client.get(url)
+        _read(res)
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resize_cache.stats.snapshot()['hits'], 0)
+
+    def test_versioned_url_immutable(self):
+        """a url naming the source content is cached for good"""
+        version = resize_cache.key(self.recipe.image.name)
+        res = self.client.get(resize_url(self.recipe.id, width=160, v=version))
+        _read(res)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('max-age=31536000', res['Cache-Control'])
+        self.assertIn('immutable', res['Cache-Control'])
+
+    def test_stale_version_not_found(self):
+        """a url naming a replaced image is not served"""
+        res = self.client.get(resize_url(self.recipe.id, width=160, v='old'))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_evicted_before_open_rendered_again(self):
+        """a render deleted before it is opened is rendered again"""
+        get = resize_cache.get
+        calls = []
+
+        def evicting_get(*args):
+            path, hit = get(*args)
+            if not calls:
+                calls.append(path)
+                os.remove(path)
+            return path, hit
+
+        with patch.object(resize_cache, 'get', side_effect=evicting_get):
+            res = self.client.get(resize_url(self.recipe.id, width=160))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(_read(res))
+        self.assertEqual(resize_cache.stats.snapshot()['misses'], 2)
+
+    def test_invalid_params(self):
+        """widths and formats outside the whitelist are rejected"""
+        res = self.client.get(
+            resize_url(self.recipe.id, width=333, type='gif')
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('width', res.data)
+        self.assertIn('type', res.data)
+
+    def test_other_user_recipe_not_found(self):
+        """images of other users are not served"""
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'pass@123',
+        )
+        self.client.force_authenticate(other)
+
+        res = self.client.get(resize_url(self.recipe.id, width=160))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_lru_eviction_by_size(self):
+        """the least recently used render goes when over the limit"""
+        paths = {}
+        for width in (320, 480):
+            _read(self.client.get(resize_url(self.recipe.id, width=width)))
+            paths[width] = resize_cache.path(
+                self.recipe.image.name, width, 'webp'
+            )
+        # use 320 again so 480 is the oldest
+        _read(self.client.get(resize_url(self.recipe.id, width=320)))
+        limit = resize_cache.size
+
+        with override_settings(RESIZE_CACHE_MAX_BYTES=limit):
+            _read(self.client.get(resize_url(self.recipe.id, width=160)))
+
+        self.assertTrue(os.path.exists(paths[320]))
+        self.assertFalse(os.path.exists(paths[480]))
+        self.assertEqual(resize_cache.stats.snapshot()['evictions'], 1)
+        self.assertLessEqual(resize_cache.size, limit)
+
+    def test_bound_counts_other_processes(self):
+        """renders written by other processes count against the limit"""
+        _read(self.client.get(resize_url(self.recipe.id, width=320)))
+        other = os.path.join(resize_cache.root, 'other', '320.webp')
+        os.makedirs(os.path.dirname(other))
+        with open(other, 'wb') as other_file:
+            other_file.write(b'x' * 10000)
+        limit = resize_cache.size + 10000
+
+        with override_settings(RESIZE_CACHE_MAX_BYTES=limit):
+            _read(self.client.get(resize_url(self.recipe.id, width=160)))
+
+        self.assertLessEqual(resize_cache.size, limit)
+        self.assertEqual(resize_cache.stats.snapshot()['evictions'], 1)
+
+    def test_concurrent_requests_render_once(self):
+        """requests for the same render wait for the first one"""
+        started = threading.Event()
+        release = threading.Event()
+        render = resize_cache._render
+        calls = []
+
+        def slow_render(*args):
+            calls.append(args)
+            started.set()
+            release.wait(5)
+            return render(*args)
+
+        image = self.recipe.image
+        results = []
+        with patch.object(resize_cache, '_render', side_effect=slow_render):
+            threads = [
+                threading.Thread(target=lambda: results.append(
+                    resize_cache.get(image.name, image.storage, 640, 'webp')
+                ))
+                for _ in range(3)
+            ]
+            threads[0].start()
+            started.wait(5)
+            for thread in threads[1:]:
+                thread.start()
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(hit for _, hit in results),
+                         [False, True, True])
+        stats = resize_cache.stats.snapshot()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+
+def _read(response):
+    """consume a file response, the test client closes it at the end"""
+    return b''.join(response.streaming_content)
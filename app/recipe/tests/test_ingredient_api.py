@@ -4,13 +4,16 @@ test ingredient test api
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import TestCase
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
 from decimal import Decimal
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import Ingredient, Recipe
-from recipe.serializers import IngredientSerializer
+from recipe.serializers import IngredientCountSerializer
 
 INGRIDIENT_URL = reverse('recipe:ingredient-list')
 
@@ -45,11 +48,13 @@ class PrivateIngridientTest(TestCase):
         Ingredient.objects.create(user=self.user, name="Onion")
         res = self.client.get(INGRIDIENT_URL)
 
-        ingr = Ingredient.objects.all().order_by('-name')
-        serializer = IngredientSerializer(ingr, many=True)
+        ingr = Ingredient.objects.annotate(
+            recipe_count=Count('recipe')
+        ).order_by('-name')
+        serializer = IngredientCountSerializer(ingr, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_get_ingridient_for_correct_user(self):
         """get for correct mapped user"""
@@ -59,9 +64,9 @@ class PrivateIngridientTest(TestCase):
         res = self.client.get(INGRIDIENT_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], ingridient.name)
-        self.assertEqual(res.data[0]['id'], ingridient.id)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], ingridient.name)
+        self.assertEqual(res.data['results'][0]['id'], ingridient.id)
 
     def test_ingredient_upate(self):
         """upate ingredient data"""
@@ -93,10 +98,9 @@ class PrivateIngridientTest(TestCase):
         r1.ingredients.add(ng1)
         res = self.client.get(INGRIDIENT_URL, {'assigned_only': 1})
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        s1 = IngredientSerializer(ng1)
-        s2 = IngredientSerializer(ng2)
-        self.assertIn(s1.data, res.data)
-        self.assertNotIn(s2.data, res.data)
+        ids = [i['id'] for i in res.data['results']]
+        self.assertIn(ng1.id, ids)
+        self.assertNotIn(ng2.id, ids)
 
     def test_filter_unique(self):
         """test filter unique ingredient"""
@@ -123,4 +127,141 @@ class PrivateIngridientTest(TestCase):
         res = self.client.get(INGRIDIENT_URL, {'assigned_only': 1})
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
\ No newline at end of file
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_list_recipe_count(self):
+        """each ingredient carries the number of recipes using it"""
+        eggs = Ingredient.objects.create(user=self.user, name='Eggs')
+        milk = Ingredient.objects.create(user=self.user, name='Milk')
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self._create_recipe(eggs, milk)
+        self._create_recipe(eggs)
+
+        res = self.client.get(INGRIDIENT_URL)
+
+        counts = {i['id']: i['recipe_count'] for i in res.data['results']}
+        self.assertEqual(counts, {eggs.id: 2, milk.id: 1, salt.id: 0})
+
+    def test_assigned_only_uses_exists(self):
+        """assigned_only is a semi join, no join on recipes and no DISTINCT"""
+        eggs = Ingredient.objects.create(user=self.user, name='Eggs')
+        self._create_recipe(eggs)
+        self._create_recipe(eggs)
+
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(INGRIDIENT_URL, {'assigned_only': 1})
+
+        self.assertEqual(len(res.data['results']), 1)
+        sql = [q['sql'] for q in ctx.captured_queries
+               if 'FROM "core_ingredient"' in q['sql']]
+        self.assertTrue(sql)
+        for query in sql:
+            self.assertIn('EXISTS', query)
+            self.assertNotIn('DISTINCT', query)
+
+    def test_order_by_recipe_count(self):
+        """ordering=-recipe_count pages by usage with stable ties"""
+        ingredients = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('A', 'B', 'C', 'D')
+        ]
+        self._create_recipe(*ingredients[1:])
+        self._create_recipe(ingredients[2])
+
+        res = self.client.get(
+            INGRIDIENT_URL, {'ordering': '-recipe_count', 'page_size': 2}
+        )
+        names = [i['name'] for i in res.data['results']]
+        res = self.client.get(res.data['next'])
+        names += [i['name'] for i in res.data['results']]
+
+        self.assertEqual(names, ['C', 'D', 'B', 'A'])
+        self.assertIsNone(res.data['next'])
+
+    def test_unknown_ordering_is_ignored(self):
+        """ordering on other fields falls back to the default"""
+        Ingredient.objects.create(user=self.user, name='A')
+        Ingredient.objects.create(user=self.user, name='B')
+
+        res = self.client.get(INGRIDIENT_URL, {'ordering': 'user'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [i['name'] for i in res.data['results']], ['B', 'A']
+        )
+
+    def test_list_ordering_ignored_on_detail(self):
+        """detail actions ignore orderings only the list annotates"""
+        ingredient = Ingredient.objects.create(user=self.user, name='A')
+        url = f'{detail_uri(ingredient.id)}?ordering=recipe_count'
+
+        res = self.client.patch(url, {'name': 'B'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.client.delete(url)
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+    def _create_recipe(self, *ingredients):
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title='Autocomplete',
+            price=Decimal('5.00'),
+            time_minutes=10
+        )
+        recipe.ingredients.add(*ingredients)
+
+    def test_autocomplete_prefix_before_fuzzy(self):
+        """prefix matches first, then typo tolerant matches"""
+        fuzzy = Ingredient.objects.create(user=self.user, name='Tomatoe sauce')
+        prefix = Ingredient.objects.create(user=self.user, name='Tomato')
+        Ingredient.objects.create(user=self.user, name='Potato')
+        Ingredient.objects.create(user=create_user('o@example.com'),
+                                  name='Tomato')
+
+        res = self.client.get(INGRIDIENT_URL, {'q': 'tomato'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([i['id'] for i in res.data], [prefix.id, fuzzy.id])
+
+        res = self.client.get(INGRIDIENT_URL, {'q': 'tomatp'})
+        self.assertEqual(res.data[0]['id'], prefix.id)
+
+    def test_autocomplete_ranks_usage(self):
+        """equal matches are ordered by the recipes using them"""
+        chili = Ingredient.objects.create(user=self.user, name='Chili')
+        chicken = Ingredient.objects.create(user=self.user, name='Chicken')
+        self._create_recipe(chicken)
+        self._create_recipe(chicken, chili)
+        self._create_recipe(chicken)
+
+        res = self.client.get(INGRIDIENT_URL, {'q': 'chi'})
+
+        self.assertEqual([i['id'] for i in res.data], [chicken.id, chili.id])
+
+    def test_autocomplete_short_prefix_and_limit(self):
+        """one letter matches by prefix, limit bounds the results"""
+        for name in ('Salt', 'Sage', 'Sugar', 'Basil'):
+            Ingredient.objects.create(user=self.user, name=name)
+
+        res = self.client.get(INGRIDIENT_URL, {'q': 's', 'limit': 2})
+
+        self.assertEqual([i['name'] for i in res.data], ['Sage', 'Salt'])
+
+    def test_autocomplete_assigned_only(self):
+        """autocomplete combines with assigned_only"""
+        used = Ingredient.objects.create(user=self.user, name='Butter')
+        Ingredient.objects.create(user=self.user, name='Buttermilk')
+        self._create_recipe(used)
+        self._create_recipe(used)
+
+        res = self.client.get(
+            INGRIDIENT_URL, {'q': 'butt', 'assigned_only': 1}
+        )
+
+        self.assertEqual([i['id'] for i in res.data], [used.id])
+
+    def test_autocomplete_invalid_limit(self):
+        """limit must be a positive integer"""
+        res = self.client.get(INGRIDIENT_URL, {'q': 'salt', 'limit': 0})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,180 @@
+"""
+Query budget tests for the recipe apis
+"""
+import tempfile
+from decimal import Decimal
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+
+RECIPE_URL = reverse('recipe:recipe-list')
+
+# maximum number of queries each endpoint may run, whatever the row count
+QUERY_BUDGETS = {
+    'recipe-list': 3,
+    'recipe-detail': 4,
+    # the recipe, its update, the image lock and the transaction around them
+    'recipe-upload-image': 5,
+    'recipe-create': 13,
+    'recipe-update': 18,
+    'recipe-batch': 18,
+}
+
+
+def detail_url(recipe_id):
+    """detail page url"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def image_upload_url(recipe_id):
+    """upload image url"""
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+def create_recipes(user, count, tags_per_recipe=3, ingredients_per_recipe=3):
+    """create recipes with tags and ingredients attached"""
+    recipes = []
+    for i in range(count):
+        recipe = Recipe.objects.create(
+            user=user,
+            title=f'Recipe {i}',
+            time_minutes=10,
+            price=Decimal('5.50'),
+        )
+        for j in range(tags_per_recipe):
+            recipe.tags.add(
+                Tag.objects.create(user=user, name=f'Tag {recipe.id}-{j}')
+            )
+        for j in range(ingredients_per_recipe):
+            recipe.ingredients.add(Ingredient.objects.create(
+                user=user,
+                name=f'Ingr {recipe.id}-{j}',
+            ))
+        recipes.append(recipe)
+    return recipes
+
+
+class QueryBudgetMixin:
+    """assert helpers for per endpoint query budgets"""
+
+    def assertQueryBudget(self, endpoint, func, *args, **kwargs):
+        """run func and fail when it goes over the endpoint budget"""
+        budget = QUERY_BUDGETS[endpoint]
+        with CaptureQueriesContext(connection) as ctx:
+            res = func(*args, **kwargs)
+        queries = '\n'.join(q['sql'] for q in ctx.captured_queries)
+        self.assertLessEqual(
+            len(ctx.captured_queries),
+            budget,
+            f'{endpoint} ran {len(ctx.captured_queries)} queries, '
+            f'budget is {budget}:\n{queries}'
+        )
+        return res, len(ctx.captured_queries)
+
+
+class RecipeQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """recipe endpoints run a fixed number of queries"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'budget@example.com',
+            'pass@123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        """list runs the same queries for 1 or many recipes"""
+        create_recipes(self.user, 1)
+        res, few = self.assertQueryBudget(
+            'recipe-list', self.client.get, RECIPE_URL
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        create_recipes(self.user, 20)
+        res, many = self.assertQueryBudget(
+            'recipe-list', self.client.get, RECIPE_URL
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 21)
+        self.assertEqual(few, many)
+
+    def test_detail_queries(self):
+        """detail loads tags and ingredients with prefetch"""
+        recipe = create_recipes(self.user, 1, 10, 10)[0]
+        res, _ = self.assertQueryBudget(
+            'recipe-detail', self.client.get, detail_url(recipe.id)
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['tags']), 10)
+        self.assertEqual(len(res.data['ingredients']), 10)
+
+    def test_upload_image_queries(self):
+        """upload image does not load tags and ingredients"""
+        recipe = create_recipes(self.user, 1)[0]
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            Image.new('RGB', (10, 10)).save(image_file, format='JPEG')
+            image_file.seek(0)
+            res, _ = self.assertQueryBudget(
+                'recipe-upload-image',
+                self.client.post,
+                image_upload_url(recipe.id),
+                {'image': image_file},
+                format='multipart',
+            )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        recipe.image.delete()
+
+    def test_create_queries_do_not_grow_with_attrs(self):
+        """create resolves tags and ingredients in bulk"""
+        def payload(count):
+            return {
+                'title': 'Bulk recipe',
+                'time_minutes': 10,
+                'price': Decimal('5.50'),
+                'tags': [{'name': f'Tag {i}'} for i in range(count)],
+                'ingredients': [
+                    {'name': f'Ingr {i}'} for i in range(count)
+                ],
+            }
+
+        res, few = self.assertQueryBudget(
+            'recipe-create',
+            self.client.post, RECIPE_URL, payload(1), format='json',
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        res, many = self.assertQueryBudget(
+            'recipe-create',
+            self.client.post, RECIPE_URL, payload(20), format='json',
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(recipe.tags.count(), 20)
+        self.assertEqual(recipe.ingredients.count(), 20)
+        self.assertEqual(few, many)
+
+    def test_update_queries_do_not_grow_with_attrs(self):
+        """update replaces tags and ingredients in bulk"""
+        recipe = create_recipes(self.user, 1, 5, 5)[0]
+        payload = {
+            'tags': [{'name': f'New tag {i}'} for i in range(20)],
+            'ingredients': [{'name': f'New ingr {i}'} for i in range(20)],
+        }
+        res, _ = self.assertQueryBudget(
+            'recipe-update',
+            self.client.patch, detail_url(recipe.id), payload, format='json',
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['tags']), 20)
+        self.assertEqual(recipe.tags.count(), 20)
+        self.assertEqual(recipe.ingredients.count(), 20)
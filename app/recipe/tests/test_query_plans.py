@@ -0,0 +1,90 @@
+"""
+Query plan tests for recipe filters
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+
+RECIPE_URL = reverse('recipe:recipe-list')
+
+
+class RecipeFilterPlanTests(TestCase):
+    """tag and ingredient filters plan as semi-joins"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'plans@example.com',
+            'pass@123',
+        )
+        self.client.force_authenticate(self.user)
+        self.tags = [
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+            for i in range(3)
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(user=self.user, name=f'Ingr {i}')
+            for i in range(3)
+        ]
+        for i in range(10):
+            recipe = Recipe.objects.create(
+                user=self.user,
+                title=f'Recipe {i}',
+                time_minutes=10,
+                price=Decimal('5.50'),
+            )
+            recipe.tags.add(*self.tags)
+            recipe.ingredients.add(*self.ingredients)
+
+    def _recipe_query_plan(self, params):
+        """run the list request and explain its recipe query"""
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(RECIPE_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        sql = next(
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].startswith('SELECT "core_recipe"."id"')
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}')
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        return res, sql, plan
+
+    def assertNoDeduplication(self, sql, plan):
+        """the recipe query neither asks for nor plans a DISTINCT"""
+        self.assertNotIn('DISTINCT', sql)
+        for node in ('Unique', 'HashAggregate', 'GroupAggregate'):
+            self.assertNotIn(node, plan)
+
+    def test_filter_any_plans_without_distinct(self):
+        """match any is built as EXISTS subqueries"""
+        params = {
+            'tags': ','.join(str(t.id) for t in self.tags),
+            'ingredients': ','.join(str(i.id) for i in self.ingredients),
+        }
+        res, sql, plan = self._recipe_query_plan(params)
+
+        self.assertIn('EXISTS', sql)
+        self.assertNoDeduplication(sql, plan)
+        self.assertEqual(len(res.data['results']), 10)
+
+    def test_filter_all_plans_without_distinct(self):
+        """match all is built as EXISTS subqueries"""
+        params = {
+            'tags': ','.join(str(t.id) for t in self.tags),
+            'ingredients': str(self.ingredients[0].id),
+            'match': 'all',
+        }
+        res, sql, plan = self._recipe_query_plan(params)
+
+        self.assertIn('EXISTS', sql)
+        self.assertNoDeduplication(sql, plan)
+        self.assertEqual(len(res.data['results']), 10)
@@ -2,16 +2,21 @@
 
 import tempfile
 import os
+from concurrent.futures import wait
+from unittest.mock import patch
 from PIL import Image
 
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from core.images import schedule_variants
 from core.models import Recipe, Tag, Ingredient
 from rest_framework import status
 from rest_framework.test import APIClient
 from django.urls import reverse
 from decimal import Decimal
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.pagination import RecipeCursorPagination
 
 RECIPE_URL = reverse('recipe:recipe-list')
 
@@ -65,7 +70,7 @@ class PrivateRecipeTests(TestCase):
         res = self.client.get(RECIPE_URL)
         recipe = Recipe.objects.all().order_by('-id')
         serializer = RecipeSerializer(recipe, many=True)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
     def test_recipe_list_limited_user(self):
@@ -79,8 +84,39 @@ class PrivateRecipeTests(TestCase):
         res = self.client.get(RECIPE_URL)
         recipe = Recipe.objects.filter(user=self.user)
         serializer = RecipeSerializer(recipe, many=True)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_recipe_list_cursor_pagination(self):
+        """list pages through recipes with opaque cursors"""
+        recipes = [
+            create_recipe(user=self.user, title=f'Recipe {i}')
+            for i in range(5)
+        ]
+        res = self.client.get(RECIPE_URL, {'page_size': 2})
+
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', res.data)
+        self.assertIsNone(res.data['previous'])
+        ids = [r['id'] for r in res.data['results']]
+        self.assertEqual(ids, [recipes[4].id, recipes[3].id])
+
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            ids += [r['id'] for r in res.data['results']]
+        self.assertEqual(ids, [r.id for r in reversed(recipes)])
+        self.assertIsNotNone(res.data['previous'])
+
+    @patch.object(RecipeCursorPagination, 'max_page_size', 2)
+    def test_recipe_list_max_page_size(self):
+        """page size is capped on the server"""
+        for i in range(3):
+            create_recipe(user=self.user, title=f'Recipe {i}')
+        res = self.client.get(RECIPE_URL, {'page_size': 1000})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertIsNotNone(res.data['next'])
 
     def test_recipe_detail(self):
         """detail serializer"""
@@ -220,6 +256,23 @@ class PrivateRecipeTests(TestCase):
             ).exists()
             self.assertTrue(exist)
 
+    def test_create_recipe_with_repeated_tag_names(self):
+        """repeated tag names resolve to a single tag"""
+        payload = {
+            'title': 'Recipe 3',
+            'time_minutes': 30,
+            'price': Decimal('12.32'),
+            'tags': [{'name': 'Indian'}, {'name': 'Indian'}],
+        }
+        res = self.client.post(RECIPE_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(recipe.tags.count(), 1)
+        self.assertEqual(
+            Tag.objects.filter(user=self.user, name='Indian').count(),
+            1,
+        )
+
     def test_tage_update(self):
         """update recipe tags"""
         recipe = create_recipe(user=self.user)
@@ -363,9 +416,9 @@ class PrivateRecipeTests(TestCase):
         s1 = RecipeSerializer(r1)
         s2 = RecipeSerializer(r2)
         s3 = RecipeSerializer(r3)
-        self.assertIn(s1.data, res.data)
-        self.assertIn(s2.data, res.data)
-        self.assertNotIn(s3.data, res.data)
+        self.assertIn(s1.data, res.data['results'])
+        self.assertIn(s2.data, res.data['results'])
+        self.assertNotIn(s3.data, res.data['results'])
 
     def test_filter_by_ingredients(self):
         """test filter by ingredients"""
@@ -384,9 +437,96 @@ class PrivateRecipeTests(TestCase):
         s2 = RecipeSerializer(r2)
         s3 = RecipeSerializer(r3)
 
-        self.assertIn(s1.data, res.data)
-        self.assertIn(s2.data, res.data)
-        self.assertNotIn(s3.data, res.data)
+        self.assertIn(s1.data, res.data['results'])
+        self.assertIn(s2.data, res.data['results'])
+        self.assertNotIn(s3.data, res.data['results'])
+
+    def test_filter_by_tags_match_all(self):
+        """match all returns recipes having every listed tag"""
+        r1 = create_recipe(user=self.user, title='Thai vegan curry')
+        r2 = create_recipe(user=self.user, title='Vegan salad')
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Thai')
+        r1.tags.add(tag1, tag2)
+        r2.tags.add(tag1)
+        params = {'tags': f'{tag1.id},{tag2.id}', 'match': 'all'}
+        res = self.client.get(RECIPE_URL, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ids = [r['id'] for r in res.data['results']]
+        self.assertEqual(ids, [r1.id])
+
+    def test_filter_returns_recipe_once(self):
+        """a recipe matching several ids is listed once"""
+        recipe = create_recipe(user=self.user)
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Thai')
+        recipe.tags.add(tag1, tag2)
+        res = self.client.get(RECIPE_URL, {'tags': f'{tag1.id},{tag2.id}'})
+
+        ids = [r['id'] for r in res.data['results']]
+        self.assertEqual(ids, [recipe.id])
+
+    def test_filter_invalid_match(self):
+        """match only accepts any or all"""
+        res = self.client.get(RECIPE_URL, {'tags': '1', 'match': 'some'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_ranks_title_over_description(self):
+        """title matches come before description matches"""
+        in_description = create_recipe(
+            user=self.user, title='Stew', description='Slow cooked curries'
+        )
+        in_title = create_recipe(user=self.user, title='Green curry')
+        create_recipe(user=self.user, title='Pancakes')
+        res = self.client.get(RECIPE_URL, {'search': 'curry'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        ids = [r['id'] for r in res.data['results']]
+        self.assertEqual(ids, [in_title.id, in_description.id])
+
+    def test_search_websearch_syntax(self):
+        """phrases and excluded words are supported"""
+        r1 = create_recipe(user=self.user, title='Thai green curry')
+        create_recipe(user=self.user, title='Green Thai curry')
+        create_recipe(user=self.user, title='Thai green curry with beef')
+        res = self.client.get(RECIPE_URL, {'search': '"thai green" -beef'})
+
+        ids = [r['id'] for r in res.data['results']]
+        self.assertEqual(ids, [r1.id])
+
+    def test_search_vector_updated_on_write(self):
+        """renamed recipes are found by their new title"""
+        recipe = create_recipe(user=self.user, title='Pancakes')
+        url = detail_url(recipe.id)
+        self.client.patch(url, {'title': 'Crepes'})
+
+        res = self.client.get(RECIPE_URL, {'search': 'crepes'})
+        self.assertEqual([r['id'] for r in res.data['results']], [recipe.id])
+        res = self.client.get(RECIPE_URL, {'search': 'pancakes'})
+        self.assertEqual(res.data['results'], [])
+
+    def test_search_with_filters_and_pages(self):
+        """search combines with tag filters and cursor pages"""
+        tag = Tag.objects.create(user=self.user, name='Dinner')
+        recipes = [
+            create_recipe(user=self.user, title=f'Curry {i}')
+            for i in range(3)
+        ]
+        for recipe in recipes:
+            recipe.tags.add(tag)
+        create_recipe(user=self.user, title='Curry without tag')
+        params = {'search': 'curry', 'tags': tag.id, 'page_size': 2}
+
+        res = self.client.get(RECIPE_URL, params)
+        ids = [r['id'] for r in res.data['results']]
+        res = self.client.get(res.data['next'])
+        ids += [r['id'] for r in res.data['results']]
+
+        self.assertIsNone(res.data['next'])
+        self.assertEqual(ids, [r.id for r in reversed(recipes)])
+
 
 class ImageUploadTestCase(TestCase):
     """image upload test cases """
@@ -417,6 +557,165 @@ class ImageUploadTestCase(TestCase):
         self.assertIn('image', res.data)
         self.assertTrue(os.path.exists(self.recipe.image.path))
 
+    def test_upload_image_generates_variants(self):
+        """variants are rendered after the upload and shown on detail"""
+        url = image_upload_url(self.recipe.id)
+
+        with tempfile.TemporaryDirectory() as media, \
+                override_settings(MEDIA_ROOT=media), \
+                tempfile.NamedTemporaryFile(suffix='.jpg') as filepath:
+            Image.new('RGB', (600, 400)).save(filepath, format='JPEG')
+            filepath.seek(0)
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(
+                    url, {'image': filepath}, format='multipart'
+                )
+            self.assertEqual(res.data['image_variants'], {})
+            self.recipe.refresh_from_db()
+            wait([schedule_variants(self.recipe.image.name)])
+
+            res = self.client.get(detail_url(self.recipe.id))
+
+            variants = res.data['image_variants']
+            self.assertEqual(
+                set(variants), set(settings.RECIPE_IMAGE_VARIANTS)
+            )
+            self.assertTrue(
+                variants['thumbnail']['webp'].startswith('http://testserver')
+            )
+            self.recipe.image.delete()
+
+    @patch('core.signals.schedule_variants')
+    def test_replace_image_releases_old_file(self, patched_schedule):
+        """uploading a new image deletes the unused old one"""
+        url = image_upload_url(self.recipe.id)
+        names = []
+        for color in ('red', 'blue'):
+            with tempfile.NamedTemporaryFile(suffix='.jpg') as filepath:
+                Image.new('RGB', (10, 10), color).save(filepath, 'JPEG')
+                filepath.seek(0)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.post(
+                        url, {'image': filepath}, format='multipart'
+                    )
+            self.recipe.refresh_from_db()
+            names.append(self.recipe.image.name)
+
+        storage = self.recipe.image.storage
+        self.assertFalse(storage.exists(names[0]))
+        self.assertTrue(storage.exists(names[1]))
+
+    @patch('core.signals.schedule_variants')
+    def test_detail_upload_strips_exif(self, patched_schedule):
+        """images sent to the detail endpoint are re-encoded too"""
+        exif = Image.Exif()
+        exif[0x010f] = 'SecretCam'
+        exif[0x0112] = 1
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as filepath:
+            Image.new('RGB', (10, 10)).save(
+                filepath, 'JPEG', exif=exif.tobytes()
+            )
+            filepath.seek(0)
+            res = self.client.patch(
+                detail_url(self.recipe.id),
+                {'image': filepath},
+                format='multipart',
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        with Image.open(self.recipe.image.path) as image:
+            self.assertEqual(dict(image.getexif()), {})
+
+    @patch('core.signals.schedule_variants')
+    def test_detail_upload_schedules_variants(self, patched_schedule):
+        """variants are rendered for images set through the detail too"""
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as filepath:
+            Image.new('RGB', (10, 10)).save(filepath, 'JPEG')
+            filepath.seek(0)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(
+                    detail_url(self.recipe.id),
+                    {'image': filepath},
+                    format='multipart',
+                )
+            # saving it again schedules nothing more
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(
+                    detail_url(self.recipe.id), {'title': 'Renamed'}
+                )
+
+        self.recipe.refresh_from_db()
+        patched_schedule.assert_called_once_with(
+            self.recipe.image.name, self.user.id
+        )
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=100)
+    def test_detail_upload_too_many_pixels(self):
+        """the pixel limit holds on create as well"""
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as filepath:
+            Image.new('RGB', (20, 10)).save(filepath, format='JPEG')
+            filepath.seek(0)
+            res = self.client.post(RECIPE_URL, {
+                'title': 'Big', 'time_minutes': 5, 'price': '1.00',
+                'image': filepath,
+            }, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', res.data)
+
+    @patch('core.signals.schedule_variants')
+    def test_detail_replace_releases_old_file(self, patched_schedule):
+        """an image replaced through the detail endpoint is released"""
+        names = []
+        for color in ('red', 'blue'):
+            with tempfile.NamedTemporaryFile(suffix='.jpg') as filepath:
+                Image.new('RGB', (10, 10), color).save(filepath, 'JPEG')
+                filepath.seek(0)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.patch(
+                        detail_url(self.recipe.id),
+                        {'image': filepath},
+                        format='multipart',
+                    )
+            self.recipe.refresh_from_db()
+            names.append(self.recipe.image.name)
+
+        storage = self.recipe.image.storage
+        self.assertFalse(storage.exists(names[0]))
+        self.assertTrue(storage.exists(names[1]))
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=1024)
+    def test_upload_too_large(self):
+        """uploads past the size limit are refused with 413"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as filepath:
+            Image.effect_noise((100, 100), 64).save(filepath, format='PNG')
+            filepath.seek(0)
+            res = self.client.post(
+                url, {'image': filepath}, format='multipart'
+            )
+
+        self.assertEqual(
+            res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=100)
+    def test_upload_too_many_pixels(self):
+        """images over the pixel limit are refused"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as filepath:
+            Image.new('RGB', (20, 10)).save(filepath, format='JPEG')
+            filepath.seek(0)
+            res = self.client.post(
+                url, {'image': filepath}, format='multipart'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', res.data)
+
     def test_bad_image_file(self):
         """bad image file"""
         url = image_upload_url(self.recipe.id)
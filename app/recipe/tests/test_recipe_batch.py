@@ -0,0 +1,212 @@
+"""
+Tests for the recipe batch api
+"""
+import io
+import tempfile
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.models import Recipe, Tag, Ingredient
+from recipe.serializers import RecipeBatchSerializer
+from recipe.tests.test_query_budget import QueryBudgetMixin
+
+BATCH_URL = reverse('recipe:recipe-batch')
+RECIPE_URL = reverse('recipe:recipe-list')
+
+
+def create_recipe(user, **params):
+    """create recipe data"""
+    defaults = {
+        'title': 'Batch recipe',
+        'time_minutes': 5,
+        'price': Decimal('5.55'),
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def create_op(title, **data):
+    """create operation payload"""
+    data.update({'title': title, 'time_minutes': 10, 'price': '4.50'})
+    return {'op': 'create', 'data': data}
+
+
+class RecipeBatchTests(QueryBudgetMixin, TestCase):
+    """batch create, update and delete"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'batch@example.com',
+            'pass@123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_mixed_operations(self):
+        """create, update and delete are applied with per item results"""
+        updated = create_recipe(user=self.user, title='Old title')
+        updated.tags.add(Tag.objects.create(user=self.user, name='Old'))
+        deleted = create_recipe(user=self.user)
+        payload = {'operations': [
+            create_op('New', tags=[{'name': 'Lunch'}]),
+            {
+                'op': 'update',
+                'id': updated.id,
+                'data': {'title': 'New title', 'tags': [{'name': 'Lunch'}]},
+            },
+            {'op': 'delete', 'id': deleted.id},
+        ]}
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        results = res.data['results']
+        self.assertEqual(
+            [(r['index'], r['op'], r['status']) for r in results],
+            [(0, 'create', 201), (1, 'update', 200), (2, 'delete', 204)],
+        )
+        created = Recipe.objects.get(id=results[0]['id'])
+        self.assertEqual(created.user, self.user)
+        self.assertEqual(created.price, Decimal('4.50'))
+        updated.refresh_from_db()
+        self.assertEqual(updated.title, 'New title')
+        self.assertEqual(
+            list(updated.tags.values_list('name', flat=True)), ['Lunch']
+        )
+        self.assertEqual(list(created.tags.all()), list(updated.tags.all()))
+        self.assertFalse(Recipe.objects.filter(id=deleted.id).exists())
+        self.assertEqual(Tag.objects.filter(name='Lunch').count(), 1)
+
+    def test_update_keeps_attrs_not_sent(self):
+        """an update without ingredients keeps them"""
+        recipe = create_recipe(user=self.user)
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        recipe.ingredients.add(ingredient)
+        payload = {'operations': [
+            {'op': 'update', 'id': recipe.id, 'data': {'title': 'Salty'}},
+        ]}
+        self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(list(recipe.ingredients.all()), [ingredient])
+
+    def test_invalid_item_applies_nothing(self):
+        """errors are reported per item and nothing is written"""
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'pass@123',
+        )
+        foreign = create_recipe(user=other)
+        payload = {'operations': [
+            create_op('Valid'),
+            {'op': 'create', 'data': {'title': 'No price'}},
+            {'op': 'delete', 'id': foreign.id},
+            {'op': 'rename'},
+        ]}
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = res.data['operations']
+        self.assertEqual(errors[0], {})
+        self.assertIn('price', errors[1])
+        self.assertIn('id', errors[2])
+        self.assertIn('op', errors[3])
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+        self.assertTrue(Recipe.objects.filter(id=foreign.id).exists())
+
+    def test_updated_image_stored(self):
+        """image updates are written to storage"""
+        recipe = create_recipe(user=self.user)
+        image_file = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(image_file, format='JPEG')
+        upload = SimpleUploadedFile('photo.jpg', image_file.getvalue())
+        request = APIRequestFactory().post(BATCH_URL)
+        request.user = self.user
+        serializer = RecipeBatchSerializer(
+            data={'operations': [
+                {'op': 'update', 'id': recipe.id, 'data': {'image': upload}},
+            ]},
+            context={'request': request},
+        )
+        serializer.is_valid(raise_exception=True)
+        with tempfile.TemporaryDirectory() as media, \
+                override_settings(MEDIA_ROOT=media):
+            serializer.save(user=self.user)
+            recipe.refresh_from_db()
+
+            self.assertTrue(recipe.image)
+            self.assertTrue(recipe.image.storage.exists(recipe.image.name))
+
+    def test_removed_image_released(self):
+        """image updates release the images they drop"""
+        recipe = create_recipe(user=self.user)
+        with tempfile.TemporaryDirectory() as media, \
+                override_settings(MEDIA_ROOT=media):
+            recipe.image.save('photo.jpg', ContentFile(b'photo'))
+            payload = {'operations': [
+                {'op': 'update', 'id': recipe.id, 'data': {'image': None}},
+            ]}
+
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(BATCH_URL, payload, format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertFalse(recipe.image.storage.exists(recipe.image.name))
+
+    def test_same_recipe_twice_rejected(self):
+        """a recipe can be used by one operation only"""
+        recipe = create_recipe(user=self.user)
+        payload = {'operations': [
+            {'op': 'update', 'id': recipe.id, 'data': {'title': 'A'}},
+            {'op': 'delete', 'id': recipe.id},
+        ]}
+        res = self.client.post(BATCH_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Recipe.objects.filter(id=recipe.id).exists())
+
+    def test_batch_invalidates_cached_list(self):
+        """bulk writes bump the user cache version"""
+        self.client.get(RECIPE_URL)
+        payload = {'operations': [create_op('Cached')]}
+        self.client.post(BATCH_URL, payload, format='json')
+        res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_queries_do_not_grow_with_batch_size(self):
+        """a batch runs a fixed number of queries"""
+        def payload(count):
+            recipes = [create_recipe(user=self.user) for _ in range(count)]
+            tags = [{'name': f'Tag {i}'} for i in range(count)]
+            return {'operations': [
+                create_op(f'New {i}', tags=tags, ingredients=tags)
+                for i in range(count)
+            ] + [
+                {'op': 'update', 'id': r.id, 'data': {'tags': tags}}
+                for r in recipes[::2]
+            ] + [
+                {'op': 'delete', 'id': r.id} for r in recipes[1::2]
+            ]}
+
+        res, few = self.assertQueryBudget(
+            'recipe-batch',
+            self.client.post, BATCH_URL, payload(2), format='json',
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res, many = self.assertQueryBudget(
+            'recipe-batch',
+            self.client.post, BATCH_URL, payload(20), format='json',
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 40)
+        self.assertEqual(few, many)
@@ -0,0 +1,206 @@
+"""
+Tests for the streaming recipe export api
+"""
+import csv
+import io
+import json
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.asgi import ASGIHandler
+from core.models import Recipe, Tag, Ingredient
+from recipe.export import COLUMNS
+
+EXPORT_URL = reverse('recipe:recipe-export')
+
+
+def create_recipe(user, **params):
+    """create recipe data"""
+    defaults = {
+        'title': 'Export recipe',
+        'time_minutes': 5,
+        'price': Decimal('5.55'),
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+def content(response):
+    """read a streaming response body"""
+    return b''.join(response.streaming_content).decode()
+
+
+def asgi_get(path, query, token):
+    """GET through the ASGI handler, return the status, headers and the
+    parts of the body as sent"""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [
+            (b'host', b'testserver'),
+            (b'authorization', f'Token {token}'.encode()),
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    # keep the connection of the test transaction, as the test client does
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    try:
+        async_to_sync(ASGIHandler())(scope, receive, send)
+    finally:
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+    start = messages[0]
+    parts = [message['body'].decode() for message in messages[1:]
+             if message.get('body')]
+    return start['status'], dict(start['headers']), parts
+
+
+class RecipeExportTests(TestCase):
+    """NDJSON and CSV export of the user's recipes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'export@example.com',
+            'pass@123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_export_ndjson(self):
+        """one object per line, newest first, only the user's recipes"""
+        old = create_recipe(self.user, title='Old', description='Slow')
+        old.tags.add(Tag.objects.create(user=self.user, name='Dinner'))
+        old.ingredients.add(
+            Ingredient.objects.create(user=self.user, name='Rice')
+        )
+        new = create_recipe(self.user, title='New')
+        other = get_user_model().objects.create_user('o@example.com', 'pw')
+        create_recipe(other, title='Other')
+
+        res = self.client.get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in content(res).splitlines()]
+        self.assertEqual([r['id'] for r in records], [new.id, old.id])
+        self.assertEqual(records[1]['description'], 'Slow')
+        self.assertEqual(records[1]['price'], '5.55')
+        self.assertEqual(records[1]['tags'], ['Dinner'])
+        self.assertEqual(records[1]['ingredients'], ['Rice'])
+
+    def test_export_csv(self):
+        """a header row and names as JSON lists"""
+        recipe = create_recipe(self.user, title='Curry, hot')
+        recipe.tags.add(Tag.objects.create(user=self.user, name='a,b'))
+
+        res = self.client.get(EXPORT_URL, {'type': 'csv'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'text/csv')
+        self.assertIn('recipes.csv', res['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(content(res))))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['title'], 'Curry, hot')
+        self.assertEqual(json.loads(rows[0]['tags']), ['a,b'])
+        self.assertEqual(json.loads(rows[0]['ingredients']), [])
+
+    def test_export_csv_empty(self):
+        """the header is sent when there is nothing to export"""
+        res = self.client.get(EXPORT_URL, {'type': 'csv'})
+
+        self.assertTrue(content(res).startswith('id,title,'))
+
+    def test_export_filters(self):
+        """the list filters apply to the export"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        tagged = create_recipe(self.user)
+        tagged.tags.add(tag)
+        create_recipe(self.user)
+
+        res = self.client.get(EXPORT_URL, {'tags': str(tag.id)})
+
+        records = [json.loads(line) for line in content(res).splitlines()]
+        self.assertEqual([r['id'] for r in records], [tagged.id])
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_queries_per_chunk(self):
+        """tags and ingredients cost two queries per chunk, not per row"""
+        for i in range(5):
+            recipe = create_recipe(self.user, title=f'Recipe {i}')
+            recipe.tags.add(
+                Tag.objects.create(user=self.user, name=f'Tag {i}')
+            )
+
+        res = self.client.get(EXPORT_URL)
+        with CaptureQueriesContext(connection) as ctx:
+            lines = content(res).splitlines()
+
+        self.assertEqual(len(lines), 5)
+        tag_queries = [q for q in ctx.captured_queries
+                       if 'FROM "core_recipe_tags"' in q['sql']]
+        self.assertEqual(len(tag_queries), 3)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_under_asgi(self):
+        """every chunk reaches an ASGI client as soon as it is read"""
+        recipes = [create_recipe(self.user, title=f'Recipe {i}')
+                   for i in range(5)]
+        token = Token.objects.create(user=self.user).key
+
+        status_code, headers, parts = asgi_get(EXPORT_URL, '', token)
+
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(headers[b'Content-Type'], b'application/x-ndjson')
+        # one part per chunk of two recipes
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(
+            [json.loads(line)['id'] for line in ''.join(parts).splitlines()],
+            [recipe.id for recipe in reversed(recipes)],
+        )
+        status_code, headers, parts = asgi_get(EXPORT_URL, 'type=csv', token)
+        self.assertIn(b'recipes.csv', headers[b'Content-Disposition'])
+        # the header row goes first, on its own
+        self.assertEqual(parts[0].strip(), ','.join(COLUMNS))
+        self.assertEqual(
+            len(list(csv.DictReader(io.StringIO(''.join(parts))))), 5
+        )
+
+    def test_export_invalid_type(self):
+        """only ndjson and csv are supported"""
+        res = self.client.get(EXPORT_URL, {'type': 'xml'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_requires_auth(self):
+        """anonymous users cannot export"""
+        res = APIClient().get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
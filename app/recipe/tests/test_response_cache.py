@@ -0,0 +1,145 @@
+"""
+Tests for the per user response cache
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.cache import response_cache_stats
+from core.models import Recipe, Tag
+
+RECIPE_URL = reverse('recipe:recipe-list')
+TAG_URL = reverse('recipe:tag-list')
+
+
+def detail_url(recipe_id):
+    """detail page url"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def create_recipe(user, **params):
+    """create recipe data"""
+    defaults = {
+        'title': 'Cached recipe',
+        'time_minutes': 5,
+        'price': Decimal('5.55'),
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class ResponseCacheTests(TestCase):
+    """cached reads are invalidated by writes"""
+
+    def setUp(self):
+        cache.clear()
+        response_cache_stats.reset()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'cache@example.com',
+            'pass@123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_second_read_is_served_from_cache(self):
+        """a repeated list is a cache hit without queries"""
+        create_recipe(user=self.user)
+        res = self.client.get(RECIPE_URL)
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(RECIPE_URL)
+
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached.data, res.data)
+        self.assertEqual(
+            response_cache_stats.snapshot(),
+            {'hits': 1, 'misses': 1},
+        )
+
+    def test_query_params_are_part_of_key(self):
+        """different query params are cached apart"""
+        self.client.get(RECIPE_URL)
+        res = self.client.get(RECIPE_URL, {'page_size': 1})
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+    def test_api_write_invalidates_list(self):
+        """creating a recipe shows up in the next list"""
+        self.client.get(RECIPE_URL)
+        payload = {
+            'title': 'New recipe',
+            'time_minutes': 5,
+            'price': Decimal('5.55'),
+        }
+        self.client.post(RECIPE_URL, payload)
+        res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_detail_invalidated_by_tag_change(self):
+        """renaming a tag invalidates recipes using it"""
+        recipe = create_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='Lunch')
+        recipe.tags.add(tag)
+        self.client.get(detail_url(recipe.id))
+
+        tag.name = 'Dinner'
+        tag.save()
+        res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['tags'][0]['name'], 'Dinner')
+
+    def test_link_change_invalidates(self):
+        """adding a tag to a recipe invalidates the tag list"""
+        recipe = create_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='Lunch')
+        self.client.get(TAG_URL, {'assigned_only': 1})
+
+        recipe.tags.add(tag)
+        res = self.client.get(TAG_URL, {'assigned_only': 1})
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_cache_is_per_user(self):
+        """users never see each other's cached responses"""
+        create_recipe(user=self.user)
+        self.client.get(RECIPE_URL)
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'pass@123',
+        )
+        self.client.force_authenticate(other)
+        res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['results'], [])
+
+    def test_other_user_write_keeps_cache(self):
+        """a write by another user does not invalidate"""
+        self.client.get(RECIPE_URL)
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'pass@123',
+        )
+        create_recipe(user=other)
+        res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(res['X-Cache'], 'HIT')
+
+    def test_error_responses_are_not_cached(self):
+        """missing recipes are not cached"""
+        self.client.get(detail_url(0))
+        res = self.client.get(detail_url(0))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response_cache_stats.snapshot()['misses'], 2)
@@ -7,7 +7,8 @@ from rest_framework.test import APIClient
 from rest_framework import status
 from django.urls import reverse
 from core.models import Tag, Recipe
-from recipe.serializers import TagSerializer
+from recipe.serializers import TagCountSerializer
+from django.db.models import Count
 from django.test import TestCase
 
 TAG_URL = reverse('recipe:tag-list')
@@ -47,10 +48,25 @@ class PrivateTagTestCase(TestCase):
 
         res = self.client.get(TAG_URL)
 
-        tags = Tag.objects.all().order_by('-name')
-        serializer = TagSerializer(tags, many=True)
+        tags = Tag.objects.annotate(
+            recipe_count=Count('recipe')
+        ).order_by('-name')
+        serializer = TagCountSerializer(tags, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
+
+    def test_tag_list_cursor_pagination(self):
+        """tags are paged by name with cursors"""
+        for name in ['a', 'b', 'c']:
+            Tag.objects.create(user=self.user, name=name)
+
+        res = self.client.get(TAG_URL, {'page_size': 2})
+        names = [t['name'] for t in res.data['results']]
+        res = self.client.get(res.data['next'])
+        names += [t['name'] for t in res.data['results']]
+
+        self.assertEqual(names, ['c', 'b', 'a'])
+        self.assertIsNone(res.data['next'])
 
     def test_tag_limit_user(self):
         """tag with limit user"""
@@ -60,9 +76,9 @@ class PrivateTagTestCase(TestCase):
         tag = Tag.objects.create(user=self.user, name="tag3")
         res = self.client.get(TAG_URL)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], tag.name)
-        self.assertEqual(res.data[0]['id'], tag.id)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], tag.name)
+        self.assertEqual(res.data['results'][0]['id'], tag.id)
 
     def test_update_tag_for_authenticated_user(self):
         """tag with limit user"""
@@ -76,6 +92,15 @@ class PrivateTagTestCase(TestCase):
         tag.refresh_from_db()
         self.assertEqual(tag.name, payload['name'])
 
+    def test_update_tag_to_existing_name(self):
+        """tag names are unique per user"""
+        Tag.objects.create(user=self.user, name="tag1")
+        tag = Tag.objects.create(user=self.user, name="tag2")
+        res = self.client.patch(patch_url(tag.id), {'name': 'tag1'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'tag2')
+
     def test_delete_tags(self):
         """detete tags details"""
         tag = Tag.objects.create(user=self.user, name="Tags")
@@ -95,10 +120,9 @@ class PrivateTagTestCase(TestCase):
         r1.tags.add(tag1)
         res = self.client.get(TAG_URL, {'assigned_only': 1})
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        s1 = TagSerializer(tag1)
-        s2 = TagSerializer(tag2)
-        self.assertIn(s1.data, res.data)
-        self.assertNotIn(s2.data, res.data)
+        ids = [t['id'] for t in res.data['results']]
+        self.assertIn(tag1.id, ids)
+        self.assertNotIn(tag2.id, ids)
 
     def test_filter_unique(self):
         """test filter unique ingredient"""
@@ -125,4 +149,22 @@ class PrivateTagTestCase(TestCase):
         res = self.client.get(TAG_URL, {'assigned_only': 1})
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
\ No newline at end of file
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_autocomplete_tags(self):
+        """tags autocomplete by prefix, most used first"""
+        dinner = Tag.objects.create(user=self.user, name='Dinner')
+        diet = Tag.objects.create(user=self.user, name='Diet')
+        Tag.objects.create(user=self.user, name='Breakfast')
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title='Soup',
+            price=Decimal('5.00'),
+            time_minutes=10
+        )
+        recipe.tags.add(diet)
+
+        res = self.client.get(TAG_URL, {'q': 'di'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([t['id'] for t in res.data], [diet.id, dinner.id])
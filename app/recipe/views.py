@@ -1,4 +1,6 @@
 """view set for recipe apis"""
+import os
+
 from drf_spectacular.utils import (
     extend_schema,
     extend_schema_view,
@@ -6,14 +8,50 @@ from drf_spectacular.utils import (
     OpenApiTypes
 )
 
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce, Collate, Upper
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.translation import gettext as _
 from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from core.asgi import AsyncStreamingHttpResponse
+from core.db.replicas import ReplicaReadMixin
+from core.images import FORMAT_EXTENSIONS
+from core.resize_cache import resize_cache
+from core.search import TrigramWordSimilarity
+from core.timing import ServerTimingMixin
 from core.models import Recipe, Tag, Ingredient
 from recipe import serializers
+from user.authentication import CachedTokenAuthentication
+from recipe.mixins import CachedResponseMixin, ConditionalGetMixin
+from recipe.export import CONTENT_TYPES, EXPORTERS, async_lines
+from recipe.filters import StableOrderingFilter
+from recipe.negotiation import IgnoreClientContentNegotiation
+from recipe.pagination import RecipeCursorPagination, NameCursorPagination
+
+SEARCH_CONFIG = 'english'
+SEARCH_RANK_SCALE = 1000000
+
 
 @extend_schema_view(
     list=extend_schema(
@@ -27,35 +65,110 @@ from recipe import serializers
                 'ingredients',
                 OpenApiTypes.STR,
                 description='Comma seprated list of ingredient IDs to filter'
+            ),
+            OpenApiParameter(
+                'match',
+                OpenApiTypes.STR, enum=['any', 'all'],
+                description='Match recipes having any (default) or all '
+                            'of the listed tags and ingredients'
+            ),
+            OpenApiParameter(
+                'search',
+                OpenApiTypes.STR,
+                description='Full text search in title and description, '
+                            'best matches first. Supports "quoted phrases", '
+                            'or and -excluded words'
             )
         ]
     )
 )
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin,
+                    ServerTimingMixin,
+                    ConditionalGetMixin,
+                    CachedResponseMixin,
+                    viewsets.ModelViewSet):
     """view for manage apis"""
     serializer_class = serializers.RecipeDetailSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipeCursorPagination
 
     def _params_to_ints(self, qs):
         """Convert a list of strings to integers."""
         return [int(str_id) for str_id in qs.split(',')]
 
+    def _filter_by_related(self, queryset, field_name, ids, match_all):
+        """Filter with EXISTS on the through table, no join and DISTINCT."""
+        field = Recipe._meta.get_field(field_name)
+        links = field.remote_field.through.objects.filter(
+            recipe_id=OuterRef('pk')
+        )
+        column = f'{field.m2m_reverse_field_name()}_id'
+        if match_all:
+            for related_id in set(ids):
+                queryset = queryset.filter(
+                    Exists(links.filter(**{column: related_id}))
+                )
+            return queryset
+
+        return queryset.filter(Exists(links.filter(**{f'{column}__in': ids})))
+
+    def _search(self, queryset, terms):
+        """Match the stored search vector, rank title over description"""
+        query = SearchQuery(
+            terms, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        # integer rank so cursor positions compare exactly
+        rank = Cast(
+            SearchRank(F('search_vector'), query) * SEARCH_RANK_SCALE,
+            IntegerField(),
+        )
+        return queryset.filter(search_vector=query).annotate(rank=rank)
+
     def get_queryset(self):
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
+        match = self.request.query_params.get('match', 'any')
+        if match not in ('any', 'all'):
+            raise ValidationError({'match': [_('Must be any or all.')]})
+
+        match_all = match == 'all'
         queryset = self.queryset
         if tags:
             tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            queryset = self._filter_by_related(
+                queryset, 'tags', tag_ids, match_all
+            )
         if ingredients:
             ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            queryset = self._filter_by_related(
+                queryset, 'ingredients', ingredient_ids, match_all
+            )
 
-        return queryset.filter(
+        search = self.request.query_params.get('search', '').strip()
+        if search and self.action == 'list':
+            queryset = self._search(queryset, search)
+
+        queryset = queryset.filter(
             user=self.request.user
-        ).order_by('-id').distinct()
+        ).order_by('-id')
+        if self.action in ('upload_image', 'resized_image', 'export'):
+            return queryset
+
+        return queryset.prefetch_related('tags', 'ingredients')
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.read_response(super().retrieve, request, *args, **kwargs)
+
+    def get_last_modified(self, request, *args, **kwargs):
+        """recipe modification time for the detail view"""
+        if self.action != 'retrieve':
+            return None
+        return Recipe.objects.filter(
+            user=request.user,
+            pk=kwargs['pk'],
+        ).values_list('updated_at', flat=True).first()
 
     def get_serializer_class(self):
 
@@ -63,6 +176,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'batch':
+            return serializers.RecipeBatchSerializer
 
         return self.serializer_class
 
@@ -70,6 +185,15 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """create recipe"""
         serializer.save(user=self.request.user)
 
+    @action(methods=['POST'], detail=False, url_path='batch')
+    def batch(self, request):
+        """Create, update and delete many recipes in one transaction"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save(user=request.user)
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         """Upload an image files"""
@@ -82,6 +206,131 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'width',
+                OpenApiTypes.INT,
+                enum=list(settings.RECIPE_IMAGE_RESIZE_WIDTHS),
+                required=True,
+            ),
+            OpenApiParameter(
+                'type',
+                OpenApiTypes.STR,
+                enum=list(FORMAT_EXTENSIONS),
+                description='Image format, webp (default) or jpeg',
+            ),
+            OpenApiParameter(
+                'v',
+                OpenApiTypes.STR,
+                description=(
+                    'Content key of the source image, the image file name '
+                    'without the extension. Versioned responses are '
+                    'immutable, a stale version is not found'
+                ),
+            ),
+        ],
+        responses={(200, 'image/*'): OpenApiTypes.BINARY},
+    )
+    @action(
+        methods=['GET'],
+        detail=True,
+        url_path='image',
+        content_negotiation_class=IgnoreClientContentNegotiation,
+    )
+    def resized_image(self, request, pk=None):
+        """Recipe image resized to one of the allowed widths"""
+        width = request.query_params.get('width', '')
+        fmt = request.query_params.get('type', 'webp')
+        errors = {}
+        if not width.isdigit() or \
+                int(width) not in settings.RECIPE_IMAGE_RESIZE_WIDTHS:
+            errors['width'] = [_('Must be one of %(widths)s.') % {
+                'widths': ', '.join(
+                    map(str, settings.RECIPE_IMAGE_RESIZE_WIDTHS)
+                ),
+            }]
+        if fmt not in FORMAT_EXTENSIONS:
+            errors['type'] = [_('Must be webp or jpeg.')]
+        if errors:
+            raise ValidationError(errors)
+
+        width = int(width)
+        image = self.get_object().image
+        if not image:
+            raise Http404
+        version = request.query_params.get('v')
+        if version is not None and version != resize_cache.key(image.name):
+            raise Http404
+        path = resize_cache.path(image.name, width, fmt)
+        etag = '"{}"'.format(os.path.relpath(path, resize_cache.root))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            image_file, hit = resize_cache.open(
+                image.name, image.storage, width, fmt
+            )
+            response = FileResponse(image_file, content_type=f'image/{fmt}')
+            response['X-Cache'] = 'HIT' if hit else 'MISS'
+        response['ETag'] = etag
+        if version is None:
+            patch_cache_control(
+                response, private=True, max_age=settings.RESIZE_CACHE_MAX_AGE
+            )
+        else:
+            # the url names the source content, so the render never changes
+            patch_cache_control(
+                response, private=True, max_age=31536000, immutable=True
+            )
+        return response
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'type',
+                OpenApiTypes.STR,
+                enum=list(EXPORTERS),
+                description='ndjson (default), one recipe per line, or csv',
+            ),
+            OpenApiParameter('tags', OpenApiTypes.STR),
+            OpenApiParameter('ingredients', OpenApiTypes.STR),
+            OpenApiParameter('match', OpenApiTypes.STR, enum=['any', 'all']),
+        ],
+        responses={
+            (200, 'application/x-ndjson'): OpenApiTypes.BINARY,
+            (200, 'text/csv'): OpenApiTypes.BINARY,
+        },
+    )
+    @action(
+        methods=['GET'],
+        detail=False,
+        url_path='export',
+        content_negotiation_class=IgnoreClientContentNegotiation,
+    )
+    def export(self, request):
+        """Stream every recipe of the user, newest first
+
+        Takes the same tags, ingredients and match filters as the list.
+        """
+        fmt = request.query_params.get('type', 'ndjson')
+        if fmt not in EXPORTERS:
+            raise ValidationError({'type': [_('Must be ndjson or csv.')]})
+
+        lines = EXPORTERS[fmt](self.get_queryset(), request)
+        filename = f'recipes.{fmt}'
+        if isinstance(request._request, ASGIRequest):
+            # the body is iterated on the event loop
+            response = AsyncStreamingHttpResponse(
+                async_lines(lines), content_type=CONTENT_TYPES[fmt],
+            )
+        else:
+            response = StreamingHttpResponse(
+                lines, content_type=CONTENT_TYPES[fmt],
+            )
+        response['Content-Disposition'] = \
+            f'attachment; filename="{filename}"'
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+
 @extend_schema_view(
     list=extend_schema(
         parameters=[
@@ -89,38 +338,162 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 'assigned_only',
                 OpenApiTypes.INT, enum=[0,1],
                 description='FIlter assigned by list'
+            ),
+            OpenApiParameter(
+                'q',
+                OpenApiTypes.STR,
+                description='Autocomplete by name prefix or fuzzy match. '
+                            'Returns an unpaginated list of the best '
+                            'matches, most used first among equal matches'
+            ),
+            OpenApiParameter(
+                'ordering',
+                OpenApiTypes.STR,
+                enum=['name', '-name', 'recipe_count', '-recipe_count'],
+                description='Sort by name (default -name) or by the '
+                            'number of recipes using the item'
+            ),
+            OpenApiParameter(
+                'limit',
+                OpenApiTypes.INT,
+                description='Number of autocomplete matches, default '
+                            f'{settings.AUTOCOMPLETE_LIMIT}'
             )
         ]
     )
 )
-class BaseRecipeAttrViewSet(mixins.DestroyModelMixin,
+class BaseRecipeAttrViewSet(ReplicaReadMixin,
+                            ServerTimingMixin,
+                            ConditionalGetMixin,
+                            CachedResponseMixin,
+                            mixins.DestroyModelMixin,
                             mixins.UpdateModelMixin,
                             mixins.ListModelMixin,
                             viewsets.GenericViewSet):
     """Base viewset for recipe attributes."""
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = NameCursorPagination
+    filter_backends = [StableOrderingFilter]
+    ordering_fields = ['name', 'recipe_count']
+    ordering = '-name'
+    recipe_field = None
+    count_serializer_class = None
+
+    @property
+    def autocomplete(self):
+        """the q param of an autocomplete list, '' otherwise"""
+        if self.action != 'list':
+            return ''
+        return self.request.query_params.get('q', '').strip()
+
+    @property
+    def paginator(self):
+        """autocomplete returns the top matches without pages"""
+        if self.autocomplete:
+            return None
+        return super().paginator
+
+    def _autocomplete_limit(self):
+        limit = self.request.query_params.get('limit', '')
+        if not limit:
+            return settings.AUTOCOMPLETE_LIMIT
+        if not limit.isdigit() or int(limit) < 1:
+            msg = _('Must be a positive integer.')
+            raise ValidationError({'limit': [msg]})
+        return min(int(limit), settings.AUTOCOMPLETE_MAX_LIMIT)
+
+    def _recipe_links(self):
+        """recipe links of the outer row, for EXISTS and counts"""
+        field = Recipe._meta.get_field(self.recipe_field)
+        column = f'{field.m2m_reverse_field_name()}_id'
+        return field.remote_field.through.objects.filter(
+            **{column: OuterRef('pk')}
+        ).order_by().values(column)
+
+    def _recipe_count(self):
+        """number of recipes using each row, a correlated count"""
+        counts = self._recipe_links().annotate(count=Count('*'))
+        return Coalesce(Subquery(counts.values('count')), Value(0))
+
+    def _autocomplete(self, queryset, q):
+        """top matches by prefix, then similarity, then usage
+
+        Prefix matches come from the (user, UPPER(name)) index in name
+        order. Fuzzy matches from the trigram index are only looked up
+        when there are too few prefix matches to fill the results, they
+        always rank below them. At most AUTOCOMPLETE_CANDIDATES rows of
+        each kind are ranked, so the cost does not grow with the number
+        of matching rows.
+        """
+        limit = self._autocomplete_limit()
+        candidates = settings.AUTOCOMPLETE_CANDIDATES
+        upper_name = Collate(Upper('name'), 'C')
+        prefix_ids = list(
+            queryset.annotate(upper_name=upper_name).filter(
+                upper_name__startswith=q.upper()
+            ).order_by('upper_name').values_list('pk', flat=True)[:candidates]
+        )
+        match = Q(pk__in=prefix_ids)
+        # shorter strings have too few trigrams to match fuzzily
+        if len(prefix_ids) < limit and len(q) >= 3:
+            fuzzy = queryset.filter(name__trigram_word_similar=q).exclude(
+                pk__in=prefix_ids
+            ).annotate(
+                similarity=TrigramWordSimilarity(q, 'name')
+            ).order_by('-similarity').values('pk')[:candidates]
+            match |= Q(pk__in=fuzzy)
+
+        return self.queryset.filter(match).annotate(
+            prefix=Case(
+                When(pk__in=prefix_ids, then=Value(1)),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            similarity=TrigramWordSimilarity(q, 'name'),
+            recipe_count=self._recipe_count(),
+        ).order_by('-prefix', '-similarity', '-recipe_count', 'name')[:limit]
 
     def get_queryset(self):
         """Filter queryset to authenticated user."""
         assigned_only = bool(
             int(self.request.query_params.get('assigned_only', 0))
         )
-        queryset = self.queryset
+        queryset = self.queryset.filter(user=self.request.user)
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            queryset = queryset.filter(Exists(self._recipe_links()))
 
-        return queryset.filter(
-            user=self.request.user
-        ).order_by('-name').distinct()
+        if self.autocomplete:
+            return self._autocomplete(queryset, self.autocomplete)
+        if self.action == 'list':
+            queryset = queryset.annotate(recipe_count=self._recipe_count())
+        return queryset.order_by('-name')
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return self.count_serializer_class
+        return self.serializer_class
+
+    def perform_update(self, serializer):
+        """update attribute, names are unique per user"""
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            msg = _('An item with this name already exists.')
+            raise ValidationError({'name': [msg]})
 
 
 class TagViewSet(BaseRecipeAttrViewSet):
     """Tag serializer with mixins models"""
     serializer_class = serializers.TagSerializer
+    count_serializer_class = serializers.TagCountSerializer
     queryset = Tag.objects.all()
+    recipe_field = 'tags'
 
 class IngredientViewSet(BaseRecipeAttrViewSet):
     """ingridient view set"""
     serializer_class = serializers.IngredientSerializer
+    count_serializer_class = serializers.IngredientCountSerializer
     queryset = Ingredient.objects.all()
+    recipe_field = 'ingredients'
@@ -0,0 +1,64 @@
+"""
+Authentication for the apis
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+def token_cache_key(key):
+    """cache key for a token, the raw token never goes to the cache"""
+    return f'auth-token-snapshot:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+# user fields kept in the cache, never the password hash
+SNAPSHOT_FIELDS = ['id', 'email', 'name', 'is_active', 'is_staff',
+                   'is_superuser']
+
+
+def invalidate_tokens(keys):
+    """drop cached lookups of the given token keys"""
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication caching the token to user lookup
+
+    A cache hit runs no query. The cache keeps a snapshot of the user
+    without the password hash, the user is built from it with the other
+    fields deferred. Entries are dropped when the token is deleted or its
+    user is saved, again once the write commits, so password changes and
+    deactivation apply at once.
+    """
+    cache_timeout = settings.AUTH_TOKEN_CACHE_TIMEOUT
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        snapshot = cache.get(cache_key)
+        if snapshot is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, {
+                name: getattr(user, name) for name in SNAPSHOT_FIELDS
+            }, self.cache_timeout)
+            return user, token
+
+        user_model = get_user_model()
+        # from_db takes the values in the order of the model fields
+        names = [
+            field.attname for field in user_model._meta.concrete_fields
+            if field.attname in snapshot
+        ]
+        user = user_model.from_db(
+            DEFAULT_DB_ALIAS, names, [snapshot[name] for name in names]
+        )
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return user, self.get_model()(key=key, user=user)
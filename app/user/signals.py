@@ -0,0 +1,33 @@
+"""
+Signal receivers keeping cached authentication fresh
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from user.authentication import invalidate_tokens
+
+
+def invalidate_keys(keys):
+    """drop cached lookups now and once the write commits"""
+    invalidate_tokens(keys)
+    # a request reading the old rows before the commit may cache them again
+    transaction.on_commit(lambda: invalidate_tokens(keys))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """a deleted token stops authenticating"""
+    invalidate_keys([instance.key])
+
+
+@receiver(post_save, sender=get_user_model())
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    """password, is_active or profile changes reload the user"""
+    if created:
+        return
+    invalidate_keys(
+        list(Token.objects.filter(user=instance).values_list('key', flat=True))
+    )
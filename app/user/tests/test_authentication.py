@@ -0,0 +1,120 @@
+"""
+Tests for cached token authentication
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from user.authentication import CachedTokenAuthentication, token_cache_key
+
+ME_URL = reverse('user:me')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """token lookups are cached and invalidated"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'auth@example.com',
+            'pass@12345',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.factory = APIRequestFactory()
+
+    def _authenticate(self, auth_class, key=None):
+        request = self.factory.get(
+            '/', HTTP_AUTHORIZATION=f'Token {key or self.token.key}'
+        )
+        return auth_class().authenticate(request)
+
+    def test_cache_hit_runs_no_queries(self):
+        """the second lookup of a token skips the database"""
+        with self.assertNumQueries(1):
+            user, _ = self._authenticate(CachedTokenAuthentication)
+        with self.assertNumQueries(0):
+            cached_user, token = self._authenticate(
+                CachedTokenAuthentication
+            )
+
+        self.assertEqual(user, self.user)
+        self.assertEqual(cached_user, self.user)
+        self.assertEqual(cached_user.email, self.user.email)
+        self.assertTrue(cached_user.is_authenticated)
+        self.assertEqual(token.key, self.token.key)
+
+    def test_cache_holds_no_password(self):
+        """the password hash never goes to the cache"""
+        self._authenticate(CachedTokenAuthentication)
+
+        snapshot = cache.get(token_cache_key(self.token.key))
+        self.assertNotIn('password', snapshot)
+        self.assertNotIn(self.user.password, snapshot.values())
+        self.assertEqual(snapshot['id'], self.user.pk)
+
+    def test_stock_class_queries_every_time(self):
+        """the stock class runs the lookup on every request"""
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self._authenticate(TokenAuthentication)
+
+    def test_api_request_with_cached_token(self):
+        """api requests authenticate from the cache"""
+        headers = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        self.client.get(ME_URL, **headers)
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL, **headers)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], self.user.email)
+
+    def test_deleted_token_is_rejected(self):
+        """deleting the token invalidates the cache"""
+        self._authenticate(CachedTokenAuthentication)
+        key = self.token.key
+        self.token.delete()
+
+        res = self.client.get(ME_URL, HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_rejected(self):
+        """deactivating the user invalidates the cache"""
+        self._authenticate(CachedTokenAuthentication)
+        self.user.is_active = False
+        self.user.save()
+
+        res = self.client.get(
+            ME_URL, HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalidated_again_on_commit(self):
+        """a lookup cached before the delete commits is dropped too"""
+        key = self.token.key
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+            # a concurrent request still seeing the token
+            cache.set(token_cache_key(key), {'id': self.user.pk})
+
+        self.assertIsNone(cache.get(token_cache_key(key)))
+
+    def test_password_change_reloads_user(self):
+        """a password change drops the cached user"""
+        self._authenticate(CachedTokenAuthentication)
+        self.user.set_password('new@12345')
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            user, _ = self._authenticate(CachedTokenAuthentication)
+        self.assertTrue(user.check_password('new@12345'))
+
+    def test_invalid_token_is_rejected(self):
+        """unknown tokens are rejected and not cached"""
+        res = self.client.get(ME_URL, HTTP_AUTHORIZATION='Token invalid')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
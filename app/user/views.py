@@ -1,11 +1,14 @@
 """Create api views for users"""
 
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
 from user.serializers import UserSerializer, UserTokenSerializer
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
+from user.authentication import CachedTokenAuthentication
+from core.db.replicas import ReplicaReadMixin
+from core.timing import ServerTimingMixin
 
-class UserAPIView(generics.CreateAPIView):
+class UserAPIView(ServerTimingMixin, generics.CreateAPIView):
     """api view"""
     serializer_class = UserSerializer
 
@@ -14,11 +17,13 @@ class UserAuthTokenView(ObtainAuthToken):
     serializer_class = UserTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
-class ManagerUserApiView(generics.RetrieveUpdateAPIView):
+class ManagerUserApiView(ReplicaReadMixin,
+                         ServerTimingMixin,
+                         generics.RetrieveUpdateAPIView):
     """manager user api view that retrive user profile"""
 
     serializer_class = UserSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):